@@ -0,0 +1,61 @@
+import sys
+import pathlib
+import resource
+import subprocess
+import time
+import numpy as np
+import pandas as pd
+
+# we're appending the backend and controller directories to our path so that we can import fetch easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "controller"))
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+from dbconnect import connect_to_database
+from models import Base, Stocks, BarMinute
+
+SYMBOL = "BENCH"
+ROWS = 10000000
+
+
+def seed(rows):
+    from helpers import bulk_load
+    engine = connect_to_database(get_engine_only=True)
+    Base.metadata.create_all(engine, tables=[Stocks.__table__, BarMinute.__table__])
+    ssn = connect_to_database()()
+    ssn.query(BarMinute).filter(BarMinute.ticker == SYMBOL).delete()
+    if ssn.get(Stocks, SYMBOL) is None:
+        ssn.add(Stocks(symbol=SYMBOL))
+    ssn.commit()
+    timestamps = pd.date_range("2000-01-03", periods=rows, freq="min")
+    # loaded a million rows at a time to keep the seeding itself out of the peak RSS
+    for start in range(0, rows, 1000000):
+        n = min(1000000, rows - start)
+        prices = np.random.default_rng(start).uniform(100, 200, n)
+        bulk_load(BarMinute, pd.DataFrame({
+            "ticker": SYMBOL,
+            "timestamp": timestamps[start:start + n],
+            "open": prices, "high": prices, "low": prices, "close": prices,
+            "volume": 100.0, "trade_count": 1, "vwap": prices,
+        }), ssn)
+        ssn.commit()
+
+
+def measure(output):
+    import fetch
+    began = time.perf_counter()
+    data = fetch.get_bars_min_by_symbol(SYMBOL, output=output)
+    elapsed = time.perf_counter() - began
+    rows = len(data) if output != "numpy" else len(data["timestamp"])
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{output:7s} {rows / elapsed:12.0f} rows/s   peak RSS {peak:8.0f} MB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure":
+        measure(sys.argv[2])
+        sys.exit()
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    seed(rows)
+    # every mode runs in its own process so that peak RSS is not shared between them
+    for output in ("dicts", "pandas", "numpy", "arrow"):
+        subprocess.run([sys.executable, __file__, "--measure", output], check=True)
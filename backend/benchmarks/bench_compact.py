@@ -0,0 +1,63 @@
+import sys
+import pathlib
+import time
+from sqlalchemy import text
+
+# we're appending the db directory to our path here so that we can import helpers easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+from dbconnect import connect_to_database
+from helpers import bulk_load
+from compact import encode
+from models import (Base, Stocks, Trades, Quotes, TickerIds, ConditionSets, TradesCompact,
+                    QuotesCompact)
+from bench_copy import make_trades, make_quotes
+
+ROWS = 1000000
+
+
+def table_size(ssn, mapper):
+    """
+    Returns (heap bytes, index bytes) of the mapper's table.
+    """
+    name = ssn.connection().dialect.identifier_preparer.format_table(mapper.__table__)
+    return ssn.execute(text("SELECT pg_table_size('{0}'), pg_indexes_size('{0}')".format(name))).one()
+
+
+def timed_load(engine, ssn, mapper, load):
+    ssn.execute(mapper.__table__.delete())
+    ssn.commit()
+    began = time.perf_counter()
+    load()
+    ssn.commit()
+    elapsed = time.perf_counter() - began
+    # sizes are only meaningful once dead tuples of earlier runs are gone
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM {}".format(
+            connection.dialect.identifier_preparer.format_table(mapper.__table__))))
+    return elapsed, table_size(ssn, mapper)
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    engine = connect_to_database(get_engine_only=True)
+    Base.metadata.create_all(engine, tables=[Stocks.__table__, Trades.__table__, Quotes.__table__,
+                                             TickerIds.__table__, ConditionSets.__table__,
+                                             TradesCompact.__table__, QuotesCompact.__table__])
+    ssn = connect_to_database()()
+    if ssn.get(Stocks, "AAPL") is None:
+        ssn.add(Stocks(symbol="AAPL"))
+        ssn.commit()
+
+    mb = 1024 * 1024
+    for mapper, model, df in [(Trades, TradesCompact, make_trades(rows)), (Quotes, QuotesCompact, make_quotes(rows))]:
+        row_time, (row_heap, row_index) = timed_load(engine, ssn, mapper, lambda: bulk_load(mapper, df, ssn))
+        compact_time, (compact_heap, compact_index) = timed_load(
+            engine, ssn, model, lambda: bulk_load(model, encode(mapper, df, ssn), ssn))
+        print(f"{mapper.__tablename__:7s} rows    {rows / row_time:10.0f} rows/s   "
+              f"table {row_heap / mb:7.1f} MB   indexes {row_index / mb:7.1f} MB")
+        print(f"{mapper.__tablename__:7s} compact {rows / compact_time:10.0f} rows/s   "
+              f"table {compact_heap / mb:7.1f} MB   indexes {compact_index / mb:7.1f} MB   "
+              f"({(row_heap + row_index) / (compact_heap + compact_index):.1f}x smaller)")
+        for target in (mapper, model):
+            ssn.execute(target.__table__.delete())
+        ssn.commit()
@@ -0,0 +1,70 @@
+import sys
+import pathlib
+import time
+import numpy as np
+import pandas as pd
+
+# we're appending the db directory to our path here so that we can import helpers easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+from dbconnect import connect_to_database
+from helpers import bulk_load
+from models import Base, Stocks, Trades, Quotes
+
+ROWS = 200000
+NY = 'America/New_York'
+
+
+def make_trades(n):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "ticker": "AAPL",
+        "timestamp": pd.date_range("2022-01-03 14:30", periods=n, freq="ms", tz="UTC").tz_convert(NY),
+        "exchange": rng.choice(["V", "Q", "N", "P"], n),
+        "price": rng.uniform(100, 200, n),
+        "size": rng.integers(1, 1000, n).astype(float),
+        "conditions": [["@", "I"]] * n,
+        "tape": "C",
+        "trade_id": np.arange(n),
+    })
+
+
+def make_quotes(n):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "ticker": "AAPL",
+        "timestamp": pd.date_range("2022-01-03 14:30", periods=n, freq="ms", tz="UTC").tz_convert(NY),
+        "ask_exchange": rng.choice(["V", "Q", "N", "P"], n),
+        "ask_price": rng.uniform(100, 200, n),
+        "ask_size": rng.integers(1, 10, n),
+        "bid_exchange": rng.choice(["V", "Q", "N", "P"], n),
+        "bid_price": rng.uniform(100, 200, n),
+        "bid_size": rng.integers(1, 10, n),
+        "conditions": [["R"]] * n,
+    })
+
+
+def timed(ssn, mapper, load):
+    ssn.execute(mapper.__table__.delete())
+    ssn.commit()
+    began = time.perf_counter()
+    load()
+    ssn.commit()
+    return time.perf_counter() - began
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    engine = connect_to_database(get_engine_only=True)
+    Base.metadata.create_all(engine, tables=[Stocks.__table__, Trades.__table__, Quotes.__table__])
+    ssn = connect_to_database()()
+    if ssn.get(Stocks, "AAPL") is None:
+        ssn.add(Stocks(symbol="AAPL"))
+        ssn.commit()
+
+    for mapper, df in [(Trades, make_trades(rows)), (Quotes, make_quotes(rows))]:
+        old = timed(ssn, mapper, lambda: ssn.bulk_insert_mappings(mapper, df.to_dict(orient="records")))
+        new = timed(ssn, mapper, lambda: bulk_load(mapper, df, ssn))
+        print(f"{mapper.__tablename__:7s} bulk_insert_mappings {rows / old:10.0f} rows/s   "
+              f"COPY {rows / new:10.0f} rows/s   ({old / new:.1f}x)")
+        ssn.execute(mapper.__table__.delete())
+        ssn.commit()
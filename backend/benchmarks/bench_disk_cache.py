@@ -0,0 +1,61 @@
+import sys
+import pathlib
+import tempfile
+import time
+import asyncio
+import pandas as pd
+
+# we're appending the db directory to our path here so that we can import api easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+import api
+import disk_cache
+from api import DataType, get_historic_data_base
+
+LATENCY = 0.05  # seconds per simulated HTTP round trip
+TRADES_PER_DAY = 2000
+
+
+class FakePagedRest:
+    """
+    Local stand-in for the paginated endpoint behind iterate_pages: one page of trades per
+    requested day, after a simulated round trip.
+    """
+
+    def __init__(self, latency=LATENCY):
+        self.latency = latency
+        self.calls = 0
+
+    def _get_historic_url(self, _type, symbol):
+        return symbol
+
+    async def _request(self, url, payload):
+        first = pd.Timestamp(payload["start"][:10], tz="UTC")
+        last = pd.Timestamp(payload["end"][:10], tz="UTC")
+        for day in pd.date_range(first, last, freq="D"):
+            self.calls += 1
+            await asyncio.sleep(self.latency)
+            stamps = day + pd.Timedelta(hours=14, minutes=30) + pd.to_timedelta(range(TRADES_PER_DAY), unit="s")
+            yield {"trades": [{"t": t.isoformat().replace("+00:00", "Z"), "x": "V", "p": 100.0, "s": 10,
+                               "c": ["@"], "i": i, "z": "C"} for i, t in enumerate(stamps)]}
+
+
+def run(symbols, start, end):
+    api.rest = FakePagedRest()
+    began = time.perf_counter()
+    data = asyncio.run(get_historic_data_base(symbols, DataType.Trades, start, end, cache=True, chunk="month"))
+    elapsed = time.perf_counter() - began
+    return elapsed, api.rest.calls, sum(len(df) for _, df in data)
+
+
+if __name__ == "__main__":
+    symbols = [f"SYM{i}" for i in range(int(sys.argv[1]) if len(sys.argv) > 1 else 20)]
+    with tempfile.TemporaryDirectory() as directory:
+        disk_cache.CACHE_DIR = directory
+        scenarios = [
+            ("cold cache, 2 months", "2022-01-01", "2022-03-01"),
+            ("warm cache, same range", "2022-01-01", "2022-03-01"),
+            ("warm cache, range extended", "2022-01-01", "2022-03-15"),
+        ]
+        for name, start, end in scenarios:
+            elapsed, calls, rows = run(symbols, start, end)
+            print(f"{name:28s} {elapsed:8.2f}s  {calls:6d} API calls  {rows / elapsed:12.0f} rows/s")
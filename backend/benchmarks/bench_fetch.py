@@ -0,0 +1,62 @@
+import sys
+import pathlib
+import time
+import asyncio
+import pandas as pd
+
+# we're appending the db directory to our path here so that we can import api easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+import api
+from api import DataType, get_historic_data_base
+
+LATENCY = 0.05  # seconds per simulated HTTP round trip
+
+
+class FakeAsyncRest:
+    """
+    Local stand-in for the paginated API of alpaca_trade_api.rest_async.AsyncRest that sleeps
+    instead of calling the network. Each request costs one round trip and returns one page per
+    calendar month of the requested range, with one trade per day, so a fetch that stops after
+    the first page misses rows.
+    """
+
+    def __init__(self, latency=LATENCY):
+        self.latency = latency
+        self.calls = 0
+
+    def _get_historic_url(self, _type, symbol):
+        return symbol
+
+    async def _request(self, url, payload):
+        days = pd.date_range(payload["start"][:10], payload["end"][:10], freq="D", tz="UTC")
+        for _, month in days.to_series().groupby([days.year, days.month]):
+            self.calls += 1
+            await asyncio.sleep(self.latency)
+            yield {"trades": [{"t": day.isoformat().replace("+00:00", "Z"), "x": "V", "p": 100.0, "s": 10,
+                               "c": ["@"], "i": i, "z": "C"} for i, day in enumerate(month)]}
+
+
+def run(symbols, start, end, **kwargs):
+    api.rest = FakeAsyncRest()
+    began = time.perf_counter()
+    results = asyncio.run(get_historic_data_base(symbols, DataType.Trades, start, end, cache=False, **kwargs))
+    elapsed = time.perf_counter() - began
+    rows = sum(len(data) for _, data in results)
+    return elapsed, api.rest.calls, rows
+
+
+if __name__ == "__main__":
+    symbols = [f"SYM{i}" for i in range(int(sys.argv[1]) if len(sys.argv) > 1 else 200)]
+    start, end = "2022-01-01", "2022-12-31"
+
+    scenarios = [
+        ("serial, unchunked (old loop)", dict(concurrency=1, chunk=None)),
+        ("pool of 50, unchunked", dict(concurrency=50, chunk=None)),
+        ("pool of 50, monthly chunks", dict(concurrency=50, chunk="month")),
+        ("pool of 200, monthly chunks", dict(concurrency=200, chunk="month")),
+    ]
+    expected = len(symbols) * len(pd.date_range(start, end, freq="D"))
+    for name, kwargs in scenarios:
+        elapsed, calls, rows = run(symbols, start, end, **kwargs)
+        print(f"{name:32s} {elapsed:8.2f}s  {calls / elapsed:10.1f} req/s  {rows}/{expected} rows")
+        assert rows == expected, "pages were dropped"
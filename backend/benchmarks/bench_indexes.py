@@ -0,0 +1,112 @@
+import sys
+import pathlib
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select, text
+
+# we're appending the db directory to our path here so that we can import helpers easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+from dbconnect import connect_to_database
+from helpers import bulk_load
+from db_migrate import create_missing_indexes
+from models import Base, Stocks, BarMinute, Trades, Quotes
+from bench_copy import make_trades, make_quotes
+
+ROWS = 1000000
+SYMBOLS = 100
+LATEST = 100
+NY = 'America/New_York'
+# plan nodes that read a range of an index rather than the whole table
+RANGE_SCANS = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+def make_minute_bars(n, names):
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range("2022-01-03 09:30", periods=n // len(names), freq="min", tz=NY)
+    close = rng.uniform(100, 200, len(timestamps) * len(names))
+    return pd.DataFrame({
+        "ticker": np.tile(names, len(timestamps)), "timestamp": timestamps.repeat(len(names)),
+        "open": close, "high": close + 1, "low": close - 1, "close": close,
+        "volume": rng.integers(1, 1000, len(close)).astype(float),
+        "trade_count": rng.integers(1, 50, len(close)), "vwap": close})
+
+
+def plan_nodes(plan):
+    """
+    Yields (node type, index name) of every node of an EXPLAIN (FORMAT JSON) plan.
+    """
+    yield plan["Node Type"], plan.get("Index Name")
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def explain(connection, query):
+    compiled = query.compile(dialect=connection.dialect)
+    result = connection.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + str(compiled),
+                                        compiled.params).scalar()
+    return result[0]
+
+
+def index_sizes(connection, mapper):
+    name = connection.dialect.identifier_preparer.format_table(mapper.__table__)
+    return connection.execute(text("SELECT c.relname, pg_relation_size(c.oid) FROM pg_index i "
+                                   "JOIN pg_class c ON c.oid = i.indexrelid WHERE i.indrelid = to_regclass(:name) "
+                                   "ORDER BY c.relname"), {"name": name}).all()
+
+
+def queries(ssn, mapper, columns, symbol):
+    first, last = ssn.execute(select(func.min(mapper.timestamp), func.max(mapper.timestamp))).one()
+    window = (first + (last - first) / 2, first + (last - first) / 2 + (last - first) / 20)
+    return [
+        ("latest N", select(mapper).where(mapper.ticker == symbol)
+         .order_by(mapper.timestamp.desc()).limit(LATEST)),
+        ("latest N, covered", select(*columns).where(mapper.ticker == symbol)
+         .order_by(mapper.timestamp.desc()).limit(LATEST)),
+        ("window per ticker", select(mapper).where(mapper.ticker == symbol, mapper.timestamp >= window[0],
+                                                   mapper.timestamp < window[1]).order_by(mapper.timestamp)),
+        ("window, all tickers", select(func.count()).select_from(mapper).where(mapper.timestamp >= window[0],
+                                                                             mapper.timestamp < window[1])),
+    ]
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    engine = connect_to_database(get_engine_only=True)
+    Base.metadata.create_all(engine, tables=[Stocks.__table__, BarMinute.__table__, Trades.__table__,
+                                             Quotes.__table__])
+    # tables created before the index layout get it here
+    create_missing_indexes(engine, tables=[BarMinute.__table__, Trades.__table__, Quotes.__table__])
+    ssn = connect_to_database()()
+    names = ["S{:04d}".format(i) for i in range(SYMBOLS)]
+    for name in names:
+        if ssn.get(Stocks, name) is None:
+            ssn.add(Stocks(symbol=name))
+    ssn.commit()
+
+    rng = np.random.default_rng(1)
+    tables = [
+        (BarMinute, make_minute_bars(rows, names), [BarMinute.timestamp, BarMinute.close]),
+        (Trades, make_trades(rows).assign(ticker=rng.choice(names, rows)), [Trades.timestamp, Trades.price, Trades.size]),
+        (Quotes, make_quotes(rows).assign(ticker=rng.choice(names, rows)), [Quotes.timestamp]),
+    ]
+    failed = 0
+    for mapper, df, columns in tables:
+        ssn.execute(mapper.__table__.delete())
+        bulk_load(mapper, df, ssn)
+        ssn.commit()
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            # statistics for the planner and the visibility map for index-only scans
+            connection.execute(text("VACUUM ANALYZE {}".format(
+                connection.dialect.identifier_preparer.format_table(mapper.__table__))))
+            print(f"{mapper.__tablename__}: {len(df)} rows, indexes "
+                  + ", ".join(f"{name} {size / 1024:.0f} kB" for name, size in index_sizes(connection, mapper)))
+            for label, query in queries(ssn, mapper, columns, names[0]):
+                plan = explain(connection, query)
+                nodes = list(plan_nodes(plan["Plan"]))
+                ok = any(node in RANGE_SCANS for node, _ in nodes) and all(node != "Seq Scan" for node, _ in nodes)
+                failed += not ok
+                scans = ", ".join(f"{node} on {index}" if index else node for node, index in nodes if "Scan" in node)
+                print(f"  {label:20s} {plan['Execution Time']:8.2f} ms   {'ok  ' if ok else 'FAIL'} {scans}")
+        ssn.execute(mapper.__table__.delete())
+        ssn.commit()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,51 @@
+import sys
+import pathlib
+import time
+import pandas as pd
+
+# we're appending the db directory to our path here so that we can import populate_hist easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+from alpaca_trade_api.entity_v2 import TradesV2
+from populate_hist import normalize_batch, NY, TRADE_KEY
+
+
+def make_pages(symbols, rows):
+    """
+    Raw trade pages as sent by the API, one page of ``rows`` records per symbol.
+    """
+    opened = pd.Timestamp("2022-01-03 14:30", tz="UTC")
+    stamps = [(opened + pd.Timedelta(microseconds=137 * i)).isoformat().replace("+00:00", "Z") for i in range(rows)]
+    return [(f"SYM{s}", [{"t": stamps[i], "x": "V", "p": 100.0 + i % 7, "s": 10, "c": ["@"], "i": i, "z": "C"}
+                         for i in range(rows)]) for s in range(symbols)]
+
+
+def normalize_page(symbol, data_df):
+    """
+    The per-page normalization populate_hist ran before normalize_batch, kept as the baseline.
+    """
+    data_df["ticker"] = symbol
+    data_df.reset_index(inplace=True)
+    data_df.rename(columns={"id": "trade_id"}, inplace=True)
+    data_df = data_df.drop_duplicates(subset=TRADE_KEY)
+    data_df['timestamp'] = data_df['timestamp'].dt.tz_convert(NY)
+    return data_df
+
+
+def per_page(pages):
+    return pd.concat([normalize_page(symbol, TradesV2(records).df) for symbol, records in pages])
+
+
+def batched(pages):
+    return normalize_batch(pages, "trades")
+
+
+if __name__ == "__main__":
+    for symbols, rows in [(5000, 20), (500, 200), (10, 10000)]:
+        pages = make_pages(symbols, rows)
+        timings = []
+        for normalize in (per_page, batched):
+            began = time.perf_counter()
+            df = normalize(pages)
+            timings.append(time.perf_counter() - began)
+        print(f"{symbols:5d} symbols x {rows:5d} trades  per page {timings[0]:7.2f}s  "
+              f"batched {timings[1]:7.2f}s  ({timings[0] / timings[1]:5.1f}x, {len(df)} rows)")
@@ -0,0 +1,72 @@
+import sys
+import pathlib
+import time
+import asyncio
+import os
+import pandas as pd
+
+# we're appending the db directory to our path here so that we can import parallel_backfill easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+import api
+from dbconnect import connect_to_database
+from models import Base, Stocks, Trades, Crons
+from parallel_backfill import run_parallel_backfill
+
+SYMBOLS = 16
+DAYS = 5
+TRADES_PER_PAGE = 10000
+PAGES_PER_DAY = 2
+LATENCY = 0.02  # seconds per simulated HTTP round trip
+
+
+class FakePagedRest:
+    """
+    Local stand-in for the paginated trades endpoint: PAGES_PER_DAY full pages per requested day.
+    Pages are decoded, normalized and written for real, only the network is simulated.
+    """
+
+    def _get_historic_url(self, _type, symbol):
+        return symbol
+
+    async def _request(self, url, payload):
+        first = pd.Timestamp(payload["start"][:10], tz="UTC")
+        last = pd.Timestamp(payload["end"][:10], tz="UTC")
+        for day in pd.date_range(first, last, freq="D", inclusive="left" if len(payload["end"]) == 10 else "both"):
+            for page in range(PAGES_PER_DAY):
+                await asyncio.sleep(LATENCY)
+                opened = day + pd.Timedelta(hours=14, minutes=30, seconds=page * TRADES_PER_PAGE)
+                yield {"trades": [{"t": (opened + pd.Timedelta(seconds=i)).isoformat().replace("+00:00", "Z"),
+                                   "x": "V", "p": 100.0 + i % 7, "s": 10, "c": ["@"], "i": page * TRADES_PER_PAGE + i,
+                                   "z": "C"} for i in range(TRADES_PER_PAGE)]}
+
+
+def use_fake_source():
+    api.rest = FakePagedRest()
+
+
+def reset(ssn):
+    ssn.execute(Trades.__table__.delete())
+    ssn.execute(Crons.__table__.delete())
+    ssn.commit()
+
+
+if __name__ == "__main__":
+    processes = [int(p) for p in sys.argv[1:]] or sorted({1, os.cpu_count() or 1})
+    symbols = [f"SYM{i}" for i in range(SYMBOLS)]
+    engine = connect_to_database(get_engine_only=True)
+    Base.metadata.create_all(engine, tables=[Stocks.__table__, Trades.__table__, Crons.__table__])
+    ssn = connect_to_database()()
+    missing = [{"symbol": s} for s in symbols if ssn.get(Stocks, s) is None]
+    if missing:
+        ssn.execute(Stocks.__table__.insert(), missing)
+        ssn.commit()
+
+    for count in processes:
+        reset(ssn)
+        began = time.perf_counter()
+        result = run_parallel_backfill(symbols, "2022-01-03", f"2022-01-{3 + DAYS:02d}", typ="trades",
+                                       processes=count, chunk="day", report_interval=60,
+                                       initializer=use_fake_source)
+        elapsed = time.perf_counter() - began
+        print(f"{count:3d} processes  {elapsed:8.2f}s  {result['rows'] / elapsed:10.0f} rows/s  "
+              f"{result['completed']} units, {len(result['failed'])} failed")
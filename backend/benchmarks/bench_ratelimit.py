@@ -0,0 +1,76 @@
+import sys
+import pathlib
+import time
+import asyncio
+from collections import deque
+from aiohttp import web
+
+# we're appending the db directory to our path here so that we can import ratelimit easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+from ratelimit import RateLimitedRest, TokenBucket
+
+# scaled down quota so that a run takes seconds: 100 requests per 5 second window
+QUOTA = 100
+PERIOD = 5.0
+REQUESTS = 400
+
+
+class StubServer:
+    """
+    Local stand-in for the Alpaca data API that enforces a sliding-window quota
+    and answers with 429 and X-RateLimit-* headers once it is exceeded.
+    """
+
+    def __init__(self, quota=QUOTA, period=PERIOD):
+        self.quota = quota
+        self.period = period
+        self.served = deque()
+        self.rejected = 0
+        self.max_in_window = 0
+
+    async def handle(self, request):
+        now = time.time()
+        while self.served and self.served[0] <= now - self.period:
+            self.served.popleft()
+        headers = {
+            "X-RateLimit-Limit": str(self.quota),
+            "X-RateLimit-Remaining": str(max(0, self.quota - len(self.served) - 1)),
+            "X-RateLimit-Reset": str(self.served[0] + self.period if self.served else now + self.period),
+        }
+        if len(self.served) >= self.quota:
+            self.rejected += 1
+            return web.json_response({"message": "too many requests."}, status=429, headers=headers)
+        self.served.append(now)
+        self.max_in_window = max(self.max_in_window, len(self.served))
+        bar = {"t": "2022-01-03T14:30:00Z", "o": 1, "h": 1, "l": 1, "c": 1, "v": 1, "n": 1, "vw": 1}
+        return web.json_response({"bars": [bar], "next_page_token": None}, headers=headers)
+
+
+async def run(limiter):
+    server = StubServer()
+    app = web.Application()
+    app.router.add_get("/v2/stocks/{symbol}/bars", server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    rest = RateLimitedRest(key_id="stub", secret_key="stub", data_url=f"http://127.0.0.1:{port}",
+                           limiter=limiter, max_retries=20)
+    began = time.perf_counter()
+    results = await asyncio.gather(*[rest.get_bars_async(f"SYM{i}", "2022-01-03", "2022-01-04", "1Min")
+                                     for i in range(REQUESTS)], return_exceptions=True)
+    elapsed = time.perf_counter() - began
+    await runner.cleanup()
+
+    failed = sum(isinstance(r, Exception) for r in results)
+    print(f"{REQUESTS} requests in {elapsed:.2f}s = {REQUESTS / elapsed * PERIOD:.1f} per window "
+          f"(quota {QUOTA}), max in window {server.max_in_window}, 429s {server.rejected}, failed {failed}")
+
+
+if __name__ == "__main__":
+    print("token bucket sized to the quota:")
+    asyncio.run(run(TokenBucket(limit=QUOTA, burst=5, period=PERIOD)))
+    print("bucket sized 10x too large, relying on headers and backoff:")
+    asyncio.run(run(TokenBucket(limit=QUOTA * 10, burst=50, period=PERIOD)))
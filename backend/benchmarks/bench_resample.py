@@ -0,0 +1,49 @@
+import sys
+import pathlib
+import time
+import numpy as np
+import pandas as pd
+from alpaca_trade_api.rest import TimeFrame
+
+# we're appending the db directory to our path here so that we can import resample easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+from resample import resample_bars, BarResampler
+
+SYMBOLS = 100
+DAYS = 10
+NY = 'America/New_York'
+
+
+def make_minute_bars(symbols, days):
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range("2022-01-03 04:00", periods=days * 16 * 60, freq="min", tz=NY)
+    n = len(timestamps)
+    frames = []
+    for i in range(symbols):
+        close = 100 + rng.standard_normal(n).cumsum()
+        frames.append(pd.DataFrame({
+            "ticker": "S{:04d}".format(i), "timestamp": timestamps, "open": close, "high": close + 1,
+            "low": close - 1, "close": close, "volume": rng.integers(1, 1000, n).astype(float),
+            "trade_count": rng.integers(1, 50, n), "vwap": close}))
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == "__main__":
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else SYMBOLS
+    minutes = make_minute_bars(symbols, DAYS)
+    rows = len(minutes)
+    for timeframe in (TimeFrame.Hour, TimeFrame.Day):
+        began = time.perf_counter()
+        bars = resample_bars(minutes, timeframe)
+        elapsed = time.perf_counter() - began
+        print(f"resample_bars {timeframe.value:6s} {rows} minute bars -> {len(bars):6d} bars   "
+              f"{rows / elapsed:10.0f} minute bars/s")
+
+    stream = list(minutes.assign(timestamp=minutes["timestamp"].dt.tz_convert("UTC").dt.as_unit("ns")
+                                 .astype("int64")).itertuples(index=False, name=None))
+    resampler = BarResampler()
+    began = time.perf_counter()
+    for bar in stream:
+        resampler.update(bar)
+    elapsed = time.perf_counter() - began
+    print(f"BarResampler  {rows} minute bars, hour and day   {rows / elapsed:10.0f} minute bars/s")
@@ -0,0 +1,40 @@
+import sys
+import pathlib
+import time
+import tracemalloc
+import numpy as np
+
+# we're appending the db directory to our path here so that we can import trade_bars easily
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+from trade_bars import TradeBarAggregator, MINUTE_NS
+
+SYMBOLS = 10000
+TRADES = 1000000
+START = 1641220200 * 10**9
+
+
+if __name__ == "__main__":
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else SYMBOLS
+    names = ["S{:05d}".format(i) for i in range(symbols)]
+
+    tracemalloc.start()
+    aggregator = TradeBarAggregator()
+    for name in names:
+        aggregator.add(name, START, 100.0, 1.0)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"state of {symbols} symbols: {memory / 1e6:.1f} MB, symbol names and index included")
+
+    rng = np.random.default_rng(0)
+    trades = list(zip(rng.choice(names, TRADES).tolist(),
+                      (START + np.sort(rng.integers(0, MINUTE_NS, TRADES))).tolist(),
+                      rng.uniform(100, 200, TRADES).tolist(), rng.integers(1, 1000, TRADES).astype(float).tolist()))
+    began = time.perf_counter()
+    for trade in trades:
+        aggregator.add(*trade)
+    elapsed = time.perf_counter() - began
+    print(f"add   {TRADES / elapsed:10.0f} trades/s")
+
+    began = time.perf_counter()
+    bars = aggregator.flush(START + 2 * MINUTE_NS)
+    print(f"flush {len(bars)} bars in {(time.perf_counter() - began) * 1000:.1f} ms")
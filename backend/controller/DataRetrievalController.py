@@ -2,8 +2,25 @@ import sys
 import pathlib
 import json
 from typing import List
+import pandas as pd
+from sqlalchemy import func, inspect, select, true, tuple_
+from sqlalchemy.dialects.postgresql import array
 from sqlalchemy.orm import Session
-from db.dbconnect import connect_to_database
+
+# the db modules import each other by their flat names; they are imported the same way here so
+# that the controller shares their engine, models and caches instead of loading a second copy
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "db"))
+from dbconnect import connect_to_database
+import latest_cache
+from query_cache import query_cache, make_key
+from compact import compact_model, decode, ticker_ids, to_ns
+
+
+def _plain(df):
+    """
+    Returns the rows of a DataFrame as a list of dicts, with missing values as None.
+    """
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
 
 
 class DataRetrievalController:
@@ -17,60 +34,283 @@ class DataRetrievalController:
         """
         self.session = connect_to_database()
 
-    def query_data(self, mapper, parameter_val=None, parameter="id"):
+    def _build_query(self, session, mapper, parameter_val=None, parameter="id", start=None, end=None,
+                     columns=None, limit=None, after=None):
+        """
+        Builds the query behind query_data, with every filter, the projection and the limit in SQL.
+        """
+        keys = columns or [attr.key for attr in inspect(mapper).column_attrs]
+        query = session.query(*[getattr(mapper, key).label(key) for key in keys])
+
+        if type(parameter_val) == str:
+            query = query.filter(getattr(mapper, parameter) == parameter_val)
+        elif type(parameter_val) == list:
+            query = query.filter(getattr(mapper, parameter).in_(parameter_val))
+        elif parameter_val is not None:
+            raise ValueError("Enter valid parameter value. List is valid type.")
+
+        if start is not None or end is not None or after is not None or limit is not None:
+            if not hasattr(mapper, "timestamp"):
+                raise ValueError("{} has no timestamp to filter or paginate on".format(mapper.__name__))
+            if start is not None:
+                query = query.filter(mapper.timestamp >= start)
+            if end is not None:
+                query = query.filter(mapper.timestamp < end)
+            if after is not None:
+                # keyset pagination: resume right after the last (ticker, timestamp) returned
+                query = query.filter(tuple_(mapper.ticker, mapper.timestamp) > tuple_(*after))
+            query = query.order_by(mapper.ticker, mapper.timestamp)
+            if limit is not None:
+                query = query.limit(limit)
+        return query
+
+    def _compact_query(self, session, model, parameter_val=None, parameter="ticker", start=None, end=None,
+                       columns=None, limit=None, after=None):
+        """
+        Builds the query behind query_data on a compact model, with the symbols and timestamps of
+        the filters translated to ticker ids and ns since the epoch. Rows are ordered by ticker id.
+        """
+        if parameter_val is not None:
+            if parameter != "ticker":
+                raise ValueError("{} can only be filtered on ticker".format(model.__tablename__))
+            symbols = [parameter_val] if type(parameter_val) == str else parameter_val
+            parameter_val = list(ticker_ids(symbols, session).values())
+        if after is not None:
+            after = (ticker_ids([after[0]], session).get(after[0], -1), to_ns(after[1]))
+        return self._build_query(session, model, parameter_val, parameter, to_ns(start), to_ns(end),
+                                 columns, limit, after)
+
+    def _decoded(self, session, model, query, batch_size=None):
+        """
+        Runs a query on a compact model and yields its rows decoded, as DataFrames of at most
+        batch_size rows (all of them at once by default).
+        """
+        keys = [c["name"] for c in query.column_descriptions]
+        result = session.connection().execution_options(stream_results=True).execute(query.statement)
+        for rows in result.partitions(batch_size):
+            yield decode(model, pd.DataFrame.from_records(rows, columns=keys, coerce_float=True), session)
+
+    def query_data(self, mapper, parameter_val=None, parameter="id", start=None, end=None,
+                   columns=None, limit=None, after=None, use_cache=True):
         """
         Queries data from the database using the given mapper, parameter value, and parameter name.
 
+        Time range, projection, limit and pagination are all applied in SQL, and rows are read
+        as plain tuples rather than ORM objects. Results are kept in the process-wide query cache
+        (see db/query_cache.py) until they expire or a write to one of their tickers drops them.
+
         Args:
             mapper: The mapper object for the type of data to retrieve.
             parameter_val: The value of the parameter to filter on.
             parameter: The name of the parameter to filter on.
+            start: Only return rows with a timestamp at or after this time.
+            end: Only return rows with a timestamp before this time.
+            columns (list): The attributes to return. Defaults to all of them.
+            limit (int): The maximum number of rows to return, ordered by (ticker, timestamp).
+            after (tuple): (ticker, timestamp) of the last row of the previous page.
+            use_cache (bool): Whether to answer from, and fill, the query cache.
+
+        With DB_COMPACT_SCHEMA enabled, Trades and Quotes are read from their compact model and
+        decoded (see db/compact.py); pages are then ordered by ticker id rather than by symbol.
 
         Returns:
-            res (list): A list of dictionary representations of the retrieved data.
+            res (list): A list of dictionary representations of the retrieved data. Rows served from
+                the cache are shared between callers and should not be modified.
         """
-        session = self.session()
-        if type(parameter_val) == str:
-            q_res = session.query(mapper).filter(getattr(mapper, parameter) == parameter_val).all()
-            res = [q.toDict() for q in q_res]
-            return res
-        elif type(parameter_val) == list:
-            prm = getattr(mapper, parameter)
-            q_res = session.query(mapper).filter(prm.in_(parameter_val)).all()
-            res = [q.toDict() for q in q_res]
-            return res
-        elif parameter_val == None:
-            q_res = session.query(mapper).all()
-            res = [q.toDict() for q in q_res]
-            return res
-        else:
+        if parameter_val is not None and type(parameter_val) not in (str, list):
             print("Enter valid parameter value. List is valid type.")
+            return None
+        if use_cache:
+            key = make_key(mapper.__tablename__, parameter, parameter_val, start, end, columns, limit, after)
+            res = query_cache.get(key)
+            if res is not None:
+                return list(res)
+        model = compact_model(mapper)
+        with self.session() as session:
+            if model is not None:
+                query = self._compact_query(session, model, parameter_val, parameter, start, end,
+                                            columns, limit, after)
+                res = [row for df in self._decoded(session, model, query) for row in _plain(df)]
+            else:
+                query = self._build_query(session, mapper, parameter_val, parameter, start, end,
+                                          columns, limit, after)
+                res = [row._asdict() for row in query]
+        if use_cache:
+            query_cache.put(key, res)
+        return list(res)
 
-    def get_latest_series(self, mapper, parameter_val=None, parameter="id"):
+    def stream_data(self, mapper, parameter_val=None, parameter="id", start=None, end=None,
+                    columns=None, page_size=10000):
         """
-        Gets the latest series data from the database using the given mapper, parameter value, and parameter name.
+        Streams the rows of query_data through a server-side cursor instead of loading them all.
+
+        Takes the same arguments as query_data except limit and after. Rows are fetched from the
+        database ``page_size`` at a time, so memory stays constant however many rows match.
+
+        Yields:
+            dict: One dictionary per row, ordered by (ticker, timestamp) for time-series models.
+        """
+        model = compact_model(mapper)
+        with self.session() as session:
+            if model is not None:
+                query = self._compact_query(session, model, parameter_val, parameter, start, end, columns)
+                query = query.order_by(model.ticker, model.timestamp)
+                for df in self._decoded(session, model, query, page_size):
+                    yield from _plain(df)
+                return
+            query = self._build_query(session, mapper, parameter_val, parameter, start, end, columns)
+            if hasattr(mapper, "timestamp"):
+                query = query.order_by(mapper.ticker, mapper.timestamp)
+            for row in query.yield_per(page_size):
+                yield row._asdict()
+
+    def query_columns(self, mapper, parameter_val=None, parameter="id", start=None, end=None,
+                      columns=None, limit=None, after=None, output="pandas", batch_size=100000):
+        """
+        Runs query_data as a Core select and returns the result in columnar form.
+
+        Rows are read from a server-side cursor ``batch_size`` at a time and each batch is turned
+        into columns right away, so neither ORM entities nor per-row dicts are ever built.
 
         Args:
-            mapper: The mapper object for the type of data to retrieve.
-            parameter_val: The value of the parameter to filter on.
-            parameter: The name of the parameter to filter on.
+            Same as query_data, plus:
+            output (str): "pandas" for a DataFrame, "numpy" for a dict of column arrays or
+                "arrow" for a pyarrow Table (requires pyarrow).
+            batch_size (int): Number of rows fetched from the cursor at a time.
 
         Returns:
-            res (dict): A dictionary representation of the latest series data for the given parameters.
+            DataFrame, dict or pyarrow.Table: The retrieved data, one column per attribute.
         """
-        session = self.session()
-        if type(parameter_val) == str:
-            q_res = session.query(mapper).filter(getattr(mapper, parameter) == parameter_val).order_by(mapper.date.desc()).first()
-            res = q_res.toDict()
-            return res
-        elif type(parameter_val) == list:
-            prm = getattr(mapper, parameter)
-            q_res = session.query(mapper).filter(prm.in_(parameter_val)).order_by(mapper.date.desc()).first()
-            res = q_res.toDict()
-            return res
-        elif parameter_val == None:
-            q_res = session.query(mapper).order_by(mapper.date.desc()).first()
-            res = q_res.toDict()
-            return res
-        else:
+        if output not in ("pandas", "numpy", "arrow"):
+            raise ValueError("Enter a valid input for output parameter valid inputs are [pandas,numpy,arrow]")
+        if output == "arrow":
+            try:
+                import pyarrow as pa
+            except ImportError:
+                raise ImportError("pyarrow is required for output='arrow'")
+
+        model = compact_model(mapper)
+        with self.session() as session:
+            if model is not None:
+                query = self._compact_query(session, model, parameter_val, parameter, start, end,
+                                            columns, limit, after)
+                keys = [c["name"] for c in query.column_descriptions]
+                frames = list(self._decoded(session, model, query, batch_size))
+            else:
+                query = self._build_query(session, mapper, parameter_val, parameter, start, end,
+                                          columns, limit, after)
+                keys = [c["name"] for c in query.column_descriptions]
+                result = session.connection().execution_options(stream_results=True).execute(query.statement)
+                frames = [pd.DataFrame.from_records(rows, columns=keys, coerce_float=True)
+                          for rows in result.partitions(batch_size)]
+
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=keys)
+        if output == "numpy":
+            return {key: df[key].to_numpy() for key in keys}
+        if output == "arrow":
+            return pa.Table.from_pandas(df, preserve_index=False)
+        return df
+
+    def query_pages(self, mapper, parameter_val=None, parameter="ticker", start=None, end=None,
+                    columns=None, page_size=10000):
+        """
+        Pages through a time-series query with keyset pagination on (ticker, timestamp).
+
+        Unlike OFFSET, each page is an index range scan starting right after the previous page,
+        and every page runs in its own short session. Takes the same arguments as query_data.
+
+        Yields:
+            list: A list of dictionaries per page, at most page_size long.
+        """
+        if columns is not None:
+            columns = list(columns) + [key for key in ("ticker", "timestamp") if key not in columns]
+        after = None
+        while True:
+            page = self.query_data(mapper, parameter_val, parameter, start, end, columns, page_size, after)
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after = (page[-1]["ticker"], page[-1]["timestamp"])
+
+    def _latest_query(self, session, mapper, symbols, parameter="ticker"):
+        """
+        Builds a query returning the newest row of each symbol, or of every symbol if symbols is None.
+
+        On PostgreSQL each symbol is looked up with a LATERAL ... ORDER BY timestamp DESC LIMIT 1,
+        a single descent of the (ticker, timestamp) index per symbol; elsewhere a ROW_NUMBER()
+        window picks the first row of every symbol.
+        """
+        keys = [attr.key for attr in inspect(mapper).column_attrs]
+        group = getattr(mapper, parameter)
+        if session.get_bind().dialect.name == "postgresql":
+            if symbols is None:
+                # every symbol of the referenced stocks table, without scanning the series itself
+                source = next(iter(group.expression.foreign_keys)).column
+                names = select(source.label(parameter)).subquery("s")
+            else:
+                names = select(func.unnest(array(symbols, type_=group.type)).label(parameter)).subquery("s")
+            latest = (select(*[getattr(mapper, key).label(key) for key in keys])
+                      .where(group == names.c[parameter])
+                      .order_by(mapper.timestamp.desc())
+                      .limit(1)
+                      .lateral("l"))
+            return session.query(*[latest.c[key] for key in keys]).select_from(names).join(latest, true())
+
+        rank = func.row_number().over(partition_by=group, order_by=mapper.timestamp.desc()).label("rank")
+        ranked = session.query(*[getattr(mapper, key).label(key) for key in keys], rank)
+        if symbols is not None:
+            ranked = ranked.filter(group.in_(symbols))
+        ranked = ranked.subquery()
+        return session.query(*[ranked.c[key] for key in keys]).filter(ranked.c.rank == 1)
+
+    def get_latest_series(self, mapper, parameter_val=None, parameter="ticker", use_cache=True):
+        """
+        Gets the newest row of each requested symbol.
+
+        Symbols whose latest bar, trade or quote was seen by a stream handler of this process are
+        answered from the in-memory cache (see db/latest_cache.py); only the rest hit the database.
+
+        Args:
+            mapper: The mapper object for the type of data to retrieve. Must have a timestamp.
+            parameter_val: A symbol, a list of symbols, or None for every symbol in the table.
+            parameter: The name of the symbol column.
+            use_cache (bool): Whether to answer from the stream cache when possible.
+
+        Returns:
+            res (dict or list): The latest row as a dictionary for a single symbol (None if it has no
+                rows), otherwise a list with one dictionary per symbol that has rows.
+        """
+        if parameter_val is not None and type(parameter_val) not in (str, list):
             print("Enter valid parameter value. List is valid type.")
+            return None
+        if not hasattr(mapper, "timestamp"):
+            raise ValueError("{} has no timestamp to order by".format(mapper.__name__))
+        symbols = [parameter_val] if type(parameter_val) == str else parameter_val
+
+        found = {}
+        cache = latest_cache.lookup(mapper.__tablename__) if use_cache else None
+        if cache is not None and symbols is not None:
+            found = cache.snapshot(symbols)
+        if symbols is not None and len(found) == len(symbols):
+            # every symbol was cached, and the snapshot is already in the requested order
+            return found.get(parameter_val) if type(parameter_val) == str else list(found.values())
+
+        missing = None if symbols is None else [s for s in symbols if s not in found]
+        model = compact_model(mapper)
+        with self.session() as session:
+            if model is not None:
+                ids = None if missing is None else list(ticker_ids(missing, session).values())
+                query = self._latest_query(session, model, ids, parameter)
+                for df in self._decoded(session, model, query):
+                    found.update((row[parameter], row) for row in _plain(df))
+            else:
+                for row in self._latest_query(session, mapper, missing, parameter):
+                    found[getattr(row, parameter)] = row._asdict()
+
+        if type(parameter_val) == str:
+            return found.get(parameter_val)
+        if symbols is None:
+            return list(found.values())
+        return [found[s] for s in symbols if s in found]
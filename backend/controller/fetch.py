@@ -5,7 +5,8 @@ import pathlib
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[2])) 
 
 from DataRetrievalController import DataRetrievalController 
-from db.models import BarDaily, BarMinute, BarHour, Trades, Quotes, Stocks
+# by its flat name, like the db modules (DataRetrievalController puts backend/db on sys.path)
+from models import BarDaily, BarMinute, BarHour, Trades, Quotes, Stocks
 
 
 def get_stock_by_symbol(symbol: str):
@@ -26,91 +27,146 @@ def get_stock_by_symbol(symbol: str):
         raise e
 
 
-def get_bars_hour_by_symbol(symbol: str):
+def get_bars_hour_by_symbol(symbol: str, start=None, end=None, columns=None, limit=None, after=None, output="dicts"):
     """
     Retrieves the hourly bar data for a given symbol.
 
     Args:
         symbol (str): The symbol of the stock to retrieve bar data for.
+        start (datetime, optional): Only return rows at or after this time.
+        end (datetime, optional): Only return rows before this time.
+        columns (list, optional): The attributes to return. Defaults to all of them.
+        limit (int, optional): The maximum number of rows to return, ordered by timestamp.
+        after (tuple, optional): (ticker, timestamp) of the last row of the previous page.
+        output (str, optional): "dicts" (default) for a list of dicts, or "pandas", "numpy" or "arrow"
+            for a columnar result built straight from the cursor.
 
     Returns:
         data (list): A list of BarHour objects representing the hourly bar data for the given symbol.
+            Or a DataFrame, dict of arrays or pyarrow Table for a columnar output.
     """
     try:
         data_ret_obj = DataRetrievalController()
-        data = data_ret_obj.query_data(BarHour, symbol, "ticker")
+        if output == "dicts":
+            data = data_ret_obj.query_data(BarHour, symbol, "ticker", start, end, columns, limit, after)
+        else:
+            data = data_ret_obj.query_columns(BarHour, symbol, "ticker", start, end, columns, limit, after, output)
         return data
     except Exception as e:
         raise e
 
 
-def get_bars_min_by_symbol(symbol: str):
+def get_bars_min_by_symbol(symbol: str, start=None, end=None, columns=None, limit=None, after=None, output="dicts"):
     """
     Retrieves the minute bar data for a given symbol.
 
     Args:
         symbol (str): The symbol of the stock to retrieve bar data for.
+        start (datetime, optional): Only return rows at or after this time.
+        end (datetime, optional): Only return rows before this time.
+        columns (list, optional): The attributes to return. Defaults to all of them.
+        limit (int, optional): The maximum number of rows to return, ordered by timestamp.
+        after (tuple, optional): (ticker, timestamp) of the last row of the previous page.
+        output (str, optional): "dicts" (default) for a list of dicts, or "pandas", "numpy" or "arrow"
+            for a columnar result built straight from the cursor.
 
     Returns:
         data (list): A list of BarMinute objects representing the minute bar data for the given symbol.
+            Or a DataFrame, dict of arrays or pyarrow Table for a columnar output.
     """
     try:
         data_ret_obj = DataRetrievalController()
-        data = data_ret_obj.query_data(BarMinute, symbol, "ticker")
+        if output == "dicts":
+            data = data_ret_obj.query_data(BarMinute, symbol, "ticker", start, end, columns, limit, after)
+        else:
+            data = data_ret_obj.query_columns(BarMinute, symbol, "ticker", start, end, columns, limit, after, output)
         return data
     except Exception as e:
         raise e
 
 
-def get_bars_day_by_symbol(symbol: str):
+def get_bars_day_by_symbol(symbol: str, start=None, end=None, columns=None, limit=None, after=None, output="dicts"):
     """
     Retrieves the daily bar data for a given symbol.
 
     Args:
         symbol (str): The symbol of the stock to retrieve bar data for.
+        start (datetime, optional): Only return rows at or after this time.
+        end (datetime, optional): Only return rows before this time.
+        columns (list, optional): The attributes to return. Defaults to all of them.
+        limit (int, optional): The maximum number of rows to return, ordered by timestamp.
+        after (tuple, optional): (ticker, timestamp) of the last row of the previous page.
+        output (str, optional): "dicts" (default) for a list of dicts, or "pandas", "numpy" or "arrow"
+            for a columnar result built straight from the cursor.
 
     Returns:
         data (list): A list of BarDaily objects representing the daily bar data for the given symbol.
+            Or a DataFrame, dict of arrays or pyarrow Table for a columnar output.
     """
     try:
         data_ret_obj = DataRetrievalController()
-        data = data_ret_obj.query_data(BarDaily, symbol, "ticker")
+        if output == "dicts":
+            data = data_ret_obj.query_data(BarDaily, symbol, "ticker", start, end, columns, limit, after)
+        else:
+            data = data_ret_obj.query_columns(BarDaily, symbol, "ticker", start, end, columns, limit, after, output)
         return data
     except Exception as e:
         raise e
 
 
-def get_trades_by_symbol(symbol: str):
+def get_trades_by_symbol(symbol: str, start=None, end=None, columns=None, limit=None, after=None, output="dicts"):
     """
     Retrieves the trade data for a given symbol.
 
     Args:
         symbol (str): The symbol of the stock to retrieve trade data for.
+        start (datetime, optional): Only return rows at or after this time.
+        end (datetime, optional): Only return rows before this time.
+        columns (list, optional): The attributes to return. Defaults to all of them.
+        limit (int, optional): The maximum number of rows to return, ordered by timestamp.
+        after (tuple, optional): (ticker, timestamp) of the last row of the previous page.
+        output (str, optional): "dicts" (default) for a list of dicts, or "pandas", "numpy" or "arrow"
+            for a columnar result built straight from the cursor.
 
     Returns:
         data (list): A list of Trades objects representing the trade data for the given symbol.
+            Or a DataFrame, dict of arrays or pyarrow Table for a columnar output.
     """
     try:
         data_ret_obj = DataRetrievalController()
-        data = data_ret_obj.query_data(Trades, symbol, "ticker")
+        if output == "dicts":
+            data = data_ret_obj.query_data(Trades, symbol, "ticker", start, end, columns, limit, after)
+        else:
+            data = data_ret_obj.query_columns(Trades, symbol, "ticker", start, end, columns, limit, after, output)
         return data
     except Exception as e:
         raise e
 
 
-def get_quotes_by_symbol(symbol: str):
+def get_quotes_by_symbol(symbol: str, start=None, end=None, columns=None, limit=None, after=None, output="dicts"):
     """
     Retrieves the quote data for a given symbol.
 
     Args:
         symbol (str): The symbol of the stock to retrieve quote data for.
+        start (datetime, optional): Only return rows at or after this time.
+        end (datetime, optional): Only return rows before this time.
+        columns (list, optional): The attributes to return. Defaults to all of them.
+        limit (int, optional): The maximum number of rows to return, ordered by timestamp.
+        after (tuple, optional): (ticker, timestamp) of the last row of the previous page.
+        output (str, optional): "dicts" (default) for a list of dicts, or "pandas", "numpy" or "arrow"
+            for a columnar result built straight from the cursor.
 
     Returns:
         data (list): A list of Quotes objects representing the quote data for the given symbol.
+            Or a DataFrame, dict of arrays or pyarrow Table for a columnar output.
     """
     try:
         data_ret_obj = DataRetrievalController()
-        data = data_ret_obj.query_data(Quotes, symbol, "ticker")
+        if output == "dicts":
+            data = data_ret_obj.query_data(Quotes, symbol, "ticker", start, end, columns, limit, after)
+        else:
+            data = data_ret_obj.query_columns(Quotes, symbol, "ticker", start, end, columns, limit, after, output)
         return data
     except Exception as e:
         raise e
@@ -3,7 +3,9 @@ import sys
 import pathlib
 import os
 import time
-from typing import List
+import random
+from typing import Callable, Dict, List, Tuple
+import msgpack
 from dotenv import load_dotenv
 from alpaca_trade_api.rest import REST
 from alpaca_trade_api.stream import Stream
@@ -15,16 +17,33 @@ load_dotenv()
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# data channels that can share the single stock data websocket
+CHANNELS = ("bars", "trades", "quotes")
+
+# reconnect backoff in seconds, doubled on each failed attempt up to the cap
+RECONNECT_BASE = float(os.environ.get("STREAM_RECONNECT_BASE", 1))
+RECONNECT_CAP = float(os.environ.get("STREAM_RECONNECT_CAP", 60))
+
 class AlpacaDataStream:
     """
     Class for managing the Alpaca data stream.
     """
 
-    def __init__(self):
+    def __init__(self, backfill: Callable = None):
         """
         Constructor for the AlpacaDataStream class.
+
+        Args:
+            backfill (callable, optional): Coroutine function called as backfill(channel, since, until)
+                after a reconnect, with ``since`` mapping each symbol to the timestamp (ns) of its
+                last message and ``until`` the reconnect time. Defaults to stream_backfill.backfill_gap.
         """
         self._conn = None
+        self._backfill = backfill
+        # timestamp (ns since the epoch) of the last message received per channel and symbol
+        self.last_seen = {channel: {} for channel in CHANNELS}
+        self.reconnects = 0
+        self._backfills = set()
         self.create_connection()
 
     def get_market_clock(self):
@@ -50,35 +69,210 @@ class AlpacaDataStream:
         except Exception as e:
             raise ConnectionError("Some error in streaming data /n {}".format(e))
 
-    def get_streams(self, channel: str, symbols: List[str], handlers: List[callable]):
+    def _data_ws(self):
+        return self._conn._data_ws
+
+    def _call_in_stream_loop(self, coro_fn):
         """
-        Subscribes to data streams for the given channel, symbols, and handlers.
+        Runs a coroutine on the stream's event loop, whichever thread this is called from.
+        Nothing is sent while the websocket is down; subscriptions are replayed on (re)connect.
+        """
+        data_ws = self._data_ws()
+        if not data_ws._running or data_ws._ws is None:
+            return None
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is data_ws._loop:
+            # called from a handler: the loop cannot block on itself
+            return asyncio.ensure_future(coro_fn())
+        return asyncio.run_coroutine_threadsafe(coro_fn(), data_ws._loop).result()
+
+    async def _send_subscription(self, action: str, channel: str, symbols: List[str]):
+        data_ws = self._data_ws()
+        payload = msgpack.packb({"action": action, channel: list(symbols)})
+        frames = (payload[i:i + data_ws._max_frame_size]
+                  for i in range(0, len(payload), data_ws._max_frame_size))
+        await data_ws._ws.send(frames)
+
+    def _tracked(self, channel: str, handler: Callable):
+        """
+        Wraps a handler so that the timestamp of every message is recorded in last_seen.
+        """
+        last_seen = self.last_seen[channel]
+
+        async def tracked(msg):
+            raw = msg._raw
+            last_seen[raw["symbol"]] = raw["timestamp"]
+            await handler(msg)
+
+        return tracked
+
+    def subscribe(self, channel: str, symbols: List[str], handler: Callable):
+        """
+        Subscribes symbols of one channel to a handler on the shared data connection.
+
+        Can be called before run_streams or while the stream is running, from a handler or
+        from another thread; only the new symbols are sent, the connection is kept.
 
         Args:
-            channel (str): The data stream channel to subscribe to. Can be "bars", "trades", or "quotes".
-            symbols (List[str]): A list of symbols to subscribe to.
-            handlers (List[callable]): A list of callable objects that will handle the incoming data stream.
+            channel (str): "bars", "trades" or "quotes".
+            symbols (List[str]): The symbols to subscribe to.
+            handler (callable): The coroutine function receiving the channel's messages.
+        """
+        if channel not in CHANNELS:
+            raise ValueError("Enter a valid input for channel parameter valid inputs are [bars,trades,quotes]")
+        if not asyncio.iscoroutinefunction(handler):
+            raise ValueError("handler must be a coroutine function")
+        handlers = self._data_ws()._handlers[channel]
+        tracked = self._tracked(channel, handler)
+        for symbol in symbols:
+            handlers[symbol] = tracked
+        self._call_in_stream_loop(lambda: self._send_subscription("subscribe", channel, symbols))
+
+    def unsubscribe(self, channel: str, symbols: List[str]):
+        """
+        Unsubscribes symbols of one channel without reconnecting.
+
+        Args:
+            channel (str): "bars", "trades" or "quotes".
+            symbols (List[str]): The symbols to unsubscribe from.
+        """
+        if channel not in CHANNELS:
+            raise ValueError("Enter a valid input for channel parameter valid inputs are [bars,trades,quotes]")
+        self._call_in_stream_loop(lambda: self._send_subscription("unsubscribe", channel, symbols))
+        handlers = self._data_ws()._handlers[channel]
+        for symbol in symbols:
+            handlers.pop(symbol, None)
+
+    def subscriptions(self) -> Dict[str, List[str]]:
+        """
+        Returns the symbols currently subscribed on each channel.
+        """
+        return {channel: list(self._data_ws()._handlers[channel]) for channel in CHANNELS}
+
+    async def _run_backfill(self, disconnected_at: int, reconnected_at: int):
+        """
+        Backfills, per channel, the window each subscribed symbol missed while disconnected.
+        """
+        backfill = self._backfill
+        if backfill is None:
+            from stream_backfill import backfill_gap as backfill
+        for channel in CHANNELS:
+            symbols = self._data_ws()._handlers[channel]
+            if not symbols:
+                continue
+            last_seen = self.last_seen[channel]
+            since = {symbol: last_seen.get(symbol, disconnected_at) for symbol in symbols if symbol != "*"}
+            try:
+                await backfill(channel, since, reconnected_at)
+            except Exception:
+                logger.exception("Backfill of the {} gap failed".format(channel))
+
+    async def _supervise(self):
+        """
+        Keeps the data websocket connected: reconnects with jittered exponential backoff,
+        replays every subscription and backfills the gap in the background after each reconnect.
+        """
+        data_ws = self._data_ws()
+        data_ws._loop = asyncio.get_running_loop()
+        attempt = 0
+        disconnected_at = None
+        while data_ws._should_run:
+            try:
+                await data_ws._start_ws()
+                await data_ws._subscribe_all()
+                data_ws._running = True
+                logger.info("Connected to Alpaca server")
+                attempt = 0
+                if disconnected_at is not None:
+                    self.reconnects += 1
+                    task = asyncio.ensure_future(self._run_backfill(disconnected_at, time.time_ns()))
+                    self._backfills.add(task)
+                    task.add_done_callback(self._backfills.discard)
+                    disconnected_at = None
+                await data_ws._consume()
+            except Exception as e:
+                logger.warning("Alpaca stream disconnected: {}".format(e))
+            finally:
+                if data_ws._running and disconnected_at is None:
+                    disconnected_at = time.time_ns()
+                await data_ws.close()
+                data_ws._running = False
+            if not data_ws._should_run:
+                break
+            delay = random.uniform(0, min(RECONNECT_CAP, RECONNECT_BASE * 2 ** attempt))
+            attempt += 1
+            logger.info("Reconnecting to Alpaca server in {:.1f}s".format(delay))
+            await asyncio.sleep(delay)
+        if self._backfills:
+            await asyncio.gather(*self._backfills, return_exceptions=True)
+
+    async def _run_forever(self):
+        try:
+            await asyncio.gather(self._supervise(), self._conn._trading_ws._run_forever())
+        finally:
+            # write what the handlers' buffers still hold and release their sessions, on this
+            # loop, before asyncio.run cancels the remaining tasks
+            from write_buffer import close_all
+            await close_all()
+
+    def stop(self):
+        """
+        Stops the stream from any thread, the stream's own included (e.g. from a handler);
+        run_streams/get_streams then return.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        for ws in (self._conn._data_ws, self._conn._trading_ws):
+            if ws._loop is not None and ws._loop.is_running():
+                if ws._loop is running_loop:
+                    # called on the stream's loop: it cannot block on itself
+                    asyncio.ensure_future(ws.stop_ws())
+                else:
+                    asyncio.run_coroutine_threadsafe(ws.stop_ws(), ws._loop).result()
+            else:
+                ws._stop_stream_queue.put_nowait({"should_stop": True})
+                ws._should_run = False
+
+    def run_streams(self, subscriptions: Dict[str, Tuple[List[str], Callable]]):
+        """
+        Streams several channels over one websocket connection, with every handler running on
+        the same asyncio loop. Blocks until the stream is stopped, reconnecting as needed.
+
+        Args:
+            subscriptions (Dict[str, Tuple[List[str], callable]]): Maps "bars", "trades" and/or
+                "quotes" to the symbols and the handler of that channel.
 
         Raises:
             Exception: An exception is raised if there is an error connecting to the server.
         """
-        if channel == "bars":
-            self._conn.subscribe_bars(handlers, *symbols)
-        elif channel == "trades":
-            self._conn.subscribe_trade_updates(handlers)
-            self._conn.subscribe_trades(handlers, *symbols)
-        elif channel == "quotes":
-            self._conn.subscribe_quotes(handlers, *symbols)
+        for channel, (symbols, handler) in subscriptions.items():
+            self.subscribe(channel, symbols, handler)
 
         try:
             logger.info("Connecting to Alpaca server")
-            self._conn.run()
+            asyncio.run(self._run_forever())
             logger.info("Connection to Alpaca server terminated")
-            print("Connection established with Alpaca server")
         except Exception as e:
             logger.exception("Some error connecting to server. Check logs.")
             raise e
-        finally:
-            print("Trying to re-establish connection")
-            time.sleep(5)
-            res = self._conn.run()
+
+    def get_streams(self, channel: str, symbols: List[str], handlers: List[callable]):
+        """
+        Subscribes to data streams for the given channel, symbols, and handlers.
+
+        Args:
+            channel (str): The data stream channel to subscribe to. Can be "bars", "trades", or "quotes".
+            symbols (List[str]): A list of symbols to subscribe to.
+            handlers (List[callable]): A list of callable objects that will handle the incoming data stream.
+
+        Raises:
+            Exception: An exception is raised if there is an error connecting to the server.
+        """
+        if channel == "trades":
+            self._conn.subscribe_trade_updates(handlers)
+        self.run_streams({channel: (symbols, handlers)})
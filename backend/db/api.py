@@ -6,8 +6,12 @@ from dotenv import load_dotenv
 import os
 import pandas as pd
 import sys
+from datetime import date, datetime, timedelta
 from alpaca_trade_api.rest import TimeFrame, URL
-from alpaca_trade_api.rest_async import gather_with_concurrency, AsyncRest
+from alpaca_trade_api.entity_v2 import BarsV2, TradesV2, QuotesV2
+from ratelimit import RateLimitedRest, TokenBucket
+import disk_cache
+from disk_cache import DISK_CACHE
 
 load_dotenv()
 
@@ -16,7 +20,14 @@ api_key_id = os.environ.get('APCA_API_KEY_ID')
 api_secret = os.environ.get('APCA_API_SECRET_KEY')
 base_url = os.environ.get('APCA_API_BASE_URL')
 feed = os.environ.get('APCA_FEED')
-rest = AsyncRest(key_id=api_key_id, secret_key=api_secret)
+# maximum number of requests in flight across all symbols
+MAX_CONCURRENCY = int(os.environ.get('APCA_MAX_CONCURRENCY', 50))
+# granularity used to split each symbol's date range: "month", "day" or "none"
+FETCH_CHUNK = os.environ.get('APCA_FETCH_CHUNK', 'month').lower()
+FETCH_CHUNK = None if FETCH_CHUNK == 'none' else FETCH_CHUNK
+# rows per page requested from the API when streaming (10000 is the API maximum)
+PAGE_LIMIT = int(os.environ.get('APCA_PAGE_LIMIT', 10000))
+rest = RateLimitedRest(key_id=api_key_id, secret_key=api_secret, limiter=TokenBucket())
 api = tradeapi.REST(key_id=api_key_id, secret_key=api_secret, base_url=URL(base_url))
 
 
@@ -29,6 +40,7 @@ class DataType(str, Enum):
 def get_data_method(data_type: DataType):
     """
     Returns the corresponding async data retrieval method for the given data type.
+    All methods share the rate limiter of the module level ``rest`` client.
 
     Args:
         data_type (DataType): The type of data to retrieve.
@@ -49,23 +61,201 @@ def get_data_method(data_type: DataType):
         raise Exception(f"Unsupported data type: {data_type}")
 
 
+def split_date_range(start, end, chunk=None):
+    """
+    Splits a date range into consecutive, non-overlapping chunks.
+
+    Args:
+        start (str): The start date of the range in 'YYYY-MM-DD' format, or an RFC 3339 timestamp.
+        end (str): The end date of the range in 'YYYY-MM-DD' format, or an RFC 3339 timestamp.
+        chunk (str, optional): "month", "day" or None. None returns the range unsplit.
+
+    Returns:
+        list: A list of (start, end) tuples in chronological order. Every chunk but the last
+            ends one microsecond before the next one starts, so no row is fetched twice.
+    """
+    if chunk is None:
+        return [(start, end)]
+    if chunk not in ("month", "day"):
+        raise ValueError("Enter a valid input for chunk parameter valid inputs are [month,day,None]")
+
+    first = date.fromisoformat(start[:10])
+    last = date.fromisoformat(end[:10])
+    boundaries = [first]
+    current = first
+    while True:
+        if chunk == "day":
+            current = current + timedelta(days=1)
+        else:
+            current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+        if current >= last:
+            break
+        boundaries.append(current)
+
+    ranges = []
+    for i, chunk_start in enumerate(boundaries):
+        # the first chunk keeps the exact start, which may be a timestamp rather than a date
+        chunk_start = start if i == 0 else chunk_start.isoformat()
+        if i + 1 < len(boundaries):
+            chunk_end = datetime.combine(boundaries[i + 1], datetime.min.time()) - timedelta(microseconds=1)
+            ranges.append((chunk_start, chunk_end.isoformat() + "Z"))
+        else:
+            ranges.append((chunk_start, end))
+    return ranges
+
+
+def _stitch_chunks(symbol, responses):
+    """
+    Concatenates the chunk responses of one symbol back into a single (symbol, data) tuple.
+
+    Chunks are expected in chronological order. The first exception found is returned as is
+    so that callers can report it the same way as a failed unchunked request.
+    """
+    frames = []
+    for response in responses:
+        if isinstance(response, Exception):
+            return response
+        if len(response[1]):
+            frames.append(response[1])
+    if not frames:
+        return responses[-1] if responses else (symbol, pd.DataFrame())
+    if len(frames) == 1:
+        return symbol, frames[0]
+    return symbol, pd.concat(frames)
+
+
+async def iterate_pages(symbol, data_type: DataType, start, end, timeframe: TimeFrame = None, raw=False):
+    """
+    Asynchronously iterates over the API pages of one symbol's historic data.
+
+    Args:
+        symbol (str): The symbol to retrieve data for.
+        data_type (DataType): The type of data to retrieve.
+        start (str): The start of the data range to retrieve.
+        end (str): The end of the data range to retrieve.
+        timeframe (TimeFrame, optional): The timeframe of the data to retrieve. Defaults to None.
+        raw (bool, optional): Yield the records as sent by the API instead of building a DataFrame,
+            for callers that normalize many pages at once (see populate_hist.normalize_batch).
+
+    Yields:
+        DataFrame: One DataFrame per non-empty page, indexed by timestamp, or its list of records.
+    """
+    _type, entity_list = {
+        DataType.Bars: ("bars", BarsV2),
+        DataType.Trades: ("trades", TradesV2),
+        DataType.Quotes: ("quotes", QuotesV2),
+    }[data_type]
+    payload = {"start": start, "end": end, "limit": PAGE_LIMIT}
+    if timeframe:
+        payload.update(timeframe=timeframe.value, adjustment="raw")
+    # _request and _get_historic_url are private to AsyncRest, checked against alpaca_trade_api 3.2.0
+    async for packet in rest._request(rest._get_historic_url(_type, symbol), payload):
+        if packet.get(_type):
+            yield packet[_type] if raw else entity_list(packet[_type]).df
+
+
+async def get_historic_data_stream(symbols, data_type: DataType, start, end,
+                                   timeframe: TimeFrame = None, concurrency=MAX_CONCURRENCY,
+                                   chunk=FETCH_CHUNK, failures=None, raw=False):
+    """
+    Streaming mode of get_historic_data_base: yields pages as soon as they arrive instead of
+    returning every symbol's complete response at the end.
+
+    The (symbol, chunk) requests are scheduled the same way as in get_historic_data_base, but
+    pages are handed over through a queue bounded by ``concurrency``, so at most that many pages
+    are held in memory no matter how large the date range is. Pages of different symbols and
+    chunks are interleaved in arrival order.
+
+    Args:
+        symbols (list): List of symbols to retrieve data for.
+        data_type (DataType): The type of data to retrieve.
+        start (str or dict): The start date of the data range to retrieve in 'YYYY-MM-DD' format,
+            or a {symbol: start} dict to resume every symbol from its own point (see catch_up_asset_data).
+        end (str): The end date of the data range to retrieve in 'YYYY-MM-DD' format.
+        timeframe (TimeFrame, optional): The timeframe of the data to retrieve. Defaults to None.
+        concurrency (int, optional): Maximum number of requests in flight. Defaults to APCA_MAX_CONCURRENCY.
+        chunk (str, optional): Split each symbol's range by "month", "day" or not at all (None).
+            Defaults to APCA_FETCH_CHUNK.
+        failures (list, optional): If given, (symbol, exception) is appended for every failed request.
+        raw (bool, optional): Yield the records of each page instead of a DataFrame (see iterate_pages).
+
+    Yields:
+        tuple: (symbol, DataFrame) or (symbol, records) for every non-empty page.
+    """
+    msg = f"Streaming {data_type} data for {len(symbols)} symbols"
+    msg += f", timeframe: {timeframe}" if timeframe else ""
+    msg += f" between dates: start={start if isinstance(start, str) else min(start.values())}, end={end}"
+    print(msg)
+
+    queue = asyncio.Queue(maxsize=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    done = object()
+
+    async def produce(symbol, chunk_start, chunk_end):
+        async with semaphore:
+            try:
+                async for page in iterate_pages(symbol, data_type, chunk_start, chunk_end, timeframe, raw):
+                    await queue.put((symbol, page))
+            except Exception as e:
+                await queue.put((symbol, e))
+
+    async def produce_all():
+        await asyncio.gather(*[produce(symbol, chunk_start, chunk_end)
+                               for symbol in symbols
+                               for chunk_start, chunk_end in split_date_range(
+                                   start[symbol] if isinstance(start, dict) else start, end, chunk)])
+        await queue.put(done)
+
+    producer = asyncio.ensure_future(produce_all())
+    pages = 0
+    errors = 0
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item[1], Exception):
+                print(f"Got an error for {item[0]}: {item[1]}")
+                errors += 1
+                if failures is not None:
+                    failures.append(item)
+                continue
+            pages += 1
+            yield item
+    finally:
+        producer.cancel()
+
+    print(f"Total of {pages} {data_type} pages, and {errors} errors.")
+
+
 async def get_historic_data_base(symbols, data_type: DataType, start, end,
-                                 timeframe: TimeFrame = None):
+                                 timeframe: TimeFrame = None, concurrency=MAX_CONCURRENCY,
+                                 chunk=FETCH_CHUNK, cache=DISK_CACHE):
     """
     Base function to retrieve historic data for a given set of symbols and time range.
 
+    Every symbol's date range is split into chunks and all (symbol, chunk) requests are
+    scheduled at once on a single pool bounded by ``concurrency``. The chunks are stitched
+    back together per symbol in chronological order. Every page of each chunk is fetched (see
+    iterate_pages), however many rows it holds. With the disk cache on, past days are read from
+    disk and only the missing ones are requested (see _get_cached_data).
+
     Args:
         symbols (list): List of symbols to retrieve data for.
         data_type (DataType): The type of data to retrieve.
         start (str): The start date of the data range to retrieve in 'YYYY-MM-DD' format.
         end (str): The end date of the data range to retrieve in 'YYYY-MM-DD' format.
         timeframe (TimeFrame, optional): The timeframe of the data to retrieve. Defaults to None.
+        concurrency (int, optional): Maximum number of requests in flight. Defaults to APCA_MAX_CONCURRENCY.
+        chunk (str, optional): Split each symbol's range by "month", "day" or not at all (None).
+            Defaults to APCA_FETCH_CHUNK.
+        cache (bool, optional): Whether to use the on-disk Parquet cache. Defaults to APCA_DISK_CACHE.
 
     Returns:
-        list: A list of tuples containing the retrieved data.
+        list: A list of (symbol, data) tuples, one per symbol, in the order of ``symbols``.
 
     Raises:
-        Exception: If the python version is lower than 3.6 or if an error occurs during data retrieval.
+        Exception: If the python version is lower than 3.6.
     """
     major = sys.version_info.major
     minor = sys.version_info.minor
@@ -75,20 +265,26 @@ async def get_historic_data_base(symbols, data_type: DataType, start, end,
     msg += f", timeframe: {timeframe}" if timeframe else ""
     msg += f" between dates: start={start}, end={end}"
     print(msg)
-    step_size = 1
-    results = []
-    for i in range(0, len(symbols), step_size):
-        tasks = []
-        for symbol in symbols[i:i+step_size]:
-            args = [symbol, start, end, timeframe.value] if timeframe else \
-                [symbol, start, end]
-            tasks.append(get_data_method(data_type)(*args))
-
-        if minor >= 8:
-            results.extend(await asyncio.gather(*tasks, return_exceptions=False))
-        else:
-            results.extend(await gather_with_concurrency(500, *tasks))
 
+    if cache:
+        return await _get_cached_data(symbols, data_type, start, end, timeframe, concurrency, chunk)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    ranges = split_date_range(start, end, chunk)
+    tasks = [_fetch_pages(semaphore, symbol, data_type, chunk_start, chunk_end, timeframe)
+             for symbol in symbols for chunk_start, chunk_end in ranges]
+
+    responses = await asyncio.gather(*tasks, return_exceptions=True)
+    results = [_stitch_chunks(symbol, responses[i * len(ranges):(i + 1) * len(ranges)])
+               for i, symbol in enumerate(symbols)]
+    _report(results, data_type)
+    return results
+
+
+def _report(results, data_type):
+    """
+    Prints the errors and the number of empty responses of a get_historic_data_base call.
+    """
     bad_requests = 0
 
     for response in results:
@@ -100,16 +296,73 @@ async def get_historic_data_base(symbols, data_type: DataType, start, end,
     print(f"Total of {len(results)} {data_type}, and {bad_requests} "
           f"empty responses.")
 
-    return results
 
+async def _fetch_pages(semaphore, symbol, data_type, start, end, timeframe):
+    """
+    Fetches every page of one symbol's range while holding a slot of the shared semaphore.
+    """
+    async with semaphore:
+        frames = [page async for page in iterate_pages(symbol, data_type, start, end, timeframe)]
+    return symbol, pd.concat(frames) if frames else pd.DataFrame()
+
+
+async def _get_cached_data(symbols, data_type, start, end, timeframe, concurrency, chunk):
+    """
+    get_historic_data_base backed by the on-disk cache (see disk_cache.py).
+
+    Days already on disk are read from there; only the runs of missing days are requested,
+    split by ``chunk`` and scheduled on one pool like the uncached path. Missing days are
+    fetched through every page (see iterate_pages) so that no truncated response is ever
+    persisted, and the closed ones are written back before the rows are merged and trimmed to
+    the exact start and end of the request.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    plans = []
+    tasks = []
+    for symbol in symbols:
+        frames, missing = disk_cache.load(data_type, symbol, timeframe, start, end)
+        runs = []
+        for first, last in missing:
+            ranges = split_date_range(*disk_cache.day_range(first, last), chunk)
+            tasks += [_fetch_pages(semaphore, symbol, data_type, chunk_start, chunk_end, timeframe)
+                      for chunk_start, chunk_end in ranges]
+            runs.append((first, last, len(ranges)))
+        plans.append((symbol, frames, runs))
+
+    responses = await asyncio.gather(*tasks, return_exceptions=True)
+    results = []
+    position = 0
+    for symbol, frames, runs in plans:
+        fetched = []
+        for first, last, count in runs:
+            response = _stitch_chunks(symbol, responses[position:position + count])
+            position += count
+            if isinstance(response, Exception):
+                fetched = response
+                break
+            disk_cache.store(data_type, symbol, timeframe, response[1], first, last)
+            if len(response[1]):
+                fetched.append(response[1])
+        if isinstance(fetched, Exception):
+            results.append(fetched)
+        elif frames or fetched:
+            # whole days were read and fetched, keep only the rows the uncached path would return
+            results.append((symbol, disk_cache.trim(pd.concat(frames + fetched).sort_index(kind="stable"),
+                                                    start, end)))
+        else:
+            results.append((symbol, pd.DataFrame()))
 
+    print(f"Served {sum(len(p[1]) for p in plans)} frames from disk, "
+          f"made {len(tasks)} requests.")
+    _report(results, data_type)
+    return results
 
 
-async def get_historic_bars(symbols, start, end, timeframe: TimeFrame):
-    data=await get_historic_data_base(symbols, DataType.Bars, start, end, timeframe)
+async def get_historic_bars(symbols, start, end, timeframe: TimeFrame, **kwargs):
+    data=await get_historic_data_base(symbols, DataType.Bars, start, end, timeframe, **kwargs)
     return data
 
-async def get_historic_trades(symbols, start, end, timeframe: TimeFrame):
+async def get_historic_trades(symbols, start, end, timeframe: TimeFrame, **kwargs):
     """
     Asynchronously retrieves historical trades data for a given symbol, timeframe, and time range.
 
@@ -118,15 +371,16 @@ async def get_historic_trades(symbols, start, end, timeframe: TimeFrame):
         start (str): The start date of the historical data range in the format YYYY-MM-DD.
         end (str): The end date of the historical data range in the format YYYY-MM-DD.
         timeframe (TimeFrame): The timeframe of the historical trades data.
+        **kwargs: Scheduling and cache options (concurrency, chunk, cache) forwarded to get_historic_data_base.
 
     Returns:
         data (dict): A dictionary containing the historical trades data for the specified symbols, timeframe, and time range.
     """
-    data=await get_historic_data_base(symbols, DataType.Trades, start, end)
+    data=await get_historic_data_base(symbols, DataType.Trades, start, end, **kwargs)
     return data
 
 
-async def get_historic_quotes(symbols, start, end, timeframe: TimeFrame):
+async def get_historic_quotes(symbols, start, end, timeframe: TimeFrame, **kwargs):
     """
     Asynchronously retrieves historical quotes data for a given symbol, timeframe, and time range.
 
@@ -135,16 +389,17 @@ async def get_historic_quotes(symbols, start, end, timeframe: TimeFrame):
         start (str): The start date of the historical data range in the format YYYY-MM-DD.
         end (str): The end date of the historical data range in the format YYYY-MM-DD.
         timeframe (TimeFrame): The timeframe of the historical quotes data.
+        **kwargs: Scheduling and cache options (concurrency, chunk, cache) forwarded to get_historic_data_base.
 
     Returns:
         data (dict): A dictionary containing the historical quotes data for the specified symbols, timeframe, and time range.
     """
-    data=await get_historic_data_base(symbols, DataType.Quotes, start, end)
+    data=await get_historic_data_base(symbols, DataType.Quotes, start, end, **kwargs)
     return data
 
 
 
-def get_data(symbols,start,end,timeframe,type="bins"):
+def get_data(symbols,start,end,timeframe,type="bins",concurrency=MAX_CONCURRENCY,chunk=FETCH_CHUNK,cache=DISK_CACHE):
     """
     Retrieves historical data for a given symbol, timeframe, and time range.
 
@@ -154,6 +409,9 @@ def get_data(symbols,start,end,timeframe,type="bins"):
         end (str): The end date of the historical data range in the format YYYY-MM-DD.
         timeframe (TimeFrame): The timeframe of the historical data.
         type (str): The type of data to retrieve. Can be "bins", "trades", or "quotes". Defaults to "bins".
+        concurrency (int): Maximum number of requests in flight. Defaults to APCA_MAX_CONCURRENCY.
+        chunk (str): Split each symbol's range by "month", "day" or not at all (None). Defaults to APCA_FETCH_CHUNK.
+        cache (bool): Serve closed days from the on-disk Parquet cache. Defaults to APCA_DISK_CACHE.
 
     Returns:
         data (dict): A dictionary containing the historical data for the specified symbols, timeframe, and time range.
@@ -161,19 +419,50 @@ def get_data(symbols,start,end,timeframe,type="bins"):
     start = pd.Timestamp(start, tz=NY).date().isoformat()
     end = pd.Timestamp(end,tz=NY).date().isoformat()
     timeframe: TimeFrame = timeframe
+    kwargs = dict(concurrency=concurrency, chunk=chunk, cache=cache)
 
     if type == "bins":
-        data=asyncio.run(get_historic_bars(symbols, start, end, timeframe))
+        data=asyncio.run(get_historic_bars(symbols, start, end, timeframe, **kwargs))
     elif type == "trades":
-        data=asyncio.run(get_historic_trades(symbols, start, end, timeframe))
+        data=asyncio.run(get_historic_trades(symbols, start, end, timeframe, **kwargs))
     elif type ==  "quotes":
-        data=asyncio.run(get_historic_quotes(symbols, start, end, timeframe))
+        data=asyncio.run(get_historic_quotes(symbols, start, end, timeframe, **kwargs))
     else:
         raise ValueError("Enter a valid input for type parameters valid inputs are [bins,trades,quotes]")
 
     return data
 
 
+def stream_data(symbols,start,end,timeframe,type="bins",concurrency=MAX_CONCURRENCY,chunk=FETCH_CHUNK,raw=False):
+    """
+    Streaming counterpart of get_data. Returns an async generator to be consumed inside an event loop.
+
+    Args:
+        symbols (list): A list of symbols to retrieve historical data for.
+        start (str): The start date of the historical data range in the format YYYY-MM-DD.
+        end (str): The end date of the historical data range in the format YYYY-MM-DD.
+        timeframe (TimeFrame): The timeframe of the historical data. Only used for bins.
+        type (str): The type of data to retrieve. Can be "bins", "trades", or "quotes". Defaults to "bins".
+        concurrency (int): Maximum number of requests in flight. Defaults to APCA_MAX_CONCURRENCY.
+        chunk (str): Split each symbol's range by "month", "day" or not at all (None). Defaults to APCA_FETCH_CHUNK.
+        raw (bool): Yield each page's records as sent by the API instead of a DataFrame.
+
+    Returns:
+        async generator: Yields (symbol, DataFrame) or (symbol, records) tuples, one per API page.
+    """
+    start = pd.Timestamp(start, tz=NY).date().isoformat()
+    end = pd.Timestamp(end,tz=NY).date().isoformat()
+
+    if type == "bins":
+        return get_historic_data_stream(symbols, DataType.Bars, start, end, timeframe, concurrency, chunk, raw=raw)
+    elif type == "trades":
+        return get_historic_data_stream(symbols, DataType.Trades, start, end, None, concurrency, chunk, raw=raw)
+    elif type ==  "quotes":
+        return get_historic_data_stream(symbols, DataType.Quotes, start, end, None, concurrency, chunk, raw=raw)
+    else:
+        raise ValueError("Enter a valid input for type parameters valid inputs are [bins,trades,quotes]")
+
+
 def get_assets(status="active"):
     """
     Retrieves assets with the given status.
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from alpaca_trade_api.rest import TimeFrame
+from dotenv import load_dotenv
+from sqlalchemy import func
+from api import MAX_CONCURRENCY, FETCH_CHUNK, iterate_pages, split_date_range
+from ratelimit import backoff_delay
+from populate_hist import DATA_TYPES, get_model, normalize_batch
+from helpers import insert_into_database
+from dbconnect import connect_to_database
+from models import Crons
+
+load_dotenv()
+
+# attempts made for a failing unit within one run, on top of the first one
+JOB_RETRIES = int(os.environ.get('JOB_RETRIES', 3))
+# seconds between two progress reports
+REPORT_INTERVAL = float(os.environ.get('JOB_REPORT_INTERVAL', 10))
+
+PENDING, RUNNING, COMPLETED, FAILED = "pending", "running", "completed", "failed"
+
+
+class BackfillJob:
+    """
+    A backfill split into (symbol, date chunk) units whose status is checkpointed in the Crons table.
+
+    Every unit is one row of Crons: cron_type "backfill", cron_on the job id and cron_id the
+    job id followed by the symbol and the start of the chunk. Units run with bounded
+    parallelism, a failing unit is retried with jittered backoff, and every page is upserted,
+    so a unit interrupted halfway is simply run again. Creating the same job again (same
+    table, range and chunking) after a crash or a kill skips the completed units.
+    """
+
+    def __init__(self, symbols, start, end, timeframe=TimeFrame.Minute, typ="bins", chunk=FETCH_CHUNK,
+                 concurrency=MAX_CONCURRENCY, retries=JOB_RETRIES, report_interval=REPORT_INTERVAL,
+                 on_progress=None):
+        """
+        Args:
+            symbols (list): The symbols to backfill.
+            start (str): The start date in the format YYYY-MM-DD.
+            end (str): The end date in the format YYYY-MM-DD.
+            timeframe (TimeFrame): The timeframe of the bars. Defaults to TimeFrame.Minute.
+            typ (str): "bins", "trades" or "quotes". Defaults to "bins".
+            chunk (str): Split each symbol's range into units by "month", "day" or not at all (None).
+            concurrency (int): Maximum number of units running at once.
+            retries (int): Extra attempts for a failing unit before it is marked failed.
+            report_interval (float): Seconds between two progress reports, None to stay quiet.
+            on_progress (callable, optional): Called as on_progress(kind, value) with ("planned", units),
+                ("rows", rows written), ("completed", cron_id) and ("failed", cron_id).
+        """
+        self.symbols = symbols
+        self.start = start
+        self.end = end
+        self.timeframe = timeframe if typ == "bins" else None
+        self.typ = typ
+        self.chunk = chunk
+        self.concurrency = concurrency
+        self.retries = retries
+        self.report_interval = report_interval
+        self.on_progress = on_progress or (lambda kind, value: None)
+        self.model = get_model(typ, timeframe)
+        self.job_id = "backfill:{}:{}:{}:{}".format(self.model.__tablename__, start, end, chunk or "none")
+        self.rows_written = 0
+        self._completed = 0
+        self._failed = 0
+        self._todo = 0
+
+    def _unit_id(self, symbol, chunk_start):
+        return "{}:{}:{}".format(self.job_id, symbol, chunk_start)
+
+    def _plan(self, ssn):
+        """
+        Creates the units that are not in Crons yet and returns the ones left to run.
+
+        Returns:
+            list: (cron_id, symbol, chunk start, chunk end) of every unit not completed yet.
+        """
+        status = dict(ssn.query(Crons.cron_id, Crons.cron_status).filter(Crons.cron_on == self.job_id))
+        units = [(self._unit_id(symbol, chunk_start), symbol, chunk_start, chunk_end)
+                 for symbol in self.symbols
+                 for chunk_start, chunk_end in split_date_range(self.start, self.end, self.chunk)]
+        new = [{"cron_id": unit[0], "cron_type": "backfill", "cron_on": self.job_id, "cron_status": PENDING}
+               for unit in units if unit[0] not in status]
+        if new:
+            ssn.execute(Crons.__table__.insert(), new)
+            ssn.commit()
+        return [unit for unit in units if status.get(unit[0]) != COMPLETED]
+
+    def _set_status(self, ssn, cron_id, status):
+        values = {Crons.cron_status: status}
+        values[Crons.started_at if status == RUNNING else Crons.completed_at] = func.now()
+        ssn.query(Crons).filter(Crons.cron_id == cron_id).update(values)
+        ssn.commit()
+
+    def status(self):
+        """
+        Returns the number of units of this job per status, as checkpointed in Crons.
+
+        Returns:
+            dict: {status: number of units}
+        """
+        ssn = connect_to_database()()
+        try:
+            return dict(ssn.query(Crons.cron_status, func.count())
+                        .filter(Crons.cron_on == self.job_id).group_by(Crons.cron_status))
+        finally:
+            ssn.close()
+
+    def _report(self, began):
+        elapsed = max(time.monotonic() - began, 1e-9)
+        done = self._completed + self._failed
+        rate = done / elapsed
+        eta = "{:.0f}s".format((self._todo - done) / rate) if rate else "unknown"
+        print("{}: {}/{} units done ({} failed), {} rows, {:.0f} rows/s, {:.2f} units/s, ETA {}".format(
+            self.job_id, done, self._todo, self._failed, self.rows_written, self.rows_written / elapsed, rate, eta))
+
+    async def run_async(self):
+        """
+        Runs every unit that is not completed yet. See run.
+        """
+        data_type = DATA_TYPES[self.typ]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # a single writer thread keeps the session on one thread and the event loop free
+        writer = ThreadPoolExecutor(max_workers=1)
+        ssn = connect_to_database()()
+        loop = asyncio.get_running_loop()
+
+        def write(fn, *args):
+            return loop.run_in_executor(writer, fn, *args)
+
+        async def run_unit(cron_id, symbol, chunk_start, chunk_end):
+            async with semaphore:
+                for attempt in range(self.retries + 1):
+                    await write(self._set_status, ssn, cron_id, RUNNING)
+                    try:
+                        async for page in iterate_pages(symbol, data_type, chunk_start, chunk_end,
+                                                        self.timeframe, raw=True):
+                            data_df = normalize_batch([(symbol, page)], self.typ)
+                            await write(insert_into_database, self.model, data_df, ssn, "update", True)
+                            self.rows_written += len(data_df)
+                            self.on_progress("rows", len(data_df))
+                        await write(self._set_status, ssn, cron_id, COMPLETED)
+                        self._completed += 1
+                        self.on_progress("completed", cron_id)
+                        return
+                    except Exception as e:
+                        print("Unit {} failed (attempt {}): {}".format(cron_id, attempt + 1, e))
+                        if attempt < self.retries:
+                            await asyncio.sleep(backoff_delay(attempt))
+                await write(self._set_status, ssn, cron_id, FAILED)
+                self._failed += 1
+                self.on_progress("failed", cron_id)
+
+        async def report(began):
+            while True:
+                await asyncio.sleep(self.report_interval)
+                self._report(began)
+
+        began = time.monotonic()
+        try:
+            units = await write(self._plan, ssn)
+            self._todo = len(units)
+            self.on_progress("planned", self._todo)
+            reporter = None
+            if self.report_interval:
+                print("{}: {} units to run".format(self.job_id, self._todo))
+                reporter = asyncio.ensure_future(report(began))
+            try:
+                await asyncio.gather(*[run_unit(*unit) for unit in units])
+            finally:
+                if reporter is not None:
+                    reporter.cancel()
+            if self.report_interval:
+                self._report(began)
+        finally:
+            await write(ssn.close)
+            writer.shutdown(wait=False)
+        return {"units": self._todo, "completed": self._completed, "failed": self._failed,
+                "rows": self.rows_written}
+
+    def run(self):
+        """
+        Runs every unit that is not completed yet, reporting throughput and ETA as it goes.
+
+        Returns:
+            dict: {"units", "completed", "failed", "rows"} for this run. Failed units are tried
+                again by the next run of the same job.
+        """
+        return asyncio.run(self.run_async())
+
+
+def run_backfill_job(symbols, start, end, timeframe=TimeFrame.Minute, typ="bins", **kwargs):
+    """
+    Checkpointed counterpart of populate_asset_data. Running it again with the same arguments
+    resumes the job. See BackfillJob for the options.
+    """
+    return BackfillJob(symbols, start, end, timeframe, typ, **kwargs).run()
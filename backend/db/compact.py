@@ -0,0 +1,192 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import Exch, TickerIds, ConditionSets, TradesCompact, QuotesCompact
+
+load_dotenv()
+
+# store trades and quotes in trades_compact/quotes_compact instead of trades/quotes
+COMPACT_SCHEMA = os.environ.get('DB_COMPACT_SCHEMA', 'false').lower() == 'true'
+
+NY = 'America/New_York'
+
+# exchanges are stored as the position of their letter in Exch
+EXCHANGES = np.array([member.name for member in Exch], dtype=object)
+EXCHANGE_MEMBERS = np.array(list(Exch), dtype=object)
+EXCHANGE_CODES = {name: code for code, name in enumerate(EXCHANGES)}
+UNKNOWN_EXCHANGE = EXCHANGE_CODES["NA"]
+
+COMPACT_MODELS = {"trades": TradesCompact, "quotes": QuotesCompact}
+EXCHANGE_COLUMNS = {"trades": ["exchange"], "quotes": ["ask_exchange", "bid_exchange"]}
+
+
+class _Dictionary:
+    """
+    Two-way mapping between the values of a lookup table and their small integer ids.
+
+    Ids are read lazily and new values are inserted on demand, on a connection of their own
+    committed right away: an id handed out is never rolled back with the batch that needed it.
+    """
+
+    def __init__(self, model, column):
+        self.model = model
+        self.column = getattr(model, column)
+        self.ids = {}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _load(self, connection, where):
+        for id_, value in connection.execute(select(self.model.id, self.column).where(where)):
+            self.ids[value] = id_
+            self.values[id_] = value
+
+    def encode(self, values, ssn, create=True):
+        """
+        Returns the ids of the given values, creating the missing ones unless create is False.
+
+        Returns:
+            dict: {value: id} for every value that has an id.
+        """
+        with self._lock:
+            missing = [value for value in values if value not in self.ids]
+            if missing:
+                with ssn.get_bind().begin() as connection:
+                    # other processes may have added them since they were last read
+                    self._load(connection, self.column.in_(missing))
+                    missing = [value for value in missing if value not in self.ids]
+                    if missing and create:
+                        dialect = connection.dialect.name
+                        insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+                        connection.execute(insert(self.model.__table__)
+                                           .on_conflict_do_nothing(index_elements=[self.column.name]),
+                                           [{self.column.key: value} for value in missing])
+                        self._load(connection, self.column.in_(missing))
+            return {value: self.ids[value] for value in values if value in self.ids}
+
+    def decode(self, ids, ssn):
+        """
+        Returns {id: value} for the given ids.
+        """
+        with self._lock:
+            missing = [int(id_) for id_ in ids if id_ not in self.values]
+            if missing:
+                with ssn.get_bind().begin() as connection:
+                    self._load(connection, self.model.id.in_(missing))
+            return {id_: self.values[id_] for id_ in ids if id_ in self.values}
+
+
+tickers = _Dictionary(TickerIds, "symbol")
+condition_sets = _Dictionary(ConditionSets, "conditions")
+
+
+def compact_model(mapper):
+    """
+    Returns the compact model storing the rows of a Trades or Quotes mapper, or None if the
+    compact schema is disabled or the mapper has no compact counterpart.
+    """
+    return COMPACT_MODELS.get(mapper.__tablename__) if COMPACT_SCHEMA else None
+
+
+def to_ns(value):
+    """
+    Returns a timestamp, or a Series of them, as ns since the epoch. Naive values are read as
+    New York wall time, the way they are stored in the row tables.
+    """
+    if value is None:
+        return None
+    if isinstance(value, pd.Series):
+        if not isinstance(value.dtype, pd.DatetimeTZDtype):
+            value = pd.to_datetime(value).dt.tz_localize(NY, ambiguous=False, nonexistent="shift_forward")
+        return value.dt.tz_convert("UTC").dt.tz_localize(None).dt.as_unit("ns").astype("int64")
+    value = pd.Timestamp(value)
+    if value.tzinfo is None:
+        value = value.tz_localize(NY, ambiguous=False, nonexistent="shift_forward")
+    return value.value
+
+
+def ticker_ids(symbols, ssn):
+    """
+    Returns {symbol: id} for the symbols that have rows in the compact tables.
+    """
+    return tickers.encode(symbols, ssn, create=False)
+
+
+def _codes(series):
+    codes = {value: EXCHANGE_CODES.get(getattr(value, "name", value), UNKNOWN_EXCHANGE)
+             for value in series.unique()}
+    return series.map(codes).fillna(UNKNOWN_EXCHANGE).astype("int16")
+
+
+def encode(mapper, df, ssn):
+    """
+    Translates rows of Trades or Quotes into rows of their compact model.
+
+    Every column keeps its name: tickers and condition sets become ids of ticker_ids and
+    condition_sets (new ones are registered), exchanges become their code and timestamps ns
+    since the epoch. Each distinct value is looked up once per batch.
+
+    Args:
+        mapper (class): Trades or Quotes (or their compact model).
+        df (DataFrame): The rows, as produced by normalize_batch or the stream decoders.
+        ssn (Session): Session whose engine holds the lookup tables.
+
+    Returns:
+        DataFrame: The rows to write to the compact model.
+    """
+    table = mapper.__tablename__.replace("_compact", "")
+    out = df.copy()
+    if "ticker" in df.columns:
+        ids = tickers.encode(list(df["ticker"].unique()), ssn)
+        out["ticker"] = df["ticker"].map(ids).astype("int16")
+    if "timestamp" in df.columns:
+        out["timestamp"] = to_ns(df["timestamp"]).to_numpy()
+    for column in EXCHANGE_COLUMNS[table]:
+        if column in df.columns:
+            out[column] = _codes(df[column])
+    if "conditions" in df.columns:
+        # a condition set is keyed by its codes joined in order, no conditions at all by ""
+        keys = df["conditions"].str.join(",")
+        ids = condition_sets.encode([key for key in keys.unique() if isinstance(key, str)], ssn)
+        out["conditions"] = keys.map(ids).astype("Int16")
+    return out
+
+
+def decode(mapper, df, ssn):
+    """
+    Translates rows read from a compact model back into the values Trades or Quotes hold.
+
+    Timestamps come back as naive New York wall time and the exchange of a trade as an Exch
+    member, as they are read from the row tables. Columns missing from the DataFrame are skipped.
+
+    Args:
+        mapper (class): The compact model (or Trades/Quotes) the rows were read from.
+        df (DataFrame): The rows, with the attribute names as columns.
+        ssn (Session): Session whose engine holds the lookup tables.
+
+    Returns:
+        DataFrame: The decoded rows.
+    """
+    table = mapper.__tablename__.replace("_compact", "")
+    out = df.copy()
+    if df.empty:
+        return out
+    if "ticker" in df.columns:
+        out["ticker"] = df["ticker"].map(tickers.decode(list(df["ticker"].unique()), ssn))
+    if "timestamp" in df.columns:
+        out["timestamp"] = (pd.to_datetime(df["timestamp"].astype("int64"), unit="ns", utc=True)
+                            .dt.tz_convert(NY).dt.tz_localize(None))
+    names = EXCHANGE_MEMBERS if table == "trades" else EXCHANGES
+    for column in EXCHANGE_COLUMNS[table]:
+        if column in df.columns:
+            out[column] = names[df[column].astype("int64").to_numpy()]
+    if "conditions" in df.columns:
+        ids = [id_ for id_ in df["conditions"].unique() if pd.notna(id_)]
+        sets = {id_: key.split(",") if key else [] for id_, key in condition_sets.decode(ids, ssn).items()}
+        out["conditions"] = df["conditions"].map(sets)
+    return out
@@ -1,29 +1,190 @@
+import sys
+import time
+from sqlalchemy import inspect, select, text
+from sqlalchemy.schema import CreateIndex
 from dbconnect import connect_to_database
-from models import Base
+from models import Base, SchemaMigrations
+from partitions import PARTITIONING, PARTITIONED_TABLES, mark_partitioned, is_partitioned, \
+    is_hypertable, create_hypertable, maintain_partitions
 
+# any number works as long as every migrating process uses the same one
+MIGRATION_LOCK = 7262021
 
-def migrate_models():
+
+def _index_name(connection, table, name):
+    preparer = connection.dialect.identifier_preparer
+    schema = preparer.quote_schema(table.schema) + "." if table.schema else ""
+    return schema + preparer.quote(name)
+
+
+def create_index_online(engine, index):
+    """
+    Creates a declared index if it does not exist yet, without blocking writes to its table.
+
+    On PostgreSQL the index is built with CREATE INDEX CONCURRENTLY; an invalid index left by an
+    interrupted build is dropped and built again. A partitioned table cannot be indexed
+    concurrently as a whole, so the index is created on the parent only, built concurrently on
+    every partition and each of those attached to it. Timescale does not build indexes
+    concurrently either; on a hypertable the index is built one chunk per transaction instead.
+    Other dialects use a plain CREATE INDEX.
+
+    Args:
+        engine: A SQLAlchemy engine.
+        index (Index): An index of a table in models.py.
+
+    Returns:
+        bool: True if the index was created.
+    """
+    table = index.table
+    if engine.dialect.name != "postgresql":
+        if index.name in {i["name"] for i in inspect(engine).get_indexes(table.name, schema=table.schema or None)}:
+            return False
+        index.create(engine)
+        return True
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        name = _index_name(connection, table, index.name)
+        valid = connection.execute(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                                   {"name": name}).scalar()
+        if valid:
+            return False
+        if valid is False:
+            connection.execute(text("DROP INDEX CONCURRENTLY {}".format(name)))
+        ddl = str(CreateIndex(index).compile(dialect=connection.dialect))
+        parent = connection.dialect.identifier_preparer.format_table(table)
+        if is_hypertable(connection, table):
+            connection.execute(text(ddl + " WITH (timescaledb.transaction_per_chunk)"))
+            return True
+        if not is_partitioned(connection, table):
+            connection.execute(text(ddl.replace(" INDEX ", " INDEX CONCURRENTLY ", 1)))
+            return True
+        connection.execute(text(ddl.replace(" ON {} ".format(parent), " ON ONLY {} ".format(parent), 1)))
+        children = connection.execute(text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                                           "WHERE i.inhparent = to_regclass(:name)"), {"name": parent}).scalars().all()
+        for child in children:
+            child_index = "{}_{}".format(child, index.name)[:63]
+            child_table = _index_name(connection, table, child)
+            connection.execute(text(ddl.replace(" INDEX ", " INDEX CONCURRENTLY IF NOT EXISTS ", 1)
+                                    .replace(connection.dialect.identifier_preparer.quote(index.name),
+                                             connection.dialect.identifier_preparer.quote(child_index), 1)
+                                    .replace(" ON {} ".format(parent), " ON {} ".format(child_table), 1)))
+            connection.execute(text("ALTER INDEX {} ATTACH PARTITION {}".format(
+                name, _index_name(connection, table, child_index))))
+        return True
+
+
+def create_missing_tables(engine, partitioning=PARTITIONING):
+    """
+    Creates the tables of models.py that do not exist yet, with their indexes. Existing tables
+    are never altered or rewritten; their missing indexes are built by create_missing_indexes.
+
+    New series tables are partitioned as set by ``partitioning`` (see partitions.py); existing
+    plain tables are left unpartitioned.
+    """
+    existing = set(inspect(engine).get_table_names(schema=Base.metadata.schema or None))
+    new = [table for table in Base.metadata.sorted_tables if table.name not in existing]
+    series = [table for table in new if table.name in PARTITIONED_TABLES]
+    if new:
+        print("creating tables {}".format(", ".join(table.name for table in new)))
+    if partitioning == "native":
+        mark_partitioned(series)
+    Base.metadata.create_all(engine, tables=new)
+    if partitioning == "timescale" and series:
+        with engine.begin() as connection:
+            connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS timescaledb")
+            for table in series:
+                create_hypertable(connection, table)
+
+
+def create_missing_indexes(engine, tables=None):
+    """
+    Builds the declared indexes of models.py that do not exist yet, online (see create_index_online).
+
+    Args:
+        engine: A SQLAlchemy engine.
+        tables (list, optional): The tables to index. Defaults to every existing table.
+    """
+    if tables is None:
+        existing = set(inspect(engine).get_table_names(schema=Base.metadata.schema or None))
+        tables = [table for table in Base.metadata.sorted_tables if table.name in existing]
+    for table in tables:
+        for index in table.indexes:
+            if create_index_online(engine, index):
+                print("created index {}".format(index.name))
+
+
+# schema changes in the order they are applied, each one exactly once and recorded in
+# schema_migrations, called as migration(engine, partitioning). Migrations only add to the
+# schema: anything that would drop or rewrite a table belongs behind an explicit flag, not here.
+MIGRATIONS = [
+    (1, "create missing tables", create_missing_tables),
+    (2, "index series tables on (ticker, timestamp desc) and timestamp (BRIN)",
+     lambda engine, partitioning: create_missing_indexes(engine)),
+]
+
+
+def migrate_models(partitioning=PARTITIONING):
     """
     Function to migrate database models
 
+    Applies the migrations that are not recorded in schema_migrations yet, so a deploy only does
+    the work of the changes it brings, whatever the size of the data. A database created before
+    migrations were versioned is detected by its tables, which are kept. Concurrent runs wait
+    for each other on an advisory lock. With native partitioning, the partitions ahead are
+    created and the expired ones dropped on every run (see partitions.maintain_partitions).
+
+    Args:
+    partitioning (str): "none", "native" or "timescale" for newly created series tables.
+        Defaults to DB_PARTITIONING.
+
     Returns:
     None
     """
+    if partitioning not in ("none", "native", "timescale"):
+        raise ValueError("Enter a valid input for partitioning parameter valid inputs are [none,native,timescale]")
     engine = connect_to_database(get_engine_only=True)
+    lock = engine.connect()
     try:
-        Base.metadata.create_all(engine)
-        print("migrations completed")
-    except Exception as e:
-        raise e
+        if engine.dialect.name == "postgresql":
+            lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK})
+            lock.commit()
+        SchemaMigrations.__table__.create(engine, checkfirst=True)
+        with engine.connect() as connection:
+            applied = set(connection.execute(select(SchemaMigrations.version)).scalars())
+        for version, name, migration in MIGRATIONS:
+            if version in applied:
+                continue
+            began = time.perf_counter()
+            migration(engine, partitioning)
+            with engine.begin() as connection:
+                connection.execute(SchemaMigrations.__table__.insert(), {"version": version, "name": name})
+            print("migration {} ({}) applied in {:.1f}s".format(version, name, time.perf_counter() - began))
+        if partitioning == "native":
+            tables = [table for table in Base.metadata.sorted_tables if table.name in PARTITIONED_TABLES]
+            print("partitions created and dropped: {}".format(maintain_partitions(engine, tables)))
+        print("migrations completed, schema at version {}".format(max(version for version, _, _ in MIGRATIONS)))
+    finally:
+        if engine.dialect.name == "postgresql":
+            lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK})
+            lock.commit()
+        lock.close()
 
 
-def clean_db():
+def clean_db(confirm=False):
     """
     Function to clean the database
 
+    Drops every table of models.py with all its data. Only run with confirm=True, e.g. through
+    ``python db_migrate.py --drop-all``.
+
+    Args:
+    confirm (bool): Must be True for anything to be dropped.
+
     Returns:
     None
     """
+    if not confirm:
+        raise ValueError("clean_db drops every table and its data, call it with confirm=True to proceed")
     engine = connect_to_database(get_engine_only=True)
     try:
         Base.metadata.drop_all(engine)
@@ -32,5 +193,8 @@ def clean_db():
         raise e
 
 
-clean_db()
-migrate_models()
+if __name__ == "__main__":
+    # python db_migrate.py [--drop-all]: tables are only dropped when asked explicitly
+    if "--drop-all" in sys.argv[1:]:
+        clean_db(confirm=True)
+    migrate_models()
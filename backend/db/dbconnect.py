@@ -1,17 +1,70 @@
 import os
+import atexit
+import threading
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 
 #load the env variables
 load_dotenv()
 
+# connection pool settings, ignored for SQLite
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+
+# engines and session factories are created once per DB_URL and shared by the whole process
+_engines = {}
+_sessions = {}
+_lock = threading.Lock()
+_stats = {"engines_created": 0, "connections_opened": 0}
+
+
+def _count_connection(dbapi_connection, connection_record):
+    with _lock:
+        _stats["connections_opened"] += 1
+
+
+def get_engine(db_url=None):
+    """
+    Returns the process-wide engine for the given database URL, creating it on first use.
+
+    Args:
+        db_url (str, optional): The database URL. Defaults to the DB_URL environment variable.
+
+    Returns:
+        engine: A SQLAlchemy engine object.
+    """
+    db_url = str(db_url or os.environ["DB_URL"])
+    engine = _engines.get(db_url)
+    if engine is not None:
+        return engine
+    with _lock:
+        if db_url not in _engines:
+            options = {}
+            if make_url(db_url).get_backend_name() != "sqlite":
+                options = dict(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                               pool_pre_ping=POOL_PRE_PING, pool_recycle=POOL_RECYCLE)
+            engine = create_engine(db_url, echo=False, **options)
+            event.listen(engine, "connect", _count_connection)
+            _engines[db_url] = engine
+            _sessions[db_url] = sessionmaker(engine, expire_on_commit=False)
+            _stats["engines_created"] += 1
+            print("Connection Established!")
+        return _engines[db_url]
+
+
 def connect_to_database(get_engine_only=False):
     """
     Connect to a database using the DB_URL environment variable.
 
+    The engine, its connection pool and the session factory are cached per DB_URL, so only the
+    first call of a process actually sets them up.
+
     Args:
-        get_engine_only (bool, optional): If True, return only the SQLAlchemy engine object. If False (default), 
+        get_engine_only (bool, optional): If True, return only the SQLAlchemy engine object. If False (default),
             return a SQLAlchemy session object.
 
     Returns:
@@ -22,21 +75,55 @@ def connect_to_database(get_engine_only=False):
     """
 
     try:
-        # Get the DB_URL from the environment variables
-        db_url = os.environ["DB_URL"]
-        # Create a SQLAlchemy engine object with the DB_URL
-        engine = create_engine(str(db_url), echo=False)
+        # Get the cached engine object for the DB_URL
+        engine = get_engine()
 
         if get_engine_only:
             # If get_engine_only is True, return only the engine object
             return engine
-        
-        # Otherwise, create a session factory object that uses the engine object
-        session = sessionmaker(engine, expire_on_commit=False)
-        print("Connection Established!")
-        # Return the session factory object
-        return session
+
+        # Otherwise, return the session factory object that uses the engine object
+        return _sessions[str(os.environ["DB_URL"])]
 
     except Exception as e:
         # If there is an error connecting to the database, raise a ConnectionError
         raise ConnectionError("There is some error connecting to data base")
+
+
+def connection_stats():
+    """
+    Returns how many engines were created and how many DBAPI connections they opened.
+
+    Returns:
+        dict: {"engines_created": int, "connections_opened": int}
+    """
+    with _lock:
+        return dict(_stats)
+
+
+def dispose_engines():
+    """
+    Closes every pooled connection and forgets the cached engines and session factories.
+    """
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _sessions.clear()
+
+
+def reset_after_fork():
+    """
+    Forgets the engines inherited from a parent process without closing their connections.
+
+    A forked child must open its own connections: the inherited ones still belong to the
+    parent, so they are dropped with dispose(close=False) instead of being closed.
+    """
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose(close=False)
+        _engines.clear()
+        _sessions.clear()
+
+
+atexit.register(dispose_engines)
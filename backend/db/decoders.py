@@ -0,0 +1,76 @@
+from operator import itemgetter
+import pandas as pd
+
+NY = 'America/New_York'
+
+# column order of the tuples produced by the decoders, named after the model attributes
+BAR_COLUMNS = ("ticker", "timestamp", "open", "high", "low", "close", "volume", "trade_count", "vwap")
+TRADE_COLUMNS = ("ticker", "timestamp", "exchange", "price", "size", "conditions", "tape", "trade_id")
+QUOTE_COLUMNS = ("ticker", "timestamp", "ask_exchange", "ask_price", "ask_size",
+                 "bid_exchange", "bid_price", "bid_size", "conditions")
+
+
+def _fields(*names):
+    """
+    Returns a function reading the given fields of an entity's _raw dict into a tuple.
+
+    Some fields are optional (vwap and trade_count of a bar, the conditions of a trade or
+    quote); a message without them gets None in their place instead of raising KeyError.
+    Messages almost always carry every field, so the itemgetter is tried first.
+    """
+    get_all = itemgetter(*names)
+
+    def fields(raw):
+        try:
+            return get_all(raw)
+        except KeyError:
+            return tuple(map(raw.get, names))
+    return fields
+
+
+# the same fields under the names alpaca_trade_api.stream gives them in an entity's _raw dict
+_bar_fields = _fields("symbol", "timestamp", "open", "high", "low", "close", "volume", "trade_count", "vwap")
+_trade_fields = _fields("symbol", "timestamp", "exchange", "price", "size", "conditions", "tape", "id")
+_quote_fields = _fields("symbol", "timestamp", "ask_exchange", "ask_price", "ask_size",
+                        "bid_exchange", "bid_price", "bid_size", "conditions")
+
+
+def decode_bar(bar):
+    """
+    Turns a stream Bar entity into a tuple ordered like BAR_COLUMNS.
+
+    The timestamp stays in integer nanoseconds since the epoch (UTC); rows_to_frame converts a
+    whole batch at once.
+    """
+    return _bar_fields(bar._raw)
+
+
+def decode_trade(trade):
+    """
+    Turns a stream Trade entity into a tuple ordered like TRADE_COLUMNS.
+    """
+    return _trade_fields(trade._raw)
+
+
+def decode_quote(quote):
+    """
+    Turns a stream Quote entity into a tuple ordered like QUOTE_COLUMNS.
+    """
+    return _quote_fields(quote._raw)
+
+
+def rows_to_frame(rows, columns):
+    """
+    Builds the DataFrame of a batch of decoded rows, converting the nanosecond timestamps to
+    New York time in one vectorized step.
+
+    Args:
+        rows (list): Tuples produced by one of the decoders.
+        columns (tuple): The matching *_COLUMNS tuple.
+
+    Returns:
+        DataFrame: One column per model attribute, ready for insert_into_database.
+    """
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="ns", utc=True).dt.tz_convert(NY)
+    return df
@@ -0,0 +1,141 @@
+import os
+from datetime import date, datetime, timedelta, timezone
+from dotenv import load_dotenv
+import pandas as pd
+import pyarrow.parquet as pq
+
+load_dotenv()
+
+# historical responses are kept under this directory, one Parquet file per symbol and day
+CACHE_DIR = os.environ.get('APCA_CACHE_DIR', os.path.join(os.path.expanduser("~"), ".cache", "data-alpaca"))
+DISK_CACHE = os.environ.get('APCA_DISK_CACHE', 'false').lower() == 'true'
+# a day is only cached once this many hours have passed since its end, so late corrections are not missed
+SETTLE_HOURS = float(os.environ.get('APCA_CACHE_SETTLE_HOURS', 6))
+
+
+def _path(data_type, symbol, timeframe, day, suffix=".parquet"):
+    """
+    Returns the file of one (data type, symbol, timeframe, day), laid out as hive-style partitions.
+
+    Days without any rows are recorded as an empty file with the ".empty" suffix instead.
+    """
+    return os.path.join(CACHE_DIR, str(getattr(data_type, "value", data_type)).lower(),
+                        "timeframe={}".format(timeframe.value if timeframe else "none"),
+                        "symbol={}".format(symbol), "date={}{}".format(day.isoformat(), suffix))
+
+
+def bounds(start, end):
+    """
+    Returns the first and last UTC timestamps of a request, both included, the way the API reads them.
+
+    A 'YYYY-MM-DD' end covers that whole day, an RFC 3339 end is taken as is.
+    """
+    first, last = (pd.Timestamp(value) for value in (start, end))
+    first, last = (value.tz_localize("UTC") if value.tzinfo is None else value.tz_convert("UTC")
+                   for value in (first, last))
+    if len(end) == 10:
+        last = last + pd.Timedelta(days=1) - pd.Timedelta(nanoseconds=1)
+    return first, last
+
+
+def days_between(start, end):
+    """
+    Returns the UTC days a request touches, from the day of start to the day of end, both included.
+    """
+    first, last = bounds(start, end)
+    first, last = first.date(), last.date()
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def trim(df, start, end):
+    """
+    Returns the rows of a DataFrame indexed by UTC timestamp that fall within the request.
+
+    Whole days are cached and fetched, so the first and last day may hold rows outside of it.
+    """
+    if not len(df):
+        return df
+    first, last = bounds(start, end)
+    return df[(df.index >= first) & (df.index <= last)]
+
+
+def is_closed(day):
+    """
+    Returns True if no more data can arrive for the given (UTC) day.
+    """
+    day_end = datetime.combine(day + timedelta(days=1), datetime.min.time(), timezone.utc)
+    return datetime.now(timezone.utc) >= day_end + timedelta(hours=SETTLE_HOURS)
+
+
+def day_range(first, last):
+    """
+    Returns the API (start, end) covering the days first to last, both included.
+    """
+    end = datetime.combine(last + timedelta(days=1), datetime.min.time()) - timedelta(microseconds=1)
+    return first.isoformat(), end.isoformat() + "Z"
+
+
+def load(data_type, symbol, timeframe, start, end):
+    """
+    Reads the cached days of a request and works out which days still have to be fetched.
+
+    Days are UTC days, the way the API interprets 'YYYY-MM-DD' dates, and the end is included like
+    it is by the API (see bounds).
+
+    Args:
+        data_type (DataType): The type of data requested.
+        symbol (str): The symbol requested.
+        timeframe (TimeFrame): The timeframe of bars, None for trades and quotes.
+        start (str): The start of the request in 'YYYY-MM-DD' format or as an RFC 3339 timestamp.
+        end (str): The end of the request in 'YYYY-MM-DD' format or as an RFC 3339 timestamp.
+
+    Returns:
+        tuple: (frames, missing) where frames are the DataFrames read from disk and missing is a
+            list of (first day, last day) runs of consecutive days that are not cached.
+    """
+    paths = []
+    missing = []
+    for day in days_between(start, end):
+        path = _path(data_type, symbol, timeframe, day)
+        if os.path.exists(path):
+            paths.append(path)
+        elif os.path.exists(_path(data_type, symbol, timeframe, day, ".empty")):
+            continue
+        elif missing and missing[-1][1] == day - timedelta(days=1):
+            missing[-1] = (missing[-1][0], day)
+        else:
+            missing.append((day, day))
+    # all days of the symbol are read as one dataset, the directory names are not turned into columns
+    frames = [pq.read_table(paths, partitioning=None).to_pandas()] if paths else []
+    return frames, missing
+
+
+def store(data_type, symbol, timeframe, df, first, last):
+    """
+    Writes the closed days first to last (both included) of a fetched DataFrame to disk.
+
+    Days without rows are recorded too, so that they are not requested again either.
+
+    Args:
+        data_type (DataType): The type of data fetched.
+        symbol (str): The symbol fetched.
+        timeframe (TimeFrame): The timeframe of bars, None for trades and quotes.
+        df (DataFrame): The fetched rows, indexed by their UTC timestamp.
+        first (date): The first day the fetch covered.
+        last (date): The last day the fetch covered.
+    """
+    days = df.index.tz_convert("UTC").date if len(df) else []
+    for i in range((last - first).days + 1):
+        day = first + timedelta(days=i)
+        if not is_closed(day):
+            break
+        rows = df[days == day] if len(df) else df
+        path = _path(data_type, symbol, timeframe, day, ".parquet" if len(rows) else ".empty")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write next to the target and rename, so an interrupted run never leaves a partial day
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        if len(rows):
+            rows.to_parquet(tmp)
+        else:
+            open(tmp, "w").close()
+        os.replace(tmp, path)
@@ -1,14 +1,280 @@
-from sqlite3 import IntegrityError
+import io
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import ARRAY, insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from dbconnect import connect_to_database
+from query_cache import query_cache, TICKER_COLUMNS
+from compact import compact_model, encode as encode_compact
+from partitions import ensure_partitions
 
-def insert_into_database(mapper, data, ssn=None):
+# number of rows rendered to CSV at a time while streaming a COPY
+COPY_CHUNK_ROWS = 100000
+# batches of at least this many rows are upserted through a COPY-filled staging table
+UPSERT_STAGING_ROWS = 1000
+
+
+class _IteratorFile(io.TextIOBase):
+    """
+    Read-only file object over an iterator of strings, so psycopg2's copy_expert can pull
+    the CSV lazily instead of from one buffer holding the whole batch.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _pg_array(values):
+    """
+    Renders a list as a Postgres array literal, e.g. ['@', 'T'] -> {"@","T"}.
+    """
+    if not isinstance(values, (list, tuple)):
+        return values
+    items = ('"{}"'.format(str(v).replace('\\', '\\\\').replace('"', '\\"')) for v in values)
+    return "{" + ",".join(items) + "}"
+
+
+def _to_frame(data):
+    """
+    Returns a DataFrame for a DataFrame, a pyarrow Table/RecordBatch or a list of dicts.
+    """
+    if isinstance(data, pd.DataFrame):
+        return data
+    if hasattr(data, "to_pandas"):
+        return data.to_pandas()
+    return pd.DataFrame.from_records(data)
+
+
+def _mapped_columns(mapper, df):
+    """
+    Returns (attribute key, table column) pairs of the mapper that are present in the DataFrame.
+    """
+    return [(attr.key, attr.columns[0]) for attr in inspect(mapper).column_attrs
+            if attr.key in df.columns]
+
+
+def _wall_time(df):
+    """
+    Returns the DataFrame with tz-aware timestamp columns replaced by their naive local wall time.
+
+    The models use TIMESTAMP WITHOUT TIME ZONE and the stream handlers convert to New York time,
+    so the wall time is what is stored whichever driver or load path is used.
+    """
+    aware = {key: df[key].dt.tz_localize(None) for key in df.columns
+             if isinstance(df[key].dtype, pd.DatetimeTZDtype)}
+    return df.assign(**aware) if aware else df
+
+
+def _records(mapper, df):
+    """
+    Returns the DataFrame as a list of dicts holding only the mapper's attributes, keyed by
+    column name for Core inserts, NaN as None.
+    """
+    columns = _mapped_columns(mapper, df)
+    records = _wall_time(df[[key for key, _ in columns]]).astype(object)
+    records = records.where(records.notna(), None)
+    records.columns = [column.name for _, column in columns]
+    return records.to_dict(orient="records")
+
+
+def _csv_chunks(df, columns, chunk_rows):
+    """
+    Yields the given columns of the DataFrame as CSV text, ``chunk_rows`` rows at a time.
+    """
+    keys = [key for key, _ in columns]
+    arrays = [key for key, column in columns if isinstance(column.type, ARRAY)]
+    for start in range(0, len(df), chunk_rows):
+        chunk = _wall_time(df.iloc[start:start + chunk_rows][keys])
+        if arrays:
+            chunk = chunk.assign(**{key: chunk[key].map(_pg_array) for key in arrays})
+        yield chunk.to_csv(header=False, index=False)
+
+
+def _copy_frame(connection, target, columns, df, chunk_rows):
+    """
+    Streams the given columns of the DataFrame into ``target`` with COPY FROM STDIN.
+    """
+    preparer = connection.dialect.identifier_preparer
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        target, ", ".join(preparer.quote(column.name) for _, column in columns))
+    chunks = _csv_chunks(df, columns, chunk_rows)
+    cursor = connection.connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):
+            # psycopg2
+            cursor.copy_expert(sql, _IteratorFile(chunks))
+        else:
+            # psycopg 3
+            with cursor.copy(sql) as copy:
+                for chunk in chunks:
+                    copy.write(chunk)
+    except Exception as e:
+        # raw cursors bypass SQLAlchemy's exception wrapping, so do it here for constraint errors
+        dbapi = getattr(connection.dialect, "loaded_dbapi", None) or connection.dialect.dbapi
+        if isinstance(e, dbapi.IntegrityError):
+            raise IntegrityError(sql, None, e) from e
+        raise
+    finally:
+        cursor.close()
+
+
+def bulk_load(mapper, data, ssn, chunk_rows=COPY_CHUNK_ROWS):
+    """
+    Loads a DataFrame or Arrow batch into the mapper's table without building a dict per row.
+
+    On PostgreSQL the rows are streamed with COPY FROM STDIN in CSV format; other dialects fall
+    back to a single executemany. The caller is responsible for committing.
+
+    Parameters:
+    mapper (class): The SQLAlchemy mapper for the table to insert data into.
+    data (DataFrame): A pandas DataFrame or pyarrow Table/RecordBatch with one column per attribute.
+    ssn (Session): SQLAlchemy Session object to use for the transaction.
+    chunk_rows (int): Number of rows rendered to CSV at a time.
+
+    Returns:
+    int: The number of rows loaded.
+    """
+    df = _to_frame(data)
+    if df.empty:
+        return 0
+    connection = ssn.connection()
+
+    if connection.dialect.name != "postgresql":
+        ssn.execute(mapper.__table__.insert(), _records(mapper, df))
+        return len(df)
+
+    target = connection.dialect.identifier_preparer.format_table(mapper.__table__)
+    _copy_frame(connection, target, _mapped_columns(mapper, df), df, chunk_rows)
+    return len(df)
+
+
+def upsert(mapper, data, ssn, on_conflict="update", chunk_rows=COPY_CHUNK_ROWS):
+    """
+    Inserts rows, resolving conflicts on the table's primary key in the database itself.
+
+    The primary keys declared in models.py are used as conflict target. For Trades it is
+    covered by the wider UniqueConstraint, so no row can violate that constraint without also
+    conflicting on the key. On PostgreSQL large batches are copied into a temporary staging
+    table and merged with a single INSERT ... SELECT ... ON CONFLICT; small batches and other
+    dialects (SQLite) use one executemany of INSERT ... ON CONFLICT. The caller is responsible
+    for committing.
+
+    Parameters:
+    mapper (class): The SQLAlchemy mapper for the table to insert data into.
+    data (list or DataFrame): A list of dicts, a DataFrame or a pyarrow Table/RecordBatch.
+    ssn (Session): SQLAlchemy Session object to use for the transaction.
+    on_conflict (str): "update" overwrites the non-key columns of existing rows, "nothing" keeps them.
+    chunk_rows (int): Number of rows rendered to CSV at a time.
+
+    Returns:
+    int: The number of rows sent to the database.
+    """
+    if on_conflict not in ("update", "nothing"):
+        raise ValueError("Enter a valid input for on_conflict parameter valid inputs are [update,nothing]")
+    df = _to_frame(data)
+    if df.empty:
+        return 0
+    table = mapper.__table__
+    connection = ssn.connection()
+    dialect = connection.dialect.name
+    columns = _mapped_columns(mapper, df)
+    keys = [column.name for column in table.primary_key.columns]
+    updates = [column.name for _, column in columns if column.name not in keys]
+    if not updates:
+        on_conflict = "nothing"
+    # rows of one statement may not conflict with each other, so keep the last of each key
+    key_attrs = [key for key, column in columns if column.name in keys]
+    df = df.drop_duplicates(subset=key_attrs, keep="last")
+
+    if dialect == "postgresql" and len(df) >= UPSERT_STAGING_ROWS:
+        preparer = connection.dialect.identifier_preparer
+        target = preparer.format_table(table)
+        staging = preparer.quote("staging_" + table.name)
+        names = ", ".join(preparer.quote(column.name) for _, column in columns)
+        ssn.execute(text("CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP"
+                         .format(staging, target)))
+        _copy_frame(connection, staging, columns, df, chunk_rows)
+        conflict = "ON CONFLICT ({}) ".format(", ".join(preparer.quote(k) for k in keys))
+        if on_conflict == "update":
+            conflict += "DO UPDATE SET " + ", ".join(
+                "{0} = EXCLUDED.{0}".format(preparer.quote(name)) for name in updates)
+        else:
+            conflict += "DO NOTHING"
+        # keys distinct in pandas can still collide once stored (e.g. timestamps are truncated to
+        # microseconds): DISTINCT ON keeps the last copied of them, the staging table being in COPY order
+        key_names = ", ".join(preparer.quote(k) for k in keys)
+        ssn.execute(text("INSERT INTO {0} ({1}) SELECT DISTINCT ON ({2}) {1} FROM {3} ORDER BY {2}, ctid DESC {4}".format(
+            target, names, key_names, staging, conflict)))
+        ssn.execute(text("DROP TABLE {}".format(staging)))
+        return len(df)
+
+    if dialect == "postgresql":
+        stmt = postgresql_insert(table)
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(table)
+    else:
+        raise NotImplementedError("Upserts are not supported on {}".format(dialect))
+    if on_conflict == "update":
+        stmt = stmt.on_conflict_do_update(index_elements=keys,
+                                          set_={name: stmt.excluded[name] for name in updates})
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+    ssn.execute(stmt, _records(mapper, df))
+    return len(df)
+
+
+def _written_tickers(data):
+    """
+    Returns the set of symbols a batch writes to, or None if its rows carry no symbol column.
+    """
+    if isinstance(data, pd.DataFrame):
+        column = next((c for c in TICKER_COLUMNS if c in data.columns), None)
+        return None if column is None else set(data[column].unique())
+    if hasattr(data, "column_names"):
+        column = next((c for c in TICKER_COLUMNS if c in data.column_names), None)
+        return None if column is None else set(data.column(column).to_pylist())
+    column = next((c for c in TICKER_COLUMNS if data and c in data[0]), None)
+    return None if column is None else {row[column] for row in data}
+
+
+def _write(mapper, data, ssn, on_conflict):
+    if on_conflict is None:
+        bulk_load(mapper, data, ssn)
+    else:
+        upsert(mapper, data, ssn, on_conflict)
+
+
+def insert_into_database(mapper, data, ssn=None, on_conflict="update", raise_errors=False):
     """
     Inserts or updates records into a database using the provided mapper and data.
 
     Parameters:
     mapper (class): The SQLAlchemy mapper for the table to insert data into.
-    data (list): A list of dictionaries representing the data to insert.
+    data (list or DataFrame): A list of dictionaries representing the data to insert, or a
+        DataFrame/Arrow batch which is bulk loaded with COPY.
     ssn (Session): Optional SQLAlchemy Session object to use for the transaction.
+    on_conflict (str): "update" (default) or "nothing" to upsert on the primary key (see upsert),
+        None for a plain bulk insert that fails on duplicates (see bulk_load).
+    raise_errors (bool): Re-raise constraint violations after the rollback instead of printing them.
+
+    With DB_COMPACT_SCHEMA enabled, rows of Trades and Quotes are encoded and written to their
+    compact model instead (see compact.py).
 
     Returns:
     None
@@ -20,19 +286,30 @@ def insert_into_database(mapper, data, ssn=None):
         ssn = db_engine()
 
     try:
-        # Attempt to insert the data into the database
-        ssn.bulk_insert_mappings(mapper, data)
+        target, rows = mapper, data
+        model = compact_model(mapper)
+        if model is not None:
+            target, rows = model, encode_compact(mapper, _to_frame(data), ssn)
+        try:
+            _write(target, rows, ssn, on_conflict)
+        except IntegrityError as e:
+            if "no partition of relation" not in str(e.orig):
+                raise
+            # a partitioned table without a partition for these rows yet, e.g. a backfill of old data
+            ssn.rollback()
+            ensure_partitions(ssn.connection(), target.__table__, _to_frame(rows)["timestamp"])
+            _write(target, rows, ssn, on_conflict)
         ssn.commit()
+        # drop the cached query results this batch made stale
+        query_cache.invalidate(mapper.__tablename__, _written_tickers(data))
         print("Records added")
 
+    except IntegrityError as e:
+        # If the rows still violate a constraint (e.g. a missing stock), print an error message
+        ssn.rollback()
+        if raise_errors:
+            raise
+        print("There was an error adding data to the database:\n{}".format(e))
     except:
-        # If inserting fails, roll back the transaction and try updating instead
         ssn.rollback()
-        try:
-            print("Updating records")
-            ssn.bulk_update_mappings(mapper, data)
-            ssn.commit()
-            print("Records updated")
-        except IntegrityError as e:
-            # If updating fails due to an integrity error, print an error message
-            print("There was an error adding data to the database:\n{}".format(e))
+        raise
@@ -0,0 +1,97 @@
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+NY = ZoneInfo('America/New_York')
+
+
+class LatestCache:
+    """
+    Keeps the most recent row of every symbol seen by a stream handler.
+
+    Rows are stored as dicts shaped like the query results of DataRetrievalController (timestamp
+    as naive New York time, Enum columns as their members), so a snapshot of thousands of symbols
+    is a dict lookup per symbol.
+    """
+
+    def __init__(self, columns, converters=None):
+        """
+        Args:
+            columns (tuple): Column names of the decoded tuples passed to update().
+            converters (dict, optional): {column: function} applied to the decoded values of those
+                columns, to give them the type the database returns.
+        """
+        self.columns = columns
+        self.converters = converters or {}
+        self._rows = {}
+        self._nanos = {}
+        self._lock = threading.Lock()
+
+    def update(self, row):
+        """
+        Records a decoded row (see decoders.py) unless a newer one is already cached for its symbol.
+        """
+        symbol, nanos = row[0], row[1]
+        if nanos < self._nanos.get(symbol, -1):
+            return
+        record = dict(zip(self.columns, row))
+        record["timestamp"] = datetime.fromtimestamp(nanos // 1000 / 1e6, NY).replace(tzinfo=None)
+        for column, convert in self.converters.items():
+            record[column] = convert(record[column])
+        with self._lock:
+            self._nanos[symbol] = nanos
+            self._rows[symbol] = record
+
+    def get(self, symbol):
+        """
+        Returns the latest cached row of a symbol, or None.
+        """
+        return self._rows.get(symbol)
+
+    def snapshot(self, symbols=None):
+        """
+        Returns {symbol: row} for the given symbols that are cached, or for every cached symbol.
+        """
+        if symbols is None:
+            with self._lock:
+                return dict(self._rows)
+        get = self._rows.get
+        return {symbol: row for symbol in symbols if (row := get(symbol)) is not None}
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._nanos.clear()
+
+
+# one cache per table name, the controller looks them up by the __tablename__ of its mapper
+_caches = {}
+
+
+def _converters(model):
+    """
+    Returns {column: function} turning the names the stream sends for the Enum columns of a model
+    (the exchange letter of a trade) into the members a query of that column returns.
+    """
+    return {column.key: lambda value, members=column.type.enum_class.__members__: members.get(value, value)
+            for column in model.__table__.columns if getattr(column.type, "enum_class", None) is not None}
+
+
+def register(model, columns):
+    """
+    Returns the cache of the given model's table, creating it on first use.
+
+    Args:
+        model (class): The model the rows belong to.
+        columns (tuple): Column names of the decoded tuples passed to update().
+    """
+    if model.__tablename__ not in _caches:
+        _caches[model.__tablename__] = LatestCache(columns, _converters(model))
+    return _caches[model.__tablename__]
+
+
+def lookup(table):
+    """
+    Returns the cache of the given table, or None if no stream handler of this process fills it.
+    """
+    return _caches.get(table)
@@ -3,7 +3,7 @@ import sys,os,pathlib
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import  BigInteger, inspect,MetaData
-from sqlalchemy import Column, Integer, String,DateTime,UniqueConstraint, ForeignKey, Boolean, Float, Enum,TIMESTAMP
+from sqlalchemy import Column, Integer, String,DateTime,UniqueConstraint, ForeignKey, Boolean, Float, Enum,TIMESTAMP,SmallInteger,Index
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import func
@@ -197,6 +197,104 @@ class Quotes(Base):
 
 
 
+# Index layout of the series tables. Every accessor filters by ticker and reads a time window
+# or the latest rows (the relationships of Stocks order by timestamp desc):
+# - bars: the (ticker, timestamp) primary key serves both, the latest rows by a backward scan.
+# - trades: the primary key does not start with the ticker, so (ticker, timestamp desc) is added,
+#   covering price and size for index-only scans of the last prices.
+# - quotes: the primary key starts with (ticker, timestamp) but holds six more columns; the
+#   narrow (ticker, timestamp desc) index reads a fraction of its pages for the same scan.
+# - the large tables also get a BRIN index on timestamp, a few pages per GB, for the time
+#   window queries across tickers, as rows are inserted roughly in time order.
+Index("ix_trades_ticker_timestamp", Trades.ticker, Trades.timestamp.desc(), postgresql_include=["price", "size"])
+Index("ix_quotes_ticker_timestamp", Quotes.ticker, Quotes.timestamp.desc())
+Index("ix_bars_minute_timestamp_brin", BarMinute.timestamp, postgresql_using="brin")
+Index("ix_trades_timestamp_brin", Trades.timestamp, postgresql_using="brin")
+Index("ix_quotes_timestamp_brin", Quotes.timestamp, postgresql_using="brin")
+
+
+
+# Compact schema (see compact.py): trades and quotes stored with fixed-width codes instead of strings.
+# The attribute names are those of Trades and Quotes so queries are built the same way, only the values differ.
+
+# SQLite only autoincrements INTEGER PRIMARY KEY columns
+SmallId = SmallInteger().with_variant(Integer, "sqlite")
+
+
+class TickerIds(Base):
+    #table_names
+    __tablename__="ticker_ids"
+
+    #primary_key
+    id=Column("id",SmallId,primary_key=True,autoincrement=True)
+
+    #foreign_key
+    symbol=Column("symbol",ForeignKey('stocks.symbol',onupdate='CASCADE'),unique=True,nullable=False)
+
+    def toDict(self):
+        return { c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs }
+
+
+class ConditionSets(Base):
+    #table_names
+    __tablename__="condition_sets"
+
+    #primary_key
+    id=Column("id",SmallId,primary_key=True,autoincrement=True)
+
+    #columns
+    conditions=Column("conditions",String,unique=True,nullable=False)
+
+    def toDict(self):
+        return { c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs }
+
+
+class TradesCompact(Base):
+    #table_names
+    __tablename__="trades_compact"
+
+    #primary_key, ticker first so it doubles as the (ticker, timestamp) index
+    ticker=Column("ticker_id",ForeignKey('ticker_ids.id'),primary_key=True)
+    timestamp=Column("timestamp",BigInteger,primary_key=True)
+    exchange=Column("exchange",SmallInteger,primary_key=True)
+    trade_id=Column("trade_id",BigInteger,primary_key=True)
+
+    #columns
+    price=Column("price",Float)
+    size=Column("size",Float)
+    conditions=Column("condition_id",ForeignKey('condition_sets.id'))
+    tape=Column("tape",String(1))
+
+    def toDict(self):
+        return { c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs }
+
+
+class QuotesCompact(Base):
+    #table_names
+    __tablename__="quotes_compact"
+
+    #primary_key
+    ticker=Column("ticker_id",ForeignKey('ticker_ids.id'),primary_key=True)
+    timestamp=Column("timestamp",BigInteger,primary_key=True)
+    ask_exchange=Column("ask_exchange",SmallInteger,primary_key=True)
+    ask_price=Column("ask_price",Float,primary_key=True)
+    ask_size=Column("ask_size",Integer,primary_key=True)
+    bid_exchange=Column("bid_exchange",SmallInteger,primary_key=True)
+    bid_price=Column("bid_price",Float,primary_key=True)
+    bid_size=Column("bid_size",Integer,primary_key=True)
+
+    #columns
+    conditions=Column("condition_id",ForeignKey('condition_sets.id'))
+
+    def toDict(self):
+        return { c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs }
+
+
+# their (ticker_id, timestamp) primary keys are already narrow, only the BRIN indexes are added
+Index("ix_trades_compact_timestamp_brin", TradesCompact.timestamp, postgresql_using="brin")
+Index("ix_quotes_compact_timestamp_brin", QuotesCompact.timestamp, postgresql_using="brin")
+
+
 class Crons(Base):
     #table_names
     __tablename__="crons"
@@ -217,3 +315,19 @@ class Crons(Base):
    
     def toDict(self):
         return { c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs }
+
+
+
+class SchemaMigrations(Base):
+    #table_names
+    __tablename__="schema_migrations"
+
+    #primary_key
+    version=Column("version",Integer,primary_key=True,autoincrement=False)
+
+    #columns
+    name=Column("name",String)
+    applied_at=Column("applied_at",DateTime(timezone=True),server_default=func.now())
+
+    def toDict(self):
+        return { c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs }
@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from alpaca_trade_api.rest import TimeFrame
+from dotenv import load_dotenv
+import api
+from backfill_job import BackfillJob, REPORT_INTERVAL
+from dbconnect import reset_after_fork
+from ratelimit import RATE_LIMIT, TokenBucket
+
+load_dotenv()
+
+# number of worker processes, one per core by default
+BACKFILL_PROCESSES = int(os.environ.get('BACKFILL_PROCESSES', os.cpu_count() or 1))
+
+
+def shard_symbols(symbols, shards):
+    """
+    Splits the symbols round-robin into at most ``shards`` non-empty lists, so that symbols
+    sorted by size (e.g. most liquid first) end up spread over every shard.
+    """
+    return [symbols[i::shards] for i in range(min(shards, len(symbols)))]
+
+
+def _init_worker(processes, initializer, initargs):
+    # connections inherited from the parent are not ours to use
+    reset_after_fork()
+    # the workers share the account's quota, each one takes its share of it
+    api.rest.limiter = TokenBucket(limit=max(2, RATE_LIMIT // processes))
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_shard(symbols, start, end, timeframe, typ, events, options):
+    """
+    Runs the BackfillJob of one shard in a worker process, with its own event loop and connection.
+    """
+    def forward(kind, value):
+        events.put((kind, value))
+
+    return BackfillJob(symbols, start, end, timeframe, typ, report_interval=None,
+                       on_progress=forward, **options).run()
+
+
+class _Progress:
+    """
+    Aggregates the progress events sent by the workers.
+    """
+
+    def __init__(self):
+        self.began = time.monotonic()
+        self.units = 0
+        self.rows = 0
+        self.completed = 0
+        self.failed = []
+
+    def update(self, kind, value):
+        if kind == "planned":
+            self.units += value
+        elif kind == "rows":
+            self.rows += value
+        elif kind == "completed":
+            self.completed += 1
+        elif kind == "failed":
+            self.failed.append(value)
+
+    def report(self, shards, running):
+        elapsed = max(time.monotonic() - self.began, 1e-9)
+        done = self.completed + len(self.failed)
+        rate = done / elapsed
+        eta = "{:.0f}s".format((self.units - done) / rate) if rate else "unknown"
+        print("parallel backfill: {} shards ({} running), {}/{} units done ({} failed), {} rows, "
+              "{:.0f} rows/s, ETA {}".format(shards, running, done, self.units, len(self.failed), self.rows,
+                                            self.rows / elapsed, eta))
+
+
+def run_parallel_backfill(symbols, start, end, timeframe=TimeFrame.Minute, typ="bins",
+                          processes=BACKFILL_PROCESSES, report_interval=REPORT_INTERVAL,
+                          initializer=None, initargs=(), **kwargs):
+    """
+    Runs a BackfillJob with the symbols sharded across worker processes.
+
+    Normalizing pages and writing them is CPU bound, so one process only keeps one core busy
+    however many requests are in flight. Every worker owns its own fetch loop, rate limiter and
+    database connection; the parent only aggregates the progress events and the errors. Each
+    worker's token bucket allows APCA_RATE_LIMIT divided by the number of workers, so together
+    they stay within the account's limit. The units are checkpointed in Crons exactly as with
+    BackfillJob, so rerunning resumes the job, with any number of processes.
+
+    Args:
+        symbols (list): The symbols to backfill.
+        start (str): The start date in the format YYYY-MM-DD.
+        end (str): The end date in the format YYYY-MM-DD.
+        timeframe (TimeFrame): The timeframe of the bars. Defaults to TimeFrame.Minute.
+        typ (str): "bins", "trades" or "quotes". Defaults to "bins".
+        processes (int): Number of worker processes. Defaults to BACKFILL_PROCESSES.
+        report_interval (float): Seconds between two progress reports.
+        initializer (callable, optional): Called with ``initargs`` in every worker before it starts.
+        **kwargs: Options of each shard's BackfillJob (chunk, concurrency, retries).
+
+    Returns:
+        dict: {"units", "completed", "failed", "rows", "errors"}, where failed lists the cron_id of
+            every failed unit and errors the exceptions of shards that crashed.
+    """
+    shards = shard_symbols(symbols, processes)
+    progress = _Progress()
+    errors = []
+    with multiprocessing.Manager() as manager:
+        events = manager.Queue()
+        with ProcessPoolExecutor(max_workers=len(shards), initializer=_init_worker,
+                                 initargs=(len(shards), initializer, initargs)) as pool:
+            futures = [pool.submit(_run_shard, shard, start, end, timeframe, typ, events, kwargs)
+                       for shard in shards]
+            next_report = time.monotonic() + report_interval
+            while not all(future.done() for future in futures) or not events.empty():
+                try:
+                    progress.update(*events.get(timeout=0.1))
+                except queue.Empty:
+                    pass
+                if time.monotonic() >= next_report:
+                    progress.report(len(shards), sum(not future.done() for future in futures))
+                    next_report += report_interval
+            for future in futures:
+                if future.exception() is not None:
+                    print("A backfill shard crashed: {}".format(future.exception()))
+                    errors.append(future.exception())
+    progress.report(len(shards), 0)
+    return {"units": progress.units, "completed": progress.completed, "failed": progress.failed,
+            "rows": progress.rows, "errors": errors}
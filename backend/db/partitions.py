@@ -0,0 +1,231 @@
+import os
+import re
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from dotenv import load_dotenv
+from sqlalchemy import BigInteger, text
+
+load_dotenv()
+
+# "none" keeps plain tables, "native" range partitions them by time, "timescale" makes them hypertables
+PARTITIONING = os.environ.get('DB_PARTITIONING', 'none').lower()
+# partition width ("day" or "month") of the bars and of the trades and quotes tables
+INTERVAL_BARS = os.environ.get('PARTITION_INTERVAL_BARS', 'month')
+INTERVAL_TICKS = os.environ.get('PARTITION_INTERVAL_TICKS', 'day')
+# number of partitions created ahead of the current one
+PARTITIONS_AHEAD = int(os.environ.get('PARTITIONS_AHEAD', 3))
+# days of data kept, older partitions are dropped whole; 0 keeps everything
+RETENTION_DAYS_BARS = int(os.environ.get('RETENTION_DAYS_BARS', 0))
+RETENTION_DAYS_TICKS = int(os.environ.get('RETENTION_DAYS_TICKS', 0))
+
+NY_ZONE = ZoneInfo('America/New_York')
+DAY_NS = 86400 * 10**9
+
+# partitioned tables with their (interval, retention in days)
+PARTITIONED_TABLES = {
+    "bars_minute": (INTERVAL_BARS, RETENTION_DAYS_BARS),
+    "trades": (INTERVAL_TICKS, RETENTION_DAYS_TICKS),
+    "quotes": (INTERVAL_TICKS, RETENTION_DAYS_TICKS),
+    "trades_compact": (INTERVAL_TICKS, RETENTION_DAYS_TICKS),
+    "quotes_compact": (INTERVAL_TICKS, RETENTION_DAYS_TICKS),
+}
+
+# partitions are named after the first day they hold, e.g. trades_p20220103
+_PARTITION_NAME = re.compile(r"_p(\d{8})$")
+
+
+def _is_nanos(table):
+    # the compact tables store timestamps as ns since the epoch
+    return isinstance(table.c.timestamp.type, BigInteger)
+
+
+def _period_start(day, interval):
+    return day.replace(day=1) if interval == "month" else day
+
+
+def _next_period(day, interval):
+    if interval == "month":
+        return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def _bound(table, day):
+    """
+    Returns the SQL literal of the start of a (New York) day in the table's timestamp column.
+    """
+    if _is_nanos(table):
+        return str(int(datetime.combine(day, time(), NY_ZONE).timestamp()) * 10**9)
+    return "'{}'".format(day.isoformat())
+
+
+def _to_day(table, value):
+    if _is_nanos(table):
+        return datetime.fromtimestamp(value / 1e9, NY_ZONE).date()
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _qualified(connection, table):
+    return connection.dialect.identifier_preparer.format_table(table)
+
+
+def mark_partitioned(tables):
+    """
+    Makes create_all create the given tables as range partitioned on their timestamp.
+
+    Only affects tables that do not exist yet: an existing plain table is left as it is.
+    """
+    for table in tables:
+        if table.name in PARTITIONED_TABLES:
+            table.dialect_kwargs["postgresql_partition_by"] = "RANGE (timestamp)"
+
+
+def is_partitioned(connection, table):
+    """
+    Returns True if the table is a natively partitioned table.
+    """
+    return bool(connection.execute(text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)"),
+                                   {"name": _qualified(connection, table)}).scalar())
+
+
+def is_hypertable(connection, table):
+    """
+    Returns True if the table is a Timescale hypertable.
+    """
+    if connection.execute(text("SELECT to_regclass('_timescaledb_catalog.hypertable')")).scalar() is None:
+        return False
+    return bool(connection.execute(text("SELECT 1 FROM _timescaledb_catalog.hypertable "
+                                        "WHERE schema_name = :schema AND table_name = :name"),
+                                   {"schema": table.schema or "public", "name": table.name}).scalar())
+
+
+def create_partitions(connection, table, start, end):
+    """
+    Creates the missing partitions of a natively partitioned table covering [start, end].
+
+    Args:
+        connection: A SQLAlchemy connection on PostgreSQL.
+        table (Table): The partitioned table.
+        start (date): The first day to cover.
+        end (date): The last day to cover.
+
+    Returns:
+        int: The number of partitions that did not exist yet.
+    """
+    interval = PARTITIONED_TABLES[table.name][0]
+    preparer = connection.dialect.identifier_preparer
+    parent = _qualified(connection, table)
+    schema = preparer.quote_schema(table.schema) + "." if table.schema else ""
+    created = 0
+    day = _period_start(start, interval)
+    while day <= end:
+        following = _next_period(day, interval)
+        name = "{}_p{}".format(table.name, day.strftime("%Y%m%d"))
+        exists = connection.execute(text("SELECT to_regclass(:name)"),
+                                    {"name": schema + preparer.quote(name)}).scalar()
+        if exists is None:
+            connection.execute(text("CREATE TABLE IF NOT EXISTS {}{} PARTITION OF {} FOR VALUES FROM ({}) TO ({})".format(
+                schema, preparer.quote(name), parent, _bound(table, day), _bound(table, following))))
+            created += 1
+        day = following
+    return created
+
+
+def ensure_partitions(connection, table, timestamps):
+    """
+    Creates the partitions a batch of rows needs, e.g. for a backfill of old data.
+
+    Args:
+        connection: A SQLAlchemy connection on PostgreSQL.
+        table (Table): The partitioned table.
+        timestamps (Series): The timestamp column of the batch, as it is stored.
+    """
+    interval = PARTITIONED_TABLES[table.name][0]
+    # only the periods the rows fall in, not every one between the oldest and the newest
+    periods = {_period_start(_to_day(table, value), interval) for value in timestamps.unique()}
+    for period in sorted(periods):
+        create_partitions(connection, table, period, period)
+
+
+def drop_expired_partitions(connection, table, today=None):
+    """
+    Drops the partitions of a natively partitioned table that only hold data older than its retention.
+
+    Returns:
+        list: The names of the dropped partitions.
+    """
+    interval, retention = PARTITIONED_TABLES[table.name]
+    if not retention:
+        return []
+    cutoff = (today or date.today()) - timedelta(days=retention)
+    preparer = connection.dialect.identifier_preparer
+    schema = preparer.quote_schema(table.schema) + "." if table.schema else ""
+    children = connection.execute(text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                                       "WHERE i.inhparent = to_regclass(:name)"),
+                                  {"name": _qualified(connection, table)}).scalars()
+    dropped = []
+    for name in sorted(children):
+        match = _PARTITION_NAME.search(name)
+        if match is None:
+            continue
+        if _next_period(datetime.strptime(match.group(1), "%Y%m%d").date(), interval) <= cutoff:
+            connection.execute(text("DROP TABLE {}{}".format(schema, preparer.quote(name))))
+            dropped.append(name)
+    return dropped
+
+
+def create_hypertable(connection, table):
+    """
+    Turns a table into a Timescale hypertable chunked on its timestamp, with its retention policy.
+
+    Existing tables are converted in place only when empty, so that creating the hypertable never
+    rewrites a large table.
+    """
+    interval, retention = PARTITIONED_TABLES[table.name]
+    name = _qualified(connection, table)
+    if _is_nanos(table):
+        schema = connection.dialect.identifier_preparer.quote_schema(table.schema) + "." if table.schema else ""
+        # integer time columns need a notion of "now" for the retention policy
+        connection.execute(text("CREATE OR REPLACE FUNCTION {}unix_now_ns() RETURNS BIGINT LANGUAGE SQL STABLE "
+                                "AS $$ SELECT (extract(epoch FROM now()) * 1e9)::BIGINT $$".format(schema)))
+        chunk = str(DAY_NS * (30 if interval == "month" else 1))
+        connection.execute(text("SELECT create_hypertable(:name, 'timestamp', chunk_time_interval => {}, "
+                                "if_not_exists => TRUE)".format(chunk)), {"name": name})
+        connection.execute(text("SELECT set_integer_now_func(:name, :func, replace_if_exists => TRUE)"),
+                           {"name": name, "func": schema + "unix_now_ns"})
+        if retention:
+            connection.execute(text("SELECT add_retention_policy(:name, drop_after => {}, if_not_exists => TRUE)"
+                                    .format(DAY_NS * retention)), {"name": name})
+        return
+    connection.execute(text("SELECT create_hypertable(:name, 'timestamp', chunk_time_interval => INTERVAL '1 {}', "
+                            "if_not_exists => TRUE)".format(interval)), {"name": name})
+    if retention:
+        connection.execute(text("SELECT add_retention_policy(:name, drop_after => INTERVAL '{} days', "
+                                "if_not_exists => TRUE)".format(retention)), {"name": name})
+
+
+def maintain_partitions(engine, tables, today=None):
+    """
+    Creates the next PARTITIONS_AHEAD partitions of every natively partitioned table and drops the
+    expired ones. Meant to run daily, e.g. from cron; Timescale does both by itself.
+
+    Args:
+        engine: A SQLAlchemy engine on PostgreSQL.
+        tables (list): The tables to maintain; tables that are not partitioned are skipped.
+        today (date, optional): The current day. Defaults to today.
+
+    Returns:
+        dict: {table name: (partitions created, partitions dropped)}
+    """
+    today = today or date.today()
+    report = {}
+    with engine.begin() as connection:
+        for table in tables:
+            if table.name not in PARTITIONED_TABLES or not is_partitioned(connection, table):
+                continue
+            interval = PARTITIONED_TABLES[table.name][0]
+            last = today
+            for _ in range(PARTITIONS_AHEAD):
+                last = _next_period(last, interval)
+            created = create_partitions(connection, table, today, last)
+            report[table.name] = (created, len(drop_expired_partitions(connection, table, today)))
+    return report
@@ -1,9 +1,15 @@
-from models import Quotes, Stocks, BarHour, BarMinute, BarDaily, Trades
-from api import get_assets, get_data
+from models import Quotes, Stocks, BarHour, BarMinute, BarDaily, Trades, Crons, TickerIds
+from api import get_assets, get_data, stream_data, get_historic_data_stream, DataType
 from alpaca_trade_api.rest import TimeFrame
+from alpaca_trade_api.entity_v2 import bar_mapping_v2, trade_mapping_v2, quote_mapping_v2
+from sqlalchemy import func, select
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 import requests
+import numpy as np
 import pandas as pd
 import sys
 import pathlib
@@ -12,6 +18,8 @@ import models
 import time
 import json
 from helpers import insert_into_database
+from resample import DERIVE_BARS, TARGETS, rebuild_bars
+from compact import compact_model, ticker_ids
 from dbconnect import connect_to_database
 from dotenv import load_dotenv
 
@@ -21,6 +29,14 @@ load_dotenv()
 # Set the timezone for New York
 NY = 'America/New_York'
 
+DATA_TYPES = {"bins": DataType.Bars, "trades": DataType.Trades, "quotes": DataType.Quotes}
+# names of the raw API fields in the models, "id" of a trade is stored as trade_id
+RAW_COLUMNS = {"bins": bar_mapping_v2, "trades": dict(trade_mapping_v2, i="trade_id"), "quotes": quote_mapping_v2}
+# the unique key of Trades
+TRADE_KEY = ["trade_id", "ticker", "timestamp", "exchange", "price", "size", "tape"]
+# raw records normalized and written together when streaming historical data
+BATCH_ROWS = int(os.environ.get('APCA_BATCH_ROWS', 100000))
+
 def populate_assets(status="active"):
     """
     Populates the database with stock assets.
@@ -39,6 +55,103 @@ def populate_assets(status="active"):
     insert_into_database(Stocks, asset_df.to_dict(orient="records"))
 
 
+def get_model(typ, timeframe=TimeFrame.Minute):
+    """
+    Returns the model that stores the given type of data.
+
+    Args:
+        typ (str): The type of data. Can be "bins", "trades", or "quotes".
+        timeframe (alpaca_trade_api.rest.TimeFrame): The timeframe of the bars. Defaults to TimeFrame.Minute.
+    """
+    if typ == "bins":
+        # Set the model based on the timeframe
+        if timeframe == TimeFrame.Minute:
+            return BarMinute
+        elif timeframe == TimeFrame.Day:
+            return BarDaily
+        elif timeframe == TimeFrame.Hour:
+            return BarHour
+    elif typ == "trades":
+        return Trades
+    elif typ == "quotes":
+        return Quotes
+    raise ValueError("Unsupported data type {} with timeframe {}".format(typ, timeframe))
+
+
+def normalize_batch(pages, typ="bins"):
+    """
+    Turns raw API pages of any number of symbols into one DataFrame matching the target model.
+
+    The records of all pages are loaded into a single frame, then the ticker column, the
+    renames, the dedup on the Trades unique key and the UTC to New York conversion are each
+    applied once to the whole batch, so the cost no longer grows with the number of symbols.
+
+    Args:
+        pages (list): (symbol, records) tuples, records being a page as sent by the API
+            (see iterate_pages with raw=True).
+        typ (str): The type of data. Can be "bins", "trades", or "quotes". Defaults to "bins".
+
+    Returns:
+        DataFrame: The normalized batch.
+    """
+    records = list(itertools.chain.from_iterable(page for _, page in pages))
+    data_df = pd.DataFrame.from_records(records).rename(columns=RAW_COLUMNS[typ])
+    data_df["ticker"] = np.repeat([symbol for symbol, _ in pages], [len(page) for _, page in pages])
+    data_df["timestamp"] = pd.to_datetime(data_df["timestamp"], utc=True, format="ISO8601").dt.tz_convert(NY)
+    if typ == "trades":
+        data_df = data_df.drop_duplicates(subset=TRADE_KEY)
+    return data_df
+
+
+async def write_batches(pages, model, typ, ssn, batch_rows=BATCH_ROWS):
+    """
+    Collects raw (symbol, records) pages into batches of about ``batch_rows`` rows and writes
+    each one after a single normalize_batch. Pages are written in the order they arrive.
+
+    Batches are normalized and written on a single writer thread, like in BackfillJob, so the
+    event loop keeps fetching pages while a batch is written.
+
+    Returns:
+        int: The number of rows written.
+    """
+    writer = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+
+    def write(batch):
+        insert_into_database(model, normalize_batch(batch, typ), ssn)
+
+    batch, rows, written = [], 0, 0
+    try:
+        async for symbol, records in pages:
+            batch.append((symbol, records))
+            rows += len(records)
+            if rows >= batch_rows:
+                await loop.run_in_executor(writer, write, batch)
+                batch, written, rows = [], written + rows, 0
+        if batch:
+            await loop.run_in_executor(writer, write, batch)
+    finally:
+        writer.shutdown(wait=False)
+    return written + rows
+
+
+async def stream_asset_data(symbols, start, end, timeframe=TimeFrame.Minute, typ="bins"):
+    """
+    Streams data for a list of stock symbols into the database in batches.
+
+    Raw pages of all symbols are collected into batches of APCA_BATCH_ROWS rows, each
+    normalized and written before more pages are taken from the fetch queue, so the memory used
+    does not grow with the size of the date range. See populate_asset_data for the arguments.
+    """
+    model = get_model(typ, timeframe)
+    db_engine = connect_to_database()
+    ssn = db_engine()
+    try:
+        await write_batches(stream_data(symbols, start, end, timeframe, typ, raw=True), model, typ, ssn)
+    finally:
+        ssn.close()
+
+
 def populate_asset_data(symbols, start, end, timeframe=TimeFrame.Minute, typ="bins"):
     """
     Populates the database with data for a list of stock symbols.
@@ -49,39 +162,133 @@ def populate_asset_data(symbols, start, end, timeframe=TimeFrame.Minute, typ="bi
         end (str): The end date in the format YYYY-MM-DD.
         timeframe (alpaca_trade_api.rest.TimeFrame): The timeframe of the data. Defaults to TimeFrame.Minute.
         typ (str): The type of data to retrieve. Can be "bins", "trades", or "quotes". Defaults to "bins".
+
+    With APCA_DERIVE_BARS (the default), hour and day bars are not downloaded but built from the
+    minute bars of the range, which have to be populated first (see resample.rebuild_bars).
     """
-    data = get_data(symbols, start, end, timeframe, typ)
-    db_engine = connect_to_database()
-    ssn = db_engine()
-    dfs=[]
-    for d in data:
-
-        data_df = pd.DataFrame.from_dict(d[1])
-
-        if data_df.empty == False:
-            # Add the ticker to the dataframe
-            data_df["ticker"] = d[0]
-            data_df.reset_index(inplace=True)
-            dfs.append(data_df)
-
-            if typ == "bins":
-                # Set the model based on the timeframe
-                if timeframe == TimeFrame.Minute:
-                    model=BarMinute
-                elif timeframe == TimeFrame.Day:
-                    model=BarDaily
-                elif timeframe == TimeFrame.Hour:
-                    model=BarHour
-
-            elif typ == "trades":
-                # Rename the "id" column to "trade_id"
-                data_df.rename(columns={"id": "trade_id"}, inplace=True)
-                model=Trades
-                
-                # Remove duplicates based on trade_id, ticker, timestamp, exchange, price, size, and tape
-                data_df=data_df.drop_duplicates(subset=["trade_id",'ticker', "timestamp","exchange","price","size","tape"])
-                dfs.append(data_df ) 
-                
-                # Convert the timestamp to New York time zone
-                # data_df['timestamp'] = pd.to_datetime(data_df['timestamp'],unit='ns')
-                # data_df.timestamp = data_df.timestamp.dt.tz_localize('UTC').dt.tz
+    if typ == "bins" and DERIVE_BARS and timeframe in TARGETS:
+        rebuild_bars(symbols, start, end, timeframe)
+        return
+    asyncio.run(stream_asset_data(symbols, start, end, timeframe, typ))
+
+
+def high_water_marks(model, symbols, ssn):
+    """
+    Returns the newest stored timestamp of every symbol in the model's table.
+
+    The max() is a correlated subquery per symbol, which PostgreSQL answers with one backward
+    step on the (ticker, timestamp) key instead of scanning the table. With the compact schema
+    the rows are looked up in the compact table through their ticker ids.
+
+    Args:
+        model: The SQLAlchemy mapper of the table.
+        symbols (list): The symbols to look up.
+        ssn (Session): SQLAlchemy Session object to query with.
+
+    Returns:
+        dict: {symbol: timestamp} in New York wall time, for the symbols that have rows.
+    """
+    compact = compact_model(model)
+    if compact is not None:
+        ids = ticker_ids(symbols, ssn)
+        if not ids:
+            return {}
+        latest = select(func.max(compact.timestamp)).where(compact.ticker == TickerIds.id).scalar_subquery()
+        rows = ssn.query(TickerIds.symbol, latest).filter(TickerIds.id.in_(list(ids.values())))
+        # stored as ns since the epoch, returned like the row tables' timestamps
+        return {symbol: pd.Timestamp(nanos, unit="ns", tz="UTC").tz_convert(NY).tz_localize(None)
+                for symbol, nanos in rows if nanos is not None}
+    latest = select(func.max(model.timestamp)).where(model.ticker == Stocks.symbol).scalar_subquery()
+    rows = ssn.query(Stocks.symbol, latest).filter(Stocks.symbol.in_(symbols))
+    return {symbol: timestamp for symbol, timestamp in rows if timestamp is not None}
+
+
+def _resume_point(timestamp):
+    """
+    Turns a stored New York wall time into the RFC 3339 start of the next request.
+
+    The newest timestamp itself is fetched again: trades and quotes can share it across two
+    pages, and the rows already stored are absorbed by the upsert.
+    """
+    return pd.Timestamp(timestamp).tz_localize(NY, ambiguous=True).tz_convert("UTC").isoformat().replace("+00:00", "Z")
+
+
+async def catch_up_asset_data(symbols, start, end, timeframe=TimeFrame.Minute, typ="bins"):
+    """
+    Fetches only what is missing after the newest row stored for each symbol.
+
+    Every symbol is fetched from its own high-water mark (see high_water_marks), or from
+    ``start`` if it has no rows yet. Each symbol's pages are requested in one unchunked,
+    chronological sequence and written in arrival order, so the marks never jump over a gap and
+    an interrupted run loses nothing by starting over.
+
+    The run is recorded in the Crons table under "catchup:<table>:<end>": "running" while it
+    goes, then "completed", or "failed" if any symbol failed. A run for an end that already
+    completed does nothing; a running or failed one is simply resumed from the marks.
+
+    Args: see catch_up.
+
+    Returns:
+        str: The final status of the run.
+    """
+    model = get_model(typ, timeframe)
+    ssn = connect_to_database()()
+    cron_id = "catchup:{}:{}".format(model.__tablename__, end)
+    try:
+        cron = ssn.query(Crons).filter(Crons.cron_id == cron_id).one_or_none()
+        if cron is not None and cron.cron_status == "completed":
+            print("{} already completed".format(cron_id))
+            return cron.cron_status
+        if cron is None:
+            cron = Crons(cron_id=cron_id, cron_type="catchup", cron_on=model.__tablename__)
+            ssn.add(cron)
+        cron.cron_status = "running"
+        ssn.commit()
+
+        marks = high_water_marks(model, symbols, ssn)
+        until = pd.Timestamp(end, tz="UTC")
+        starts = {}
+        for symbol in symbols:
+            if symbol not in marks:
+                starts[symbol] = start
+            elif pd.Timestamp(marks[symbol]).tz_localize(NY, ambiguous=True) < until:
+                starts[symbol] = _resume_point(marks[symbol])
+        print("Catching up {} of {} symbols in {}".format(len(starts), len(symbols), model.__tablename__))
+
+        failures = []
+        if starts:
+            pages = get_historic_data_stream(list(starts), DATA_TYPES[typ], starts, end,
+                                             timeframe if typ == "bins" else None, chunk=None,
+                                             failures=failures, raw=True)
+            await write_batches(pages, model, typ, ssn)
+
+        cron.cron_status = "failed" if failures else "completed"
+        cron.completed_at = func.now()
+        ssn.commit()
+        return cron.cron_status
+    except Exception:
+        ssn.rollback()
+        ssn.query(Crons).filter(Crons.cron_id == cron_id).update(
+            {Crons.cron_status: "failed", Crons.completed_at: func.now()})
+        ssn.commit()
+        raise
+    finally:
+        ssn.close()
+
+
+def catch_up(symbols, start, end=None, timeframe=TimeFrame.Minute, typ="bins"):
+    """
+    Incremental counterpart of populate_asset_data, meant for the nightly job.
+
+    Args:
+        symbols (list): A list of stock symbols to retrieve data for.
+        start (str): The start date, in the format YYYY-MM-DD, for symbols that have no data yet.
+        end (str, optional): The end date in the format YYYY-MM-DD. Defaults to today in New York.
+        timeframe (alpaca_trade_api.rest.TimeFrame): The timeframe of the data. Defaults to TimeFrame.Minute.
+        typ (str): The type of data to retrieve. Can be "bins", "trades", or "quotes". Defaults to "bins".
+
+    Returns:
+        str: "completed", or "failed" if some symbols could not be fetched and a rerun is needed.
+    """
+    end = end or pd.Timestamp.now(tz=NY).date().isoformat()
+    return asyncio.run(catch_up_asset_data(symbols, start, end, timeframe, typ))
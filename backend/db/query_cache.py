@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# number of query results kept in memory
+CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 1024))
+# rows kept in memory across all results, and rows above which a result is not cached at all
+CACHE_ROWS = int(os.environ.get('QUERY_CACHE_ROWS', 1000000))
+MAX_RESULT_ROWS = int(os.environ.get('QUERY_CACHE_MAX_RESULT_ROWS', 100000))
+# seconds a result stays valid: tables that change once a day can be kept much longer than intraday ones
+TTL_INTRADAY = float(os.environ.get('QUERY_CACHE_TTL', 5))
+TTL_DAILY = float(os.environ.get('QUERY_CACHE_TTL_DAILY', 3600))
+TABLE_TTLS = {"stocks": TTL_DAILY, "bars_daily": TTL_DAILY}
+
+# columns holding the symbol a row belongs to, used to index results and writes
+TICKER_COLUMNS = ("ticker", "symbol")
+# symbol under which results that are not filtered on tickers are indexed
+ALL = object()
+
+
+class QueryCache:
+    """
+    LRU cache of query results with a time to live per table.
+
+    Every entry is indexed by the table and tickers it covers, so that a write can drop exactly
+    the results it makes stale (see invalidate). The cache only lives in the current process:
+    writes made by other processes are only picked up once the entries expire. Its memory is
+    bounded by the total number of rows it holds; a single result larger than
+    ``max_result_rows`` (e.g. years of ticks) is returned but never cached.
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE, ttls=None, default_ttl=TTL_INTRADAY, max_rows=CACHE_ROWS,
+                 max_result_rows=MAX_RESULT_ROWS):
+        """
+        Args:
+            max_entries (int): Maximum number of results kept; the least recently used goes first.
+            ttls (dict, optional): Seconds to live per table name. Defaults to TABLE_TTLS.
+            default_ttl (float): Seconds to live for tables missing from ttls.
+            max_rows (int): Maximum number of rows kept across all results.
+            max_result_rows (int): Results with more rows than this are not cached.
+        """
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.max_result_rows = max_result_rows
+        self._rows = 0
+        self.ttls = TABLE_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._index = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.skipped = 0
+
+    def _drop(self, key):
+        table, tickers = key[0], key[1]
+        self._rows -= self._entries.pop(key)[2]
+        index = self._index.get(table, {})
+        for ticker in tickers:
+            keys = index.get(ticker)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[ticker]
+
+    def get(self, key):
+        """
+        Returns the cached value of a key built by make_key, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """
+        Stores a value under a key built by make_key, evicting the least recently used entries.
+        """
+        table, tickers = key[0], key[1]
+        expires = time.monotonic() + self.ttls.get(table, self.default_ttl)
+        rows = len(value) if hasattr(value, "__len__") else 1
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if rows > self.max_result_rows:
+                self.skipped += 1
+                return
+            self._entries[key] = (expires, value, rows)
+            self._rows += rows
+            index = self._index.setdefault(table, {})
+            for ticker in tickers:
+                index.setdefault(ticker, set()).add(key)
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, table, tickers=None):
+        """
+        Drops the cached results of a table that may include rows of the given tickers.
+
+        Args:
+            table (str): The name of the table that was written to.
+            tickers (iterable, optional): The tickers that were written. None drops the whole table.
+        """
+        with self._lock:
+            index = self._index.get(table)
+            if not index:
+                return
+            if tickers is None:
+                keys = set().union(*index.values())
+            else:
+                keys = set(index.get(ALL, ()))
+                for ticker in tickers:
+                    keys.update(index.get(ticker, ()))
+            for key in keys:
+                self._drop(key)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self._rows = 0
+
+    def stats(self):
+        """
+        Returns the hit, miss, eviction, expiration, invalidation and skip counters and the current size.
+
+        Returns:
+            dict: {"hits", "misses", "evictions", "expirations", "invalidations", "skipped", "entries", "rows"}
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "expirations": self.expirations, "invalidations": self.invalidations,
+                    "skipped": self.skipped, "entries": len(self._entries), "rows": self._rows}
+
+
+def make_key(table, parameter, parameter_val, *args):
+    """
+    Builds a cache key for a query on ``table`` filtered on ``parameter`` == ``parameter_val``.
+
+    The tickers the result covers come first so put() and invalidate() can find them; every
+    other argument that shapes the result just has to be hashable.
+
+    Args:
+        table (str): The name of the queried table.
+        parameter (str): The name of the filtered column.
+        parameter_val (str, list or None): The value(s) the query is filtered on.
+        *args: Every other argument of the query (time range, columns, ...).
+    """
+    if parameter_val is None or parameter not in TICKER_COLUMNS:
+        tickers = (ALL,)
+    elif type(parameter_val) == str:
+        tickers = (parameter_val,)
+    else:
+        tickers = tuple(parameter_val)
+    args = (parameter, parameter_val) + args
+    return (table, tickers) + tuple(tuple(a) if isinstance(a, list) else a for a in args)
+
+
+query_cache = QueryCache()
+
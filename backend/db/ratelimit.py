@@ -0,0 +1,161 @@
+import asyncio
+import os
+import random
+import time
+import aiohttp
+from dotenv import load_dotenv
+from alpaca_trade_api.rest_async import AsyncRest
+
+load_dotenv()
+
+# Alpaca allows 200 data requests per minute on the free plan
+RATE_LIMIT = int(os.environ.get('APCA_RATE_LIMIT', 200))
+RATE_BURST = int(os.environ.get('APCA_RATE_BURST', 5))
+MAX_RETRIES = int(os.environ.get('APCA_MAX_RETRIES', 5))
+BACKOFF_BASE = float(os.environ.get('APCA_BACKOFF_BASE', 0.5))
+BACKOFF_CAP = float(os.environ.get('APCA_BACKOFF_CAP', 30))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every request made from one process.
+
+    The bucket holds at most ``burst`` tokens and refills at ``(limit - burst)`` tokens per
+    ``period`` seconds, so no window of ``period`` seconds can ever see more than ``limit``
+    requests. The rate-limit headers returned by the server tighten the bucket further when
+    the quota is also being spent elsewhere (other processes using the same key).
+    """
+
+    def __init__(self, limit=RATE_LIMIT, burst=RATE_BURST, period=60.0):
+        """
+        Args:
+            limit (int): Maximum number of requests allowed per period.
+            burst (int): Maximum number of requests that may be sent back to back.
+            period (float): Length of the quota window in seconds.
+        """
+        self.burst = max(1, min(burst, limit - 1))
+        self.period = period
+        self.limit = limit
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self.acquired = 0
+        self.throttled = 0
+
+    @property
+    def rate(self):
+        """Refill rate in tokens per second."""
+        return (self.limit - self.burst) / self.period
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    async def acquire(self):
+        """
+        Waits until a request may be sent and consumes one token.
+        """
+        while True:
+            now = self._refill()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.acquired += 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """
+        Stops handing out tokens for the given number of seconds and empties the bucket.
+        """
+        self._refill()
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.throttled += 1
+
+    def update_from_headers(self, headers):
+        """
+        Adapts the bucket to the X-RateLimit-* headers of a response.
+
+        Args:
+            headers (Mapping): The response headers.
+        """
+        limit = headers.get('X-RateLimit-Limit')
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if limit is not None and int(limit) != self.limit:
+            self.limit = int(limit)
+            self.burst = max(1, min(self.burst, self.limit - 1))
+        if remaining is None:
+            return
+        remaining = int(remaining)
+        self._refill()
+        if remaining == 0 and reset is not None:
+            self.pause(max(0.0, float(reset) - time.time()))
+        else:
+            self._tokens = min(self._tokens, float(remaining))
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    Returns a fully jittered exponential backoff delay for the given retry attempt.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimitedRest(AsyncRest):
+    """
+    AsyncRest whose paginated requests all go through a shared TokenBucket.
+
+    Every page costs one token. Responses with a 429 or 5xx status (and dropped connections)
+    are retried with jittered exponential backoff; any other error status raises instead of
+    being silently treated as an empty page.
+    """
+
+    def __init__(self, *args, limiter=None, max_retries=MAX_RETRIES, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or TokenBucket()
+        self.max_retries = max_retries
+
+    async def _get_page(self, session, url, opts):
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            try:
+                async with session.get(url, **opts) as response:
+                    self.limiter.update_from_headers(response.headers)
+                    if response.status in RETRY_STATUSES:
+                        if response.status == 429:
+                            retry_after = response.headers.get('Retry-After')
+                            reset = response.headers.get('X-RateLimit-Reset')
+                            if retry_after is not None:
+                                self.limiter.pause(float(retry_after))
+                            elif reset is not None:
+                                self.limiter.pause(max(0.0, float(reset) - time.time()))
+                        error = Exception(f"HTTP {response.status} for {url}")
+                    elif response.status >= 400:
+                        raise Exception(f"HTTP {response.status} for {url}: {await response.text()}")
+                    else:
+                        return await response.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt < self.max_retries:
+                await asyncio.sleep(backoff_delay(attempt))
+        raise error
+
+    async def _request(self, url, payload):
+        opts = self._get_opts(payload)
+        async with aiohttp.ClientSession() as session:
+            while 1:
+                response = await self._get_page(session, url, opts)
+                page_token = response.get('next_page_token')
+                payload["page_token"] = page_token
+                yield response
+
+                if not page_token:
+                    break
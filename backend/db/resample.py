@@ -0,0 +1,279 @@
+import logging
+import os
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+import pandas as pd
+from alpaca_trade_api.rest import TimeFrame
+from dotenv import load_dotenv
+from models import BarMinute, BarHour, BarDaily
+from helpers import insert_into_database
+from dbconnect import connect_to_database
+from decoders import BAR_COLUMNS
+from compact import to_ns
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+NY = 'America/New_York'
+NY_ZONE = ZoneInfo(NY)
+HOUR_NS = 3600 * 10**9
+
+# build bars_hour and bars_daily from bars_minute instead of downloading them
+DERIVE_BARS = os.environ.get('APCA_DERIVE_BARS', 'true').lower() == 'true'
+# update the hour and day bars as minute bars stream in
+STREAM_RESAMPLE = os.environ.get('STREAM_RESAMPLE', 'true').lower() == 'true'
+# symbols whose minute bars are read and resampled together by rebuild_bars
+RESAMPLE_SYMBOLS = int(os.environ.get('RESAMPLE_BATCH_SYMBOLS', 50))
+# days of minute bars read at a time by rebuild_bars
+RESAMPLE_DAYS = int(os.environ.get('RESAMPLE_BATCH_DAYS', 30))
+
+TARGETS = {TimeFrame.Hour: BarHour, TimeFrame.Day: BarDaily}
+
+
+def _buckets(timestamps, timeframe):
+    """
+    Returns the start of the hour or New York day each timestamp falls in.
+    """
+    if timeframe == TimeFrame.Day:
+        return timestamps.dt.normalize()
+    if timeframe != TimeFrame.Hour:
+        raise ValueError("Bars can only be resampled to TimeFrame.Hour or TimeFrame.Day")
+    if isinstance(timestamps.dtype, pd.DatetimeTZDtype):
+        # hours are floored in UTC, where none is ambiguous, New York being a whole number of hours off
+        return timestamps.dt.tz_convert("UTC").dt.floor("h").dt.tz_convert(timestamps.dt.tz)
+    return timestamps.dt.floor("h")
+
+
+def resample_bars(df, timeframe=TimeFrame.Hour):
+    """
+    Aggregates minute bars into hour or day bars in one vectorized pass.
+
+    Each bar is stamped with the start of its bucket, like the API's: open is the first open,
+    close the last close, high and low the extremes, volume and trade_count the sums and vwap
+    the volume-weighted mean of the minute vwaps. Days are New York calendar days.
+
+    Args:
+        df (DataFrame): Minute bars with the columns of BAR_COLUMNS, in any order.
+        timeframe (TimeFrame): TimeFrame.Hour or TimeFrame.Day.
+
+    Returns:
+        DataFrame: One row per (ticker, bucket), with the columns of BAR_COLUMNS.
+    """
+    buckets = _buckets(df["timestamp"], timeframe)
+    if df.empty:
+        return df.loc[:, list(BAR_COLUMNS)]
+    df = df.assign(timestamp=buckets, pv=df["vwap"] * df["volume"]).sort_values(["ticker", "timestamp"], kind="stable")
+    out = df.groupby(["ticker", "timestamp"], sort=False).agg(
+        open=("open", "first"), high=("high", "max"), low=("low", "min"), close=("close", "last"),
+        volume=("volume", "sum"), trade_count=("trade_count", "sum"), pv=("pv", "sum"))
+    out["vwap"] = (out["pv"] / out["volume"]).where(out["volume"] > 0)
+    return out.reset_index().loc[:, list(BAR_COLUMNS)]
+
+
+def stored_minute_bars(symbols, start, end, ssn):
+    """
+    Reads the minute bars of some symbols in [start, end) from bars_minute.
+
+    Args:
+        symbols (list): The symbols to read.
+        start (datetime): The first minute, naive New York time as stored.
+        end (datetime): The end of the range, excluded.
+        ssn (Session): SQLAlchemy Session object to use.
+
+    Returns:
+        DataFrame: The minute bars with the columns of BAR_COLUMNS, ordered by ticker and timestamp.
+    """
+    rows = ssn.query(*[getattr(BarMinute, key) for key in BAR_COLUMNS]).filter(
+        BarMinute.ticker.in_(symbols), BarMinute.timestamp >= start, BarMinute.timestamp < end).order_by(
+        BarMinute.ticker, BarMinute.timestamp).all()
+    return pd.DataFrame.from_records(rows, columns=BAR_COLUMNS, coerce_float=True)
+
+
+def rebuild_bars(symbols, start, end, timeframe=TimeFrame.Hour, ssn=None, batch_symbols=RESAMPLE_SYMBOLS,
+                 batch_days=RESAMPLE_DAYS):
+    """
+    Builds the hour or day bars of a range from the minute bars stored in bars_minute.
+
+    The range is widened to whole buckets, so every bar written is complete; existing bars are
+    overwritten. Minute bars are read ``batch_symbols`` symbols and ``batch_days`` days at a time.
+
+    Args:
+        symbols (list): The symbols to resample.
+        start (str): The start date in the format YYYY-MM-DD (New York time).
+        end (str): The end date in the format YYYY-MM-DD, excluded.
+        timeframe (TimeFrame): TimeFrame.Hour or TimeFrame.Day.
+        ssn (Session): Optional SQLAlchemy Session object to use.
+        batch_symbols (int): Number of symbols read and written together.
+        batch_days (int): Number of days read and written together.
+
+    Returns:
+        dict: {symbol: bars written}; symbols without minute bars in the range are left out.
+    """
+    model = TARGETS[timeframe]
+    freq = "D" if timeframe == TimeFrame.Day else "h"
+    start = pd.Timestamp(start).floor(freq).to_pydatetime()
+    end = pd.Timestamp(end).ceil(freq).to_pydatetime()
+    own_session = ssn is None
+    if own_session:
+        ssn = connect_to_database()()
+    written = {}
+    try:
+        # chunk bounds fall on midnights, so no hour or day is split between two reads
+        bounds = [start] + [bound.to_pydatetime() for bound in pd.date_range(
+            pd.Timestamp(start).ceil("D"), end, freq="{}D".format(batch_days)) if start < bound < end] + [end]
+        for i in range(0, len(symbols), batch_symbols):
+            batch = symbols[i:i + batch_symbols]
+            for low, high in zip(bounds, bounds[1:]):
+                minutes = stored_minute_bars(batch, low, high, ssn)
+                minutes["timestamp"] = pd.to_datetime(minutes["timestamp"])
+                bars = resample_bars(minutes, timeframe)
+                if not bars.empty:
+                    insert_into_database(model, bars, ssn, raise_errors=True)
+                    for symbol, count in bars["ticker"].value_counts().items():
+                        written[symbol] = written.get(symbol, 0) + count
+        missing = [symbol for symbol in symbols if symbol not in written]
+        if missing:
+            logger.warning("No minute bars to build {} from for {} symbols, e.g. {}".format(
+                model.__tablename__, len(missing), missing[:5]))
+    finally:
+        if own_session:
+            ssn.close()
+    return written
+
+
+def _day_bounds(nanos):
+    """
+    Returns the start and end, in ns since the epoch, of the New York day holding ``nanos``.
+    """
+    day = datetime.fromtimestamp(nanos / 1e9, NY_ZONE).date()
+    start = datetime.combine(day, time(), NY_ZONE)
+    end = datetime.combine(day + timedelta(days=1), time(), NY_ZONE)
+    return int(start.timestamp()) * 10**9, int(end.timestamp()) * 10**9
+
+
+def minutes_before(symbol, nanos, ssn=None):
+    """
+    Reads the minute bars stored for a symbol between the start of its New York day and ``nanos``.
+
+    Args:
+        symbol (str): The symbol to read.
+        nanos (int): The time of its next streamed bar in ns since the epoch, excluded.
+        ssn (Session): Optional SQLAlchemy Session object to use.
+
+    Returns:
+        list: Tuples ordered like BAR_COLUMNS, timestamps in ns, to pass to BarResampler.seed.
+    """
+    start, _ = _day_bounds(nanos)
+    bounds = [datetime.fromtimestamp(ns / 1e9, NY_ZONE).replace(tzinfo=None) for ns in (start, nanos)]
+    own_session = ssn is None
+    if own_session:
+        ssn = connect_to_database()()
+    try:
+        minutes = stored_minute_bars([symbol], *bounds, ssn)
+    finally:
+        if own_session:
+            ssn.close()
+    minutes["timestamp"] = to_ns(minutes["timestamp"])
+    return list(minutes.itertuples(index=False, name=None))
+
+
+class BarResampler:
+    """
+    Keeps the hour and day bar each symbol's streamed minute bars are building.
+
+    Every minute bar folds into the current bucket of its symbol, and the updated bucket is
+    returned so the caller can upsert it: bars_hour and bars_daily then hold the partial bar of
+    the current hour and day, completed by the last minute bar of the bucket. The state is one
+    list per symbol and timeframe. A minute bar older than the bucket in progress (e.g. one
+    replayed after a reconnect) is not folded in; rebuild_bars recomputes such buckets.
+
+    A symbol's buckets must hold the minutes stored before its first streamed bar, or the first
+    upsert would overwrite the complete bar with a partial one: until seed() is called for a
+    symbol (see minutes_before), needs_seed() is True. reset() forgets symbols whose stored
+    minutes changed behind the resampler's back, e.g. after a gap backfill.
+    """
+
+    def __init__(self):
+        # symbol -> [start ns, end ns, open, high, low, close, volume, trade_count, volume * vwap]
+        self.hours = {}
+        self.days = {}
+        self._seeded = set()
+        self._reset = set()
+
+    def needs_seed(self, symbol):
+        """
+        Returns True if the symbol's buckets were not seeded from the stored minute bars yet.
+        """
+        return symbol not in self._seeded
+
+    def was_reset(self, symbol):
+        """
+        Returns True if the symbol was reset since it was last seeded.
+        """
+        return symbol in self._reset
+
+    def seed(self, symbol, bars):
+        """
+        Rebuilds a symbol's buckets from the minute bars stored before its next streamed bar.
+
+        Args:
+            symbol (str): The symbol to seed.
+            bars (list): Its minute bars of the current day, ordered by time, as returned by
+                minutes_before.
+        """
+        self.hours.pop(symbol, None)
+        self.days.pop(symbol, None)
+        for bar in bars:
+            self.update(bar)
+        self._seeded.add(symbol)
+        self._reset.discard(symbol)
+
+    def reset(self, symbols):
+        """
+        Drops the buckets of some symbols, which are seeded again on their next bar.
+        """
+        for symbol in symbols:
+            self.hours.pop(symbol, None)
+            self.days.pop(symbol, None)
+            if symbol in self._seeded:
+                self._seeded.discard(symbol)
+                self._reset.add(symbol)
+
+    @staticmethod
+    def _fold(state, symbol, nanos, bar, bounds):
+        current = state.get(symbol)
+        if current is not None and nanos < current[0]:
+            return None
+        _, _, open_, high, low, close, volume, trade_count, vwap = bar
+        # a bar sent without trade_count or vwap (see decoders.py) adds nothing to their sums, as
+        # in the pandas sums of resample_frame
+        trade_count = trade_count or 0
+        pv = vwap * volume if vwap is not None else 0
+        if current is None or nanos >= current[1]:
+            current = state[symbol] = [*bounds(nanos), open_, high, low, close, volume, trade_count, pv]
+        else:
+            current[3] = max(current[3], high)
+            current[4] = min(current[4], low)
+            current[5] = close
+            current[6] += volume
+            current[7] += trade_count
+            current[8] += pv
+        start, _, open_, high, low, close, volume, trade_count, pv = current
+        return (symbol, start, open_, high, low, close, volume, trade_count, pv / volume if volume else None)
+
+    def update(self, bar):
+        """
+        Folds a minute bar into its hour and day buckets.
+
+        Args:
+            bar (tuple): A minute bar ordered like BAR_COLUMNS, timestamp in ns (see decode_bar).
+
+        Returns:
+            tuple: (hour bar, day bar), tuples ordered like BAR_COLUMNS stamped with the start of
+                their bucket in ns, or None for a bucket the bar came too late for.
+        """
+        symbol, nanos = bar[0], bar[1]
+        hour = self._fold(self.hours, symbol, nanos, bar, lambda ns: (ns - ns % HOUR_NS, ns - ns % HOUR_NS + HOUR_NS))
+        day = self._fold(self.days, symbol, nanos, bar, _day_bounds)
+        return hour, day
@@ -0,0 +1,50 @@
+import logging
+from typing import List
+from AlpacaStream.AlpacaDataStream import AlpacaDataStream
+from stream_bars import barhandler
+from stream_trades import tradehandler
+from stream_quotes import quotehandler
+from trade_bars import STREAM_TRADE_BARS
+
+logger = logging.getLogger(__name__)
+
+
+def run_all_streams(bar_symbols: List[str], trade_symbols: List[str] = None, quote_symbols: List[str] = None):
+    """
+    Streams bars, trades and quotes over a single Alpaca connection, in one process.
+
+    Args:
+        bar_symbols (List[str]): The symbols to stream bars for.
+        trade_symbols (List[str], optional): The symbols to stream trades for. Defaults to bar_symbols.
+        quote_symbols (List[str], optional): The symbols to stream quotes for. Defaults to bar_symbols.
+
+    With STREAM_TRADE_BARS, the minute bars of symbols whose trades are streamed are built from
+    those trades, and bars are only subscribed to for the other symbols.
+
+    Returns:
+        None
+    """
+    trade_symbols = bar_symbols if trade_symbols is None else trade_symbols
+    quote_symbols = bar_symbols if quote_symbols is None else quote_symbols
+    if STREAM_TRADE_BARS:
+        traded = set(trade_symbols)
+        bar_symbols = [symbol for symbol in bar_symbols if symbol not in traded]
+    subscriptions = {
+        "bars": (bar_symbols, barhandler),
+        "trades": (trade_symbols, tradehandler),
+        "quotes": (quote_symbols, quotehandler),
+    }
+    alpaca_obj = AlpacaDataStream()
+    try:
+        logger.info("Streaming bars for {}, trades for {} and quotes for {} stocks".format(
+            len(bar_symbols), len(trade_symbols), len(quote_symbols)))
+        alpaca_obj.run_streams({channel: sub for channel, sub in subscriptions.items() if sub[0]})
+    except Exception as e:
+        logger.error("There was an error streaming data. Error details: {}".format(e))
+        raise e
+
+
+if __name__ == "__main__":
+    # Example usage: stream bars, trades and quotes for AAPL and MSFT on one connection
+    symbols = ["AAPL", "MSFT"]
+    run_all_streams(symbols)
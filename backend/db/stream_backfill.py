@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from alpaca_trade_api.rest import TimeFrame
+from api import DataType, MAX_CONCURRENCY, iterate_pages
+from populate_hist import get_model, normalize_batch
+from helpers import insert_into_database
+from dbconnect import connect_to_database
+from resample import STREAM_RESAMPLE, rebuild_bars
+
+logger = logging.getLogger(__name__)
+NY = 'America/New_York'
+
+# how each stream channel is fetched and stored through the historical path
+CHANNEL_SOURCES = {
+    "bars": (DataType.Bars, "bins", TimeFrame.Minute),
+    "trades": (DataType.Trades, "trades", None),
+    "quotes": (DataType.Quotes, "quotes", None),
+}
+
+
+def _rfc3339(nanos):
+    return pd.Timestamp(nanos, unit="ns", tz="UTC").isoformat().replace("+00:00", "Z")
+
+
+def _ny(nanos):
+    return pd.Timestamp(nanos, unit="ns", tz="UTC").tz_convert(NY).tz_localize(None).to_pydatetime()
+
+
+def _rebuild_gap_bars(symbols, since, until, ssn):
+    # the gap's hour and day bars were upserted without the minutes it missed
+    for timeframe in (TimeFrame.Hour, TimeFrame.Day):
+        rebuild_bars(symbols, _ny(since), _ny(until), timeframe, ssn)
+
+
+async def backfill_gap(channel, since, until):
+    """
+    Fetches the messages a stream missed while it was disconnected and writes them to the database.
+
+    When bars are resampled as they stream, the hour and day bars of the gap are rebuilt from
+    the stored minutes once the gap is filled, and the stream's buckets of the backfilled
+    symbols are seeded again from the stored minutes on their next bar.
+
+    Args:
+        channel (str): "bars", "trades" or "quotes".
+        since (dict): Maps each symbol to the timestamp (ns since the epoch) of the last message
+            received for it; only later data is fetched.
+        until (int): The end of the gap in ns since the epoch, usually the reconnect time.
+
+    Returns:
+        int: The number of rows written.
+    """
+    data_type, typ, timeframe = CHANNEL_SOURCES[channel]
+    resampler = None
+    if channel == "bars" and STREAM_RESAMPLE:
+        # the resampler of the running bar stream, imported here as only the bar channel needs it
+        from stream_bars import resampler
+        resampler.reset(since)
+    model = get_model(typ, timeframe)
+    end = _rfc3339(until)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    # a single writer thread keeps the session on one thread and the event loop free
+    writer = ThreadPoolExecutor(max_workers=1)
+    ssn = connect_to_database()()
+    loop = asyncio.get_running_loop()
+    written = 0
+    filled = set()
+
+    async def fill(symbol, start):
+        nonlocal written
+        async with semaphore:
+            async for page in iterate_pages(symbol, data_type, _rfc3339(start + 1), end, timeframe, raw=True):
+                data_df = normalize_batch([(symbol, page)], typ)
+                await loop.run_in_executor(writer, insert_into_database, model, data_df, ssn)
+                written += len(data_df)
+                filled.add(symbol)
+
+    try:
+        results = await asyncio.gather(*[fill(symbol, start) for symbol, start in since.items()
+                                         if start < until], return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Error backfilling {} gap: {}".format(channel, result))
+        if resampler is not None and filled:
+            await loop.run_in_executor(writer, _rebuild_gap_bars, sorted(filled),
+                                       min(since[symbol] for symbol in filled), until, ssn)
+            resampler.reset(filled)
+    finally:
+        await loop.run_in_executor(writer, ssn.close)
+        writer.shutdown(wait=False)
+    logger.info("Backfilled {} {} rows for {} symbols".format(written, channel, len(since)))
+    return written
@@ -1,15 +1,30 @@
 import pathlib
 import sys
-import pandas as pd
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from AlpacaStream.AlpacaDataStream import AlpacaDataStream
 from models import Quotes, Stocks, BarHour, BarMinute, BarDaily, Trades
-from helpers import insert_into_database
+from write_buffer import WriteBuffer
+import latest_cache
+from resample import STREAM_RESAMPLE, BarResampler, minutes_before
+from decoders import decode_bar, BAR_COLUMNS
 
 logger = logging.getLogger(__name__)
 NY = 'America/New_York'
 
+# rows are written in batches by a background task instead of one insert per message
+bar_buffer = WriteBuffer(BarMinute, BAR_COLUMNS)
+# newest row of every symbol, read by DataRetrievalController.get_latest_series
+latest_bars = latest_cache.register(BarMinute, BAR_COLUMNS)
+# hour and day bars upserted as the minute bars building them arrive
+resampler = BarResampler()
+hour_buffer = WriteBuffer(BarHour, BAR_COLUMNS)
+daily_buffer = WriteBuffer(BarDaily, BAR_COLUMNS)
+# reads the stored minute bars a symbol's buckets are seeded with, off the event loop
+seed_executor = ThreadPoolExecutor(max_workers=1)
+
 
 async def barhandler(bar):
     """
@@ -21,17 +36,35 @@ async def barhandler(bar):
     Returns:
         None
     """
-    # Convert bar data to pandas dataframe
-    bar_df = pd.DataFrame(bar.__dict__)
-    # Transpose the dataframe
-    bar_df = bar_df.transpose()
-    # Rename columns to match the database table
-    bar_df.rename(columns={"symbol":"ticker"}, inplace=True)
-    # Convert timestamp to datetime object and set timezone
-    bar_df['timestamp'] = pd.to_datetime(bar_df['timestamp'],unit='ns')
-    bar_df.timestamp = bar_df.timestamp.dt.tz_localize('UTC').dt.tz_convert(NY)
-    # Insert data into the database
-    insert_into_database(BarMinute, bar_df.to_dict(orient="records"))
+    # Decode the bar straight into a row, timestamps are converted per batch
+    await store_bar(decode_bar(bar))
+
+
+async def store_bar(row):
+    """
+    Caches, queues for writing and resamples one minute bar, decoded or built from trades.
+
+    The first bar of a symbol, and the first one after a gap backfill, seeds its hour and day
+    buckets from the minute bars already stored, so the partial bars upserted stay complete.
+
+    Args:
+        row (tuple): A minute bar ordered like BAR_COLUMNS, timestamp in ns.
+    """
+    latest_bars.update(row)
+    await bar_buffer.put(row)
+    if STREAM_RESAMPLE:
+        symbol = row[0]
+        if resampler.needs_seed(symbol):
+            if resampler.was_reset(symbol):
+                # bars streamed since the reset must be stored before the seed reads them
+                await bar_buffer.flush()
+            bars = await asyncio.get_running_loop().run_in_executor(seed_executor, minutes_before, symbol, row[1])
+            resampler.seed(symbol, bars)
+        hour, day = resampler.update(row)
+        if hour is not None:
+            await hour_buffer.put(hour)
+        if day is not None:
+            await daily_buffer.put(day)
 
 
 def run_bar_stream(symbols: List[str]):
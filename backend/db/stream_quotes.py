@@ -2,14 +2,20 @@ import pathlib
 import sys
 from AlpacaStream.AlpacaDataStream import AlpacaDataStream
 from models import Quotes
-from helpers import insert_into_database
-import pandas as pd
+from write_buffer import WriteBuffer
+import latest_cache
+from decoders import decode_quote, QUOTE_COLUMNS
 import logging
 
 logger = logging.getLogger(__name__)
 
 NY = 'America/New_York'
 
+# rows are written in batches by a background task instead of one insert per message
+quotes_buffer = WriteBuffer(Quotes, QUOTE_COLUMNS)
+# newest row of every symbol, read by DataRetrievalController.get_latest_series
+latest_quotes = latest_cache.register(Quotes, QUOTE_COLUMNS)
+
 async def quotehandler(quotes):
     """
     Processes incoming quote data and saves it into the database.
@@ -20,12 +26,9 @@ async def quotehandler(quotes):
     Returns:
     None
     """
-    quotes_df = pd.DataFrame(quotes.__dict__)
-    quotes_df = quotes_df.transpose()
-    quotes_df['timestamp'] = pd.to_datetime(quotes_df['timestamp'], unit='ns')
-    quotes_df.timestamp = quotes_df.timestamp.dt.tz_localize('UTC').dt.tz_convert(NY)
-    quotes_df.rename(columns={"symbol": "ticker"}, inplace=True)
-    insert_into_database(Quotes, quotes_df.to_dict(orient="records"))
+    row = decode_quote(quotes)
+    latest_quotes.update(row)
+    await quotes_buffer.put(row)
 
 def run_quotes_stream(tickers):
     """
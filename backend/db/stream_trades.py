@@ -1,14 +1,43 @@
+import asyncio
 import pathlib
 import sys
+import time
 from AlpacaStream.AlpacaDataStream import AlpacaDataStream
 from models import Quotes, Stocks, BarHour, BarMinute, BarDaily, Trades
-from helpers import insert_into_database
-import pandas as pd
+from write_buffer import WriteBuffer
+import latest_cache
+from decoders import decode_trade, TRADE_COLUMNS
+from trade_bars import STREAM_TRADE_BARS, TradeBarAggregator
+from stream_bars import store_bar
 import logging
 
 logger = logging.getLogger("__name__")
 NY = 'America/New_York'
 
+# rows are written in batches by a background task instead of one insert per message
+trades_buffer = WriteBuffer(Trades, TRADE_COLUMNS)
+# newest row of every symbol, read by DataRetrievalController.get_latest_series
+latest_trades = latest_cache.register(Trades, TRADE_COLUMNS)
+# minute bars built from the trades, see trade_bars.py
+trade_bars = TradeBarAggregator()
+_bar_task = None
+
+
+async def emit_trade_bars():
+    """
+    Stores the minute bars of trade_bars once a second, as their grace window ends.
+    """
+    try:
+        while True:
+            await asyncio.sleep(1 - time.time() % 1)
+            for row in trade_bars.flush(time.time_ns()):
+                await store_bar(row)
+    except asyncio.CancelledError:
+        for row in trade_bars.flush_all():
+            await store_bar(row)
+        raise
+
+
 async def tradehandler(trades):
     """
     Processes trade data received through AlpacaDataStream API and saves it to a database using helper functions.
@@ -19,13 +48,14 @@ async def tradehandler(trades):
     Returns:
         None.
     """
-    print(trades.__dict__)
-    trades_df = pd.DataFrame(trades.__dict__)
-    trades_df = trades_df.transpose()
-    trades_df['timestamp'] = pd.to_datetime(trades_df['timestamp'], unit='ns')
-    trades_df.timestamp = trades_df.timestamp.dt.tz_localize('UTC').dt.tz_convert(NY)
-    trades_df.rename(columns={"symbol":"ticker","id":"trade_id"}, inplace=True)
-    insert_into_database(Trades, trades_df.to_dict(orient="records"))
+    global _bar_task
+    row = decode_trade(trades)
+    latest_trades.update(row)
+    await trades_buffer.put(row)
+    if STREAM_TRADE_BARS:
+        trade_bars.add(row[0], row[1], row[3], row[4])
+        if _bar_task is None or _bar_task.done():
+            _bar_task = asyncio.ensure_future(emit_trade_bars())
 
 def run_trades_stream(tickers):
     """
@@ -0,0 +1,150 @@
+import os
+from array import array
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# build minute bars from the trade stream instead of subscribing to bars for the same symbols
+STREAM_TRADE_BARS = os.environ.get('STREAM_TRADE_BARS', 'false').lower() == 'true'
+# milliseconds a minute stays open after its close for trades that arrive late
+GRACE_MS = float(os.environ.get('TRADE_BAR_GRACE_MS', 2000))
+
+MINUTE_NS = 60 * 10**9
+EMPTY = -1
+
+
+class TradeBarAggregator:
+    """
+    Builds minute bars, with vwap and trade_count, from a stream of trades.
+
+    The state is a fixed number of slots per symbol, held in flat typed arrays rather than one
+    object per bar: the minute being built, plus the ones still inside their grace window. A
+    trade is folded into the slot of its minute, whatever the order trades arrive in, until
+    flush() is called at or after the minute's close plus the grace window; later trades for
+    that minute are counted in ``late_trades`` and dropped. Each slot takes 80 bytes, so 10k
+    symbols with a grace window under a minute take about 1.6 MB.
+    """
+
+    def __init__(self, grace_ms=GRACE_MS):
+        """
+        Args:
+            grace_ms (float): Milliseconds after a minute's close during which its trades are still taken.
+        """
+        self.grace = int(grace_ms * 10**6)
+        self.slots = 2 + self.grace // MINUTE_NS
+        self._rows = {}
+        self._symbols = []
+        self._names = np.array([], dtype=object)
+        # per slot: start of the minute, times of its first and last trade and number of trades
+        self._start = array("q")
+        self._first = array("q")
+        self._last = array("q")
+        self._count = array("q")
+        # per slot: prices, volume and price * size summed for the vwap
+        self._open = array("d")
+        self._high = array("d")
+        self._low = array("d")
+        self._close = array("d")
+        self._volume = array("d")
+        self._pv = array("d")
+        self._evicted = []
+        # trades of minutes closed before this time (ns) are late
+        self._watermark = 0
+        self.late_trades = 0
+
+    def _register(self, symbol):
+        row = self._rows[symbol] = len(self._symbols)
+        self._symbols.append(symbol)
+        for field in (self._start, self._first, self._last, self._count):
+            field.extend([EMPTY] * self.slots)
+        for field in (self._open, self._high, self._low, self._close, self._volume, self._pv):
+            field.extend([0.0] * self.slots)
+        return row
+
+    def _bar(self, symbol, i):
+        volume = self._volume[i]
+        return (symbol, self._start[i], self._open[i], self._high[i], self._low[i], self._close[i],
+                volume, self._count[i], self._pv[i] / volume if volume else None)
+
+    def add(self, symbol, nanos, price, size):
+        """
+        Folds a trade into the bar of its minute.
+
+        Args:
+            symbol (str): The symbol traded.
+            nanos (int): The time of the trade in ns since the epoch.
+            price (float): The price of the trade.
+            size (float): The size of the trade.
+        """
+        row = self._rows.get(symbol)
+        if row is None:
+            row = self._register(symbol)
+        minute = nanos // MINUTE_NS
+        start = minute * MINUTE_NS
+        i = row * self.slots + minute % self.slots
+        current = self._start[i]
+        if current != start:
+            if current > start or start + MINUTE_NS + self.grace <= self._watermark:
+                self.late_trades += 1
+                return
+            if current != EMPTY:
+                # flush() was not called in time to free the slot: keep the bar for the next one
+                self._evicted.append(self._bar(symbol, i))
+            self._start[i] = start
+            self._first[i] = self._last[i] = nanos
+            self._open[i] = self._high[i] = self._low[i] = self._close[i] = price
+            self._volume[i] = size
+            self._pv[i] = price * size
+            self._count[i] = 1
+            return
+        if price > self._high[i]:
+            self._high[i] = price
+        elif price < self._low[i]:
+            self._low[i] = price
+        if nanos >= self._last[i]:
+            self._last[i] = nanos
+            self._close[i] = price
+        elif nanos < self._first[i]:
+            self._first[i] = nanos
+            self._open[i] = price
+        self._volume[i] += size
+        self._pv[i] += price * size
+        self._count[i] += 1
+
+    def flush(self, now):
+        """
+        Closes every minute whose grace window ended by ``now`` and returns its bar.
+
+        Args:
+            now (int): The current time in ns since the epoch.
+
+        Returns:
+            list: The closed bars as tuples ordered like BAR_COLUMNS, stamped with the start of
+                their minute in ns (see decoders.py).
+        """
+        self._watermark = max(self._watermark, now)
+        bars, self._evicted = self._evicted, []
+        if not self._symbols:
+            return bars
+        starts = np.frombuffer(self._start, dtype=np.int64)
+        due = np.flatnonzero((starts != EMPTY) & (starts + MINUTE_NS + self.grace <= now))
+        if len(due):
+            if len(self._names) != len(self._symbols):
+                self._names = np.array(self._symbols, dtype=object)
+            fields = [np.frombuffer(field, dtype=np.float64)[due]
+                      for field in (self._open, self._high, self._low, self._close, self._volume, self._pv)]
+            volume = fields[4]
+            vwap = np.divide(fields[5], volume, out=np.full(len(due), np.nan), where=volume > 0)
+            bars += zip(self._names[due // self.slots], starts[due].tolist(), *[f.tolist() for f in fields[:5]],
+                        np.frombuffer(self._count, dtype=np.int64)[due].tolist(), vwap.tolist())
+            starts[due] = EMPTY
+        # the arrays cannot grow while a view on them is alive
+        del starts
+        return bars
+
+    def flush_all(self):
+        """
+        Returns the bars of every minute still open, e.g. when the stream stops.
+        """
+        return self.flush(2**62)
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from dbconnect import connect_to_database
+from helpers import insert_into_database
+from decoders import rows_to_frame
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# a batch is written once it holds this many rows or its oldest row is this old
+FLUSH_ROWS = int(os.environ.get('STREAM_FLUSH_ROWS', 5000))
+FLUSH_INTERVAL = float(os.environ.get('STREAM_FLUSH_MS', 250)) / 1000
+# rows held in memory before put() starts blocking the stream handlers
+MAX_PENDING = int(os.environ.get('STREAM_MAX_PENDING', 10 * FLUSH_ROWS))
+
+# every buffer of the process, closed together by close_all when the stream stops
+_buffers = weakref.WeakSet()
+
+
+class WriteBuffer:
+    """
+    Collects rows from a stream handler and writes them to the database in batches.
+
+    Handlers only enqueue rows; a background task started on the first put() writes a batch
+    when it reaches ``max_rows`` or ``max_latency`` seconds after its first row, using a single
+    session for the lifetime of the buffer. The write runs in a worker thread so the websocket
+    keeps being read meanwhile. Once ``max_pending`` rows are waiting, put() blocks, which
+    slows down the websocket consumer instead of growing memory without bound.
+    """
+
+    def __init__(self, mapper, columns=None, max_rows=FLUSH_ROWS, max_latency=FLUSH_INTERVAL,
+                 max_pending=MAX_PENDING):
+        """
+        Args:
+            mapper: The SQLAlchemy mapper for the table to write to.
+            columns (tuple, optional): Column names of tuple rows produced by a decoder (see decoders.py).
+                If None, rows are dicts keyed by the mapper's attributes.
+            max_rows (int): Number of rows that triggers a write.
+            max_latency (float): Maximum number of seconds a row waits before being written.
+            max_pending (int): Number of queued rows at which put() starts blocking.
+        """
+        self.mapper = mapper
+        self.columns = columns
+        self.max_rows = max_rows
+        self.max_latency = max_latency
+        self.max_pending = max(max_pending, max_rows)
+        self._queue = None
+        self._ready = None
+        self._task = None
+        self._session = None
+        # True from the first row of a batch until the batch is written
+        self._busy = False
+        # a single worker keeps the batches ordered and the session on one thread at a time
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.rows_written = 0
+        self.batches_written = 0
+        _buffers.add(self)
+
+    def _start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def put(self, row):
+        """
+        Queues one row (a decoded tuple, or a dict keyed by the mapper's attributes) for writing.
+        """
+        if self._task is None or self._task.done():
+            self._start()
+        await self._queue.put(row)
+        if self._queue.qsize() >= self.max_rows:
+            self._ready.set()
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    def _write(self, batch):
+        if self._session is None:
+            self._session = connect_to_database()()
+        try:
+            data = rows_to_frame(batch, self.columns) if self.columns else batch
+            insert_into_database(self.mapper, data, self._session)
+            self.rows_written += len(batch)
+            self.batches_written += 1
+        except Exception:
+            logger.exception("Dropping a batch of {} {} rows".format(len(batch), self.mapper.__tablename__))
+
+    async def _run(self):
+        batch = []
+        written = None
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                self._busy = True
+                try:
+                    await asyncio.wait_for(self._ready.wait(), self.max_latency)
+                except asyncio.TimeoutError:
+                    pass
+                self._ready.clear()
+                batch += self._drain(self.max_rows - len(batch))
+                written, batch = self._executor.submit(self._write, batch), []
+                await asyncio.wrap_future(written)
+                self._busy = False
+        except asyncio.CancelledError:
+            # the event loop is shutting down: finish the batch in flight, then
+            # write the one being collected and whatever is still queued
+            if written is not None:
+                written.result()
+            if batch:
+                self._write(batch)
+            while not self._queue.empty():
+                self._write(self._drain(self.max_rows))
+            raise
+
+    async def flush(self):
+        """
+        Waits until every row queued so far is written, without waiting for ``max_latency``.
+        """
+        while self._task is not None and not self._task.done() and (self._busy or not self._queue.empty()):
+            self._ready.set()
+            await asyncio.sleep(0.01)
+
+    async def close(self):
+        """
+        Writes every queued row, stops the background task and releases the session.
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+async def close_all():
+    """
+    Closes every WriteBuffer of the process (see WriteBuffer.close). AlpacaDataStream awaits it
+    when its stream stops, so the rows still buffered are written before the loop goes away.
+    """
+    results = await asyncio.gather(*[buffer.close() for buffer in list(_buffers)], return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("Error closing a write buffer: {}".format(result))
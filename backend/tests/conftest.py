@@ -0,0 +1,15 @@
+import os
+import sys
+import pathlib
+import tempfile
+
+BACKEND = pathlib.Path(__file__).resolve().parents[1]
+
+# the tests run against TEST_DB_URL, or a throwaway SQLite file, never the DB_URL of .env
+os.environ["DB_URL"] = os.environ.get("TEST_DB_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+# and their tables go to a schema of their own, not the POSTGRES_SCHEMA of .env
+os.environ["POSTGRES_SCHEMA"] = os.environ.get("TEST_POSTGRES_SCHEMA", "test")
+
+# the modules are imported by their flat names, the way they import each other
+sys.path.append(str(BACKEND / "db"))
+sys.path.append(str(BACKEND / "controller"))
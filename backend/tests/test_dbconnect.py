@@ -0,0 +1,14 @@
+import sys
+
+
+def test_controller_and_helpers_share_one_engine():
+    import DataRetrievalController
+    import fetch
+    import helpers
+    import models
+
+    # a second copy of dbconnect would hold a second engine and pool for the same DB_URL
+    assert "db.dbconnect" not in sys.modules and "db.models" not in sys.modules
+    assert DataRetrievalController.connect_to_database(get_engine_only=True) is \
+        helpers.connect_to_database(get_engine_only=True)
+    assert fetch.Trades is models.Trades
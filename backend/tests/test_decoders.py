@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from decoders import decode_bar, decode_trade, decode_quote, rows_to_frame, BAR_COLUMNS
+from resample import BarResampler
+
+MINUTE_NS = 60 * 10 ** 9
+START = 1641220200 * 10 ** 9  # 2022-01-03 14:30 UTC
+
+
+def entity(**raw):
+    return SimpleNamespace(_raw=raw)
+
+
+def test_missing_optional_fields_decode_as_none():
+    bar = decode_bar(entity(symbol="AAA", timestamp=START, open=1.0, high=2.0, low=0.5, close=1.5,
+                            volume=100.0))
+    trade = decode_trade(entity(symbol="AAA", timestamp=START, exchange="V", price=1.0, size=5.0,
+                                tape="C", id=1))
+    quote = decode_quote(entity(symbol="AAA", timestamp=START, ask_exchange="V", ask_price=1.1,
+                                ask_size=1, bid_exchange="V", bid_price=1.0, bid_size=2))
+    assert bar[-2:] == (None, None)
+    assert trade[5] is None
+    assert quote[-1] is None
+    assert rows_to_frame([bar], BAR_COLUMNS)[["trade_count", "vwap"]].isna().all(axis=None)
+
+
+def test_resampler_folds_bars_without_vwap():
+    resampler = BarResampler()
+    full = decode_bar(entity(symbol="AAA", timestamp=START, open=1.0, high=2.0, low=0.5, close=1.5,
+                             volume=100.0, trade_count=10, vwap=1.2))
+    bare = decode_bar(entity(symbol="AAA", timestamp=START + MINUTE_NS, open=1.5, high=1.8, low=1.4,
+                             close=1.6, volume=50.0))
+    resampler.update(full)
+    hour, day = resampler.update(bare)
+    assert hour[2:] == (1.0, 2.0, 0.5, 1.6, 150.0, 10, 1.2 * 100.0 / 150.0)
+    assert day[2:] == hour[2:]
@@ -0,0 +1,41 @@
+import asyncio
+import pandas as pd
+import pytest
+
+import api
+import disk_cache
+from api import DataType, get_historic_data_base
+
+
+class FakePagedRest:
+    """
+    Stand-in for the paginated endpoint behind iterate_pages: one trade an hour, with the start
+    and end of every request included, like the API. Ids follow the timestamp, not the request.
+    """
+
+    def _get_historic_url(self, _type, symbol):
+        return symbol
+
+    async def _request(self, url, payload):
+        first, last = disk_cache.bounds(payload["start"], payload["end"])
+        stamps = pd.date_range(first.ceil("h"), last, freq="h")
+        if len(stamps):
+            yield {"trades": [{"t": t.isoformat().replace("+00:00", "Z"), "x": "V", "p": 100.0, "s": 10,
+                               "c": ["@"], "i": int(t.timestamp()) // 3600, "z": "C"} for t in stamps]}
+
+
+@pytest.mark.parametrize("start, end", [
+    ("2022-01-03", "2022-01-05"),
+    ("2022-01-31", "2022-02-01"),
+    ("2022-01-03T15:30:00Z", "2022-01-05T14:00:00Z"),
+    ("2022-01-03T10:00:00-05:00", "2022-01-04"),
+])
+def test_cached_rows_match_uncached(monkeypatch, tmp_path, start, end):
+    monkeypatch.setattr(api, "rest", FakePagedRest())
+    monkeypatch.setattr(disk_cache, "CACHE_DIR", str(tmp_path))
+    fetch = lambda cache: asyncio.run(get_historic_data_base(["AAA"], DataType.Trades, start, end,
+                                                             chunk="month", cache=cache))[0][1]
+    uncached = fetch(False)
+    # the first cached call fetches whole days and stores them, the second one reads them back
+    for cached in (fetch(True), fetch(True)):
+        pd.testing.assert_frame_equal(cached, uncached, check_freq=False)
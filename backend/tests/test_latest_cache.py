@@ -0,0 +1,56 @@
+import os
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+import latest_cache
+from DataRetrievalController import DataRetrievalController
+from dbconnect import connect_to_database
+from decoders import decode_trade, rows_to_frame, TRADE_COLUMNS
+from helpers import insert_into_database
+from models import Base, Stocks, Trades
+
+# the trades table uses Postgres types (ARRAY and a named enum)
+pytestmark = pytest.mark.skipif(make_url(os.environ["DB_URL"]).get_backend_name() != "postgresql",
+                                reason="needs a Postgres TEST_DB_URL")
+
+SYMBOL = "LCTEST"
+
+
+class FakeTrade:
+    def __init__(self, raw):
+        self._raw = raw
+
+
+@pytest.fixture
+def session():
+    engine = connect_to_database(get_engine_only=True)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE SCHEMA IF NOT EXISTS {}".format(os.environ["POSTGRES_SCHEMA"])))
+    Base.metadata.create_all(engine, tables=[Stocks.__table__, Trades.__table__])
+    ssn = connect_to_database()()
+    if ssn.get(Stocks, SYMBOL) is None:
+        ssn.add(Stocks(symbol=SYMBOL))
+        ssn.commit()
+    yield ssn
+    ssn.execute(Trades.__table__.delete().where(Trades.ticker == SYMBOL))
+    ssn.commit()
+    ssn.close()
+
+
+def test_cached_latest_trade_matches_database(monkeypatch, session):
+    monkeypatch.setattr(latest_cache, "_caches", {})
+    cache = latest_cache.register(Trades, TRADE_COLUMNS)
+    row = decode_trade(FakeTrade({"symbol": SYMBOL, "timestamp": 1641220200123456000, "exchange": "V",
+                                  "price": 101.5, "size": 10.0, "conditions": ["@", "I"], "tape": "C",
+                                  "id": 7}))
+    insert_into_database(Trades, rows_to_frame([row], TRADE_COLUMNS), session, raise_errors=True)
+    cache.update(row)
+
+    controller = DataRetrievalController()
+    stored = controller.get_latest_series(Trades, SYMBOL, use_cache=False)
+    cached = controller.get_latest_series(Trades, SYMBOL)
+    assert cached is cache.get(SYMBOL)
+    assert cached == stored
+    assert {key: type(value) for key, value in cached.items()} == \
+        {key: type(value) for key, value in stored.items()}
@@ -0,0 +1,38 @@
+import asyncio
+import os
+
+import write_buffer
+from AlpacaStream.AlpacaDataStream import AlpacaDataStream
+from decoders import TRADE_COLUMNS
+from models import Trades
+from write_buffer import WriteBuffer
+
+
+class FakeSession:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_stream_shutdown_writes_and_closes_buffers(monkeypatch):
+    session = FakeSession()
+    written = []
+    monkeypatch.setattr(write_buffer, "connect_to_database", lambda: lambda: session)
+    monkeypatch.setattr(write_buffer, "insert_into_database", lambda mapper, data, ssn: written.append(len(data)))
+    for name, value in (("APCA_API_KEY_ID", "key"), ("APCA_API_SECRET_KEY", "secret"),
+                        ("APCA_API_BASE_URL", "https://paper-api.alpaca.markets"), ("APCA_FEED", "iex")):
+        monkeypatch.setenv(name, os.environ.get(name) or value)
+    # the rows would wait a minute for the next write if nothing closed the buffer
+    buffer = WriteBuffer(Trades, TRADE_COLUMNS, max_latency=60)
+    stream = AlpacaDataStream()
+
+    async def receive_then_disconnect():
+        await buffer.put(("AAA", 1641220200123456000, "V", 101.5, 10.0, ["@"], "C", 1))
+        await buffer.put(("AAA", 1641220200223456000, "V", 101.6, 10.0, ["@"], "C", 2))
+
+    monkeypatch.setattr(stream, "_supervise", receive_then_disconnect)
+    monkeypatch.setattr(stream._conn._trading_ws, "_run_forever", lambda: asyncio.sleep(0))
+    asyncio.run(stream._run_forever())
+    assert sum(written) == 2
+    assert buffer.rows_written == 2 and session.closed